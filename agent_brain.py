@@ -17,6 +17,10 @@ def plan_workflow(query):
         month = 7
     context['month'] = month
 
+    # 指令中要求“流式”时强制分块加载 (大文件会自动进入流式模式)
+    if "流式" in query:
+        context['stream_mode'] = True
+
     # 2. 构建“长”工具链
     # 公共前置步骤：加载 -> 清洗 -> 特征工程 -> 关联分析 -> 模型推理
     common_prefix = [
@@ -36,6 +40,10 @@ def plan_workflow(query):
     if "注水" in query:
         context['task_name'] = "注水调配"
         context['target_file'] = f"{month}月+注水调配.csv"
+        # 指令中给出的目标总配注量，如 "注水调配 总量350方"；未给出时保持建议配注合计
+        budget = re.search(r'(?:总量|总配注|配注总量|预算)\D{0,3}?(\d+(?:\.\d+)?)\s*(?:方|m³|m3|立方)?', query)
+        if budget:
+            context['water_budget'] = float(budget.group(1))
         # 核心是 tool_water_algo
         workflow = common_prefix + ["tool_water_algo"] + common_suffix
 
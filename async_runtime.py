@@ -0,0 +1,99 @@
+# async_runtime.py
+"""
+工具链的异步运行时
+
+- 每个进程一个后台事件循环线程，Streamlit 脚本线程 / 命令行通过 submit() 把协程交给它执行，
+  脚本线程只负责轮询进度，不再被长时间阻塞
+- 工具可以提供 async def run_async(context) (异步 I/O、可立即取消的等待)；
+  只有同步 run() 的工具放到线程中执行
+- 每个步骤带超时；取消通过 threading.Event 协作完成：
+  线程里的步骤在 checkpoint() / runtime_config.pause() 处检查取消标记并抛出 StepCancelled
+"""
+import asyncio
+import contextvars
+import inspect
+import os
+import threading
+
+import instrumentation
+
+# 单步默认超时 (秒)，工具可在 META["timeout"] 中单独指定
+STEP_TIMEOUT = float(os.environ.get("PETRO_STEP_TIMEOUT", "300"))
+
+_cancel_event = contextvars.ContextVar("petro_cancel_event", default=None)
+_lock = threading.Lock()
+_loop = None
+_loop_pid = None
+
+
+class StepCancelled(Exception):
+    """步骤被取消 (用户提交了新的指令，或步骤超时)"""
+
+
+class StepTimeout(Exception):
+    """步骤执行超时"""
+
+
+# ==================================================
+# 协作式取消
+# ==================================================
+def current_event():
+    """当前步骤的取消标记 (不在步骤中执行时为 None)"""
+    return _cancel_event.get()
+
+
+def cancelled():
+    event = _cancel_event.get()
+    return event is not None and event.is_set()
+
+
+def checkpoint():
+    """长循环中定期调用：步骤已被取消时抛出 StepCancelled"""
+    if cancelled():
+        raise StepCancelled("步骤已取消")
+
+
+def wait(seconds):
+    """可被取消的阻塞等待 (线程中使用)"""
+    event = _cancel_event.get()
+    if event is None:
+        return
+    if event.wait(seconds):
+        raise StepCancelled("步骤已取消")
+
+
+# ==================================================
+# 事件循环
+# ==================================================
+def get_loop():
+    """进程级后台事件循环 (首次调用时启动；fork 出的子进程会重新创建)"""
+    global _loop, _loop_pid
+    with _lock:
+        if _loop is None or _loop_pid != os.getpid():
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="pipeline-loop", daemon=True).start()
+            _loop, _loop_pid = loop, os.getpid()
+        return _loop
+
+
+def submit(coro):
+    """把协程交给后台事件循环，返回 concurrent.futures.Future"""
+    return asyncio.run_coroutine_threadsafe(coro, get_loop())
+
+
+async def run_tool(tool_id, module, context, event, timeout=STEP_TIMEOUT):
+    """在取消标记 event 的作用域内执行工具 (带埋点)，超时或被取消时同时通知线程中的步骤停止"""
+    _cancel_event.set(event)  # 只影响当前任务；to_thread 会把它复制到工作线程
+    run_async = getattr(module, "run_async", None)
+    if run_async is not None and inspect.iscoroutinefunction(run_async):
+        coro = instrumentation.call_async(context, tool_id, "run", run_async(context))
+    else:
+        coro = asyncio.to_thread(instrumentation.call, context, tool_id, "run", module.run)
+    try:
+        return await asyncio.wait_for(coro, timeout)
+    except asyncio.TimeoutError:
+        event.set()
+        raise StepTimeout(f"执行超时 (> {timeout:g} s)") from None
+    except asyncio.CancelledError:
+        event.set()
+        raise
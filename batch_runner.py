@@ -0,0 +1,174 @@
+# batch_runner.py
+"""
+批量分析：一次作业跑完 data/ 下所有 月份 × 任务 的组合
+
+- 按文件名 (如 "7月+产量预测.csv") 枚举作业，逐个用 plan_workflow 规划工具链
+- 作业分发到进程池并行执行；执行前先在父进程生成各文件的 Arrow 列式副本，
+  所有 worker 以 memory map 读取同一份文件 (共享操作系统页缓存)，不重复解析 CSV
+- 报告不在 worker 里逐条提交，而是汇总后由父进程一次性写入审批日志
+- 输出目录包含每个作业的报告正文 (.md)、汇总 summary.json 与逐步耗时 timings.csv
+
+用法: python batch_runner.py [--workers 4] [--months 7 8] [--tasks 产量预测 风险预测] [--no-submit]
+"""
+import argparse
+import csv
+import datetime
+import json
+import os
+import re
+import sys
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+DATA_DIR = "data"
+OUTPUT_DIR = "batch_output"
+TASKS = ("产量预测", "风险预测", "注水调配")
+FILE_PATTERN = re.compile(r"^(\d{1,2})月\+(产量预测|风险预测|注水调配)\.(csv|xlsx|xls)$")
+# 报告由父进程批量提交，worker 中跳过审批推送步骤
+SKIPPED_TOOLS = ("tool_approval_flow",)
+
+
+def discover_jobs(data_dir=DATA_DIR, months=None, tasks=None):
+    """枚举数据目录下的 月份 × 任务 文件，返回按 (月份, 任务) 排序的作业列表"""
+    jobs = []
+    for name in os.listdir(data_dir):
+        match = FILE_PATTERN.match(name)
+        if not match:
+            continue
+        month, task = int(match.group(1)), match.group(2)
+        if (months and month not in months) or (tasks and task not in tasks):
+            continue
+        jobs.append({"file": name, "month": month, "task": task, "query": f"{month}月{task}"})
+    return sorted(jobs, key=lambda job: (job["month"], TASKS.index(job["task"])))
+
+
+def _init_worker(production):
+    import runtime_config
+    import storage
+    runtime_config.set_production_mode(production)
+    storage.init_db()
+
+
+def run_job(job, username="batch", batch_id=""):
+    """在 worker 进程中执行单个作业，返回可序列化的结果"""
+    from agent_brain import plan_workflow
+    import pipeline_executor
+    from tools import tool_approval_flow
+
+    t0 = time.perf_counter()
+    workflow, context = plan_workflow(job["query"])
+    context["target_file"] = job["file"]
+    context["username"] = username
+    workflow = [tool_id for tool_id in workflow if tool_id not in SKIPPED_TOOLS]
+    pipeline = pipeline_executor.PipelineRun(workflow, context)
+    pipeline.run_all()
+
+    result = dict(job, pid=os.getpid(), elapsed_ms=(time.perf_counter() - t0) * 1000,
+                  steps={s["tool"]: s["elapsed_ms"] for s in pipeline.steps if s["elapsed_ms"] is not None},
+                  status="failed" if pipeline.failed else "ok", error=str(pipeline.error or ""),
+                  summary=context.get("trend_summary") or context.get("risk_summary") or context.get("water_summary"),
+                  report_text=context.get("generated_report_content", ""), report=None)
+    if not pipeline.failed:
+        report_id = f"BATCH-{batch_id}-{job['month']:02d}-{TASKS.index(job['task'])}"
+        result["report"] = tool_approval_flow.build_report_record(context, report_id=report_id)
+    return result
+
+
+def _prewarm(jobs, data_dir):
+    """父进程先生成列式副本，worker 直接 memory map 读取"""
+    import data_ingest
+    for job in jobs:
+        try:
+            data_ingest.ingest(os.path.join(data_dir, job["file"]), job["task"])
+        except Exception as e:
+            print(f"⚠️ 列式副本生成失败 {job['file']}: {e}")
+
+
+def write_outputs(results, output_dir, batch_info):
+    os.makedirs(output_dir, exist_ok=True)
+    for r in results:
+        if r["report_text"]:
+            path = os.path.join(output_dir, f"{r['month']}月_{r['task']}_分析报告.md")
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(r["report_text"])
+
+    fields = ("file", "month", "task", "status", "error", "summary", "elapsed_ms", "pid")
+    jobs = [dict({k: r[k] for k in fields}, report_id=(r["report"] or {}).get("id")) for r in results]
+    summary = dict(batch_info, jobs=jobs)
+    with open(os.path.join(output_dir, "summary.json"), "w", encoding="utf-8") as f:
+        json.dump(summary, f, ensure_ascii=False, indent=4)
+
+    tools = sorted({tool for r in results for tool in r["steps"]})
+    with open(os.path.join(output_dir, "timings.csv"), "w", encoding="utf-8-sig", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["file", "month", "task", "status", "pid", "total_ms"] + tools)
+        for r in results:
+            writer.writerow([r["file"], r["month"], r["task"], r["status"], r["pid"], f"{r['elapsed_ms']:.1f}"]
+                            + [f"{r['steps'][t]:.1f}" if t in r["steps"] else "" for t in tools])
+
+
+def run_batch(jobs, workers=None, username="batch", output_dir=None, submit=True, production=True,
+              data_dir=DATA_DIR):
+    """并行执行全部作业并批量写出结果，返回 (结果列表, 输出目录)"""
+    # 带随机后缀：同一秒启动的两个批次报告 ID 不会重复 (重复提交会被报告日志拒绝)
+    batch_id = f"{datetime.datetime.now():%Y%m%d%H%M%S}-{uuid.uuid4().hex[:6]}"
+    output_dir = output_dir or os.path.join(OUTPUT_DIR, batch_id)
+    t0 = time.perf_counter()
+    _prewarm(jobs, data_dir)
+
+    results = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(production,)) as pool:
+        futures = {pool.submit(run_job, job, username, batch_id): job for job in jobs}
+        for future in as_completed(futures):
+            job = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                result = dict(job, pid=None, elapsed_ms=0.0, steps={}, status="failed", error=str(e),
+                              summary=None, report_text="", report=None)
+            results.append(result)
+            mark = "✅" if result["status"] == "ok" else "❌"
+            print(f"{mark} [{len(results)}/{len(jobs)}] {job['file']:<20} {result['elapsed_ms']:8.1f} ms "
+                  f"{result['error']}")
+    results.sort(key=lambda r: (r["month"], TASKS.index(r["task"])))
+
+    submitted = []
+    if submit:
+        import report_journal
+        submitted = report_journal.submit_reports([r["report"] for r in results if r["report"]])
+
+    batch_info = {"batch_id": batch_id, "workers": workers or os.cpu_count(), "submitted": len(submitted),
+                  "wall_ms": (time.perf_counter() - t0) * 1000}
+    write_outputs(results, output_dir, batch_info)
+    return results, output_dir
+
+
+def main():
+    parser = argparse.ArgumentParser(description="批量执行全部 月份 × 任务 分析")
+    parser.add_argument("--workers", type=int, default=None, help="进程数 (默认 CPU 核数)")
+    parser.add_argument("--months", type=int, nargs="*", help="只跑指定月份")
+    parser.add_argument("--tasks", nargs="*", choices=TASKS, help="只跑指定任务")
+    parser.add_argument("--user", default="batch", help="报告提交人")
+    parser.add_argument("--output", default=None, help=f"输出目录 (默认 {OUTPUT_DIR}/<批次号>)")
+    parser.add_argument("--no-submit", action="store_true", help="只生成报告文件，不提交审批")
+    parser.add_argument("--demo", action="store_true", help="使用演示模式 (保留演示性延时)")
+    args = parser.parse_args()
+
+    import storage
+    storage.init_db()
+
+    jobs = discover_jobs(months=args.months, tasks=args.tasks)
+    if not jobs:
+        print(f"{DATA_DIR}/ 下没有匹配的数据文件")
+        sys.exit(1)
+    print(f"共 {len(jobs)} 个作业")
+    results, output_dir = run_batch(jobs, workers=args.workers, username=args.user, output_dir=args.output,
+                                    submit=not args.no_submit, production=not args.demo)
+    failed = [r for r in results if r["status"] != "ok"]
+    print(f"\n完成 {len(results) - len(failed)}/{len(results)} | 输出目录: {output_dir}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
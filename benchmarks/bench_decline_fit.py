@@ -0,0 +1,76 @@
+# benchmarks/bench_decline_fit.py
+"""
+递减曲线拟合基准 (tool_trend_algo)
+
+按已知 Arps 参数生成带噪声的多井日产量 (指数 / 双曲 / 调和各占三分之一)，测量：
+- 冷拟合：全部井首次拟合
+- 全部命中缓存：数据未变化时重跑
+- 增量：只有 1% 的井数据变化
+并检查参数恢复精度 (b 误差 ≤ 0.2 的井占比、递减率相对误差中位数)。
+
+用法: python benchmarks/bench_decline_fit.py [--wells 10000] [--days 90] [--budget-ms 5000]
+超过 --budget-ms 时退出码为 1
+"""
+import argparse
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import numpy as np
+import pandas as pd
+
+from tools import tool_trend_algo as trend
+
+
+def synthetic(wells, days, seed=0):
+    rng = np.random.default_rng(seed)
+    well = np.repeat(np.arange(wells), days)
+    day = np.tile(np.arange(days), wells)
+    truth = {"b": rng.choice([0.0, 0.5, 1.0], wells), "qi": rng.uniform(20, 200, wells),
+             "di": rng.uniform(0.002, 0.03, wells)}
+    q = trend.arps_rate(truth["qi"][well], truth["di"][well], truth["b"][well], day)
+    q = q * np.exp(rng.normal(0, 0.03, len(q)))
+    frame = pd.DataFrame({"井号": well, "date": pd.Timestamp("2024-05-01") + pd.to_timedelta(day, "D"),
+                          "predicted_yield": q})
+    return frame, truth
+
+
+def timed(frame):
+    t0 = time.perf_counter()
+    _, params, refit = trend.fit_wells(frame, "井号", "predicted_yield")
+    return (time.perf_counter() - t0) * 1000, params, refit
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--wells", type=int, default=10000)
+    parser.add_argument("--days", type=int, default=90)
+    parser.add_argument("--budget-ms", type=float, default=5000)
+    args = parser.parse_args()
+
+    frame, truth = synthetic(args.wells, args.days)
+    print(f"{args.wells} 口井 × {args.days} 天 = {len(frame):,} 行")
+
+    cold_ms, params, refit = timed(frame)
+    print(f"冷拟合         {cold_ms:8.1f} ms  (拟合 {refit} 口)")
+    warm_ms, _, refit = timed(frame)
+    print(f"全部命中缓存   {warm_ms:8.1f} ms  (拟合 {refit} 口)")
+    changed = frame["井号"] < max(1, args.wells // 100)
+    frame.loc[changed, "predicted_yield"] *= 1.01
+    inc_ms, _, refit = timed(frame)
+    print(f"1% 井数据变化  {inc_ms:8.1f} ms  (拟合 {refit} 口)")
+
+    b_ok = np.mean(np.abs(params["b"] - truth["b"]) <= 0.2)
+    di_err = np.median(np.abs(params["di"] / truth["di"] - 1))
+    print(f"b 误差 ≤ 0.2 的井占比 {b_ok:.1%}，递减率相对误差中位数 {di_err:.2%}")
+
+    if cold_ms > args.budget_ms:
+        print(f"冷拟合超出预算 {args.budget_ms:g} ms")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+# benchmarks/bench_inference_batching.py
+"""
+推理服务微批基准
+
+模拟多个会话线程并发提交小批量的风险评分请求，对比：
+- 各线程直接做前向计算 (无服务)
+- 经 inference_service 跨会话合并成微批计算
+输出吞吐、每批平均合并的请求数以及请求延迟 P50 / P95 / P99。
+
+用法: python benchmarks/bench_inference_batching.py [--sessions 16] [--requests 200] [--rows 64]
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import numpy as np
+
+import inference_service
+from tools import tool_risk_algo as risk
+
+
+def _session(seed, requests, rows, call, latencies):
+    rng = np.random.default_rng(seed)
+    for _ in range(requests):
+        batch = np.column_stack([rng.normal(size=(rows, 3)), rng.uniform(0, 0.6, rows)])
+        t0 = time.perf_counter()
+        call(batch)
+        latencies.append((time.perf_counter() - t0) * 1000)
+
+
+def run_case(name, call, sessions, requests, rows):
+    latencies = []
+    threads = [threading.Thread(target=_session, args=(i, requests, rows, call, latencies))
+               for i in range(sessions)]
+    t0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - t0
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    print(f"{name:<12} 吞吐 {len(latencies) / elapsed:9.0f} 请求/s | "
+          f"P50 {p50:7.3f} | P95 {p95:7.3f} | P99 {p99:7.3f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sessions", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--rows", type=int, default=64)
+    args = parser.parse_args()
+    weights = risk.DEFAULT_WEIGHTS
+    print(f"{args.sessions} 个会话 × {args.requests} 个请求 × {args.rows} 行")
+
+    run_case("直接计算", lambda rows: risk._forward(weights, rows), args.sessions, args.requests, args.rows)
+    inference_service.reset()
+    run_case("微批服务", lambda rows: inference_service.infer("model_risk", "bench", weights, rows, risk._forward),
+             args.sessions, args.requests, args.rows)
+    s = inference_service.stats()["model_risk"]
+    print(f"微批服务 {s['inline']} 个请求在空闲时直接计算，其余共 {s['batches']} 批，"
+          f"平均每批合并 {s['requests_per_batch']:.1f} 个请求，前向计算合计 {s['compute_ms']:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
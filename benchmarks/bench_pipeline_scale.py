@@ -0,0 +1,262 @@
+# benchmarks/bench_pipeline_scale.py
+"""
+工具链规模基准：合成油田数据集 (10³ ~ 10⁸ 行)
+
+- 按仓库现有三种数据的列结构生成合成数据 (固定随机种子，分块写出，同一规模只生成一次)：
+  产量预测 date,predicted_yield / 风险预测 井号,预测风险类型,预测风险概率,... / 注水调配 井号,建议配注,预计增压,...
+- 每个 (规模, 任务) 在独立子进程中执行，内存峰值互不干扰：
+  首轮为冷启动 (删除列式副本，重新接入)，之后各轮取中位数 (数据 / 结果缓存已热)
+- 每个工具的 run() 与 view() 都执行；view() 在无界面 (bare) 模式下运行，只计算图表 / 表格等产物，
+  渲染缓存每轮清空，测的是真实的绘制耗时
+- 逐步耗时 / CPU / 峰值内存来自 instrumentation 埋点
+- --save 保存结果，--baseline 与历史结果对比：耗时超过基线 (1 + tolerance) 倍且绝对差值超过噪声下限时标记为回退，
+  存在回退时以非零状态退出
+
+用法: python benchmarks/bench_pipeline_scale.py [--sizes 1e3 1e4 1e5 1e6] [--tasks 产量预测] [--repeat 3]
+                                               [--save result.json] [--baseline result.json]
+10⁷ / 10⁸ 行需要显式指定 (单个文件分别约 0.2~0.5 / 2~5 GB，超过流式阈值的文件会自动按块聚合)。
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+DEFAULT_SIZES = (1_000, 10_000, 100_000, 1_000_000)
+DEFAULT_DATA_DIR = os.path.join(tempfile.gettempdir(), "petro-bench-data")
+GEN_CHUNK_ROWS = 1_000_000
+QUERIES = {
+    "产量预测": "分析7月产量趋势",
+    "风险预测": "扫描8月生产风险",
+    "注水调配": "生成7月注水调配方案",
+}
+FILE_NAMES = {
+    "产量预测": "7月+产量预测.csv",
+    "风险预测": "8月+风险预测.csv",
+    "注水调配": "7月+注水调配.csv",
+}
+RISK_TYPES = ("套损风险", "含水突升", "结蜡堵塞", "供液不足", "设备老化")
+RISK_ACTIONS = ("立即探伤", "找水堵水", "热洗清蜡", "调参降频", "计划检修")
+INJECTION_TYPES = ("增能注水", "维持现状", "控水稳油", "周期注水")
+PRIORITIES = ("高", "中", "低")
+
+
+# ==================================================
+# 合成数据
+# ==================================================
+def _production_chunk(rng, start, n):
+    import numpy as np
+    import pandas as pd
+    idx = np.arange(start, start + n)
+    day = idx % 31
+    dates = (np.datetime64("2024-07-01") + day.astype("timedelta64[D]")).astype(str)
+    yield_ = 105 - 0.25 * day + rng.normal(0, 3, n)
+    return pd.DataFrame({"date": dates, "predicted_yield": yield_.round(1)})
+
+
+def _risk_chunk(rng, start, n):
+    import numpy as np
+    import pandas as pd
+    kind = rng.integers(0, len(RISK_TYPES), n)
+    prob = np.clip(rng.beta(2, 5, n) * 100, 1, 99).astype(int)
+    day = rng.integers(1, 32, n)
+    return pd.DataFrame({
+        "井号": np.char.add("Oil-", np.char.zfill(np.arange(start, start + n).astype(str), 8)),
+        "预测风险类型": np.asarray(RISK_TYPES)[kind],
+        "预测风险概率": np.char.add(prob.astype(str), "%"),
+        "预测发生时间": np.char.add("2024-08-", np.char.zfill(day.astype(str), 2)),
+        "建议干预措施": np.asarray(RISK_ACTIONS)[kind],
+    })
+
+
+def _water_chunk(rng, start, n):
+    import numpy as np
+    import pandas as pd
+    return pd.DataFrame({
+        "井号": np.char.add("W-", np.char.zfill(np.arange(start, start + n).astype(str), 8)),
+        "建议配注": rng.integers(10, 61, n),
+        "预计增压": rng.uniform(0.1, 1.5, n).round(2),
+        "配注类型": np.asarray(INJECTION_TYPES)[rng.integers(0, len(INJECTION_TYPES), n)],
+        "执行优先级": np.asarray(PRIORITIES)[rng.integers(0, len(PRIORITIES), n)],
+    })
+
+
+GENERATORS = {"产量预测": _production_chunk, "风险预测": _risk_chunk, "注水调配": _water_chunk}
+
+
+def generate(task, rows, data_dir=DEFAULT_DATA_DIR, seed=0):
+    """生成 (或复用) 指定规模的合成数据文件，返回路径；同一 (任务, 规模, 种子) 的内容完全一致"""
+    import numpy as np
+    out_dir = os.path.join(data_dir, f"seed{seed}", str(rows))
+    path = os.path.join(out_dir, FILE_NAMES[task])
+    if os.path.exists(path):
+        return path
+    os.makedirs(out_dir, exist_ok=True)
+    rng = np.random.default_rng([seed, rows, list(GENERATORS).index(task)])
+    tmp_path = path + ".tmp"
+    for start in range(0, rows, GEN_CHUNK_ROWS):
+        chunk = GENERATORS[task](rng, start, min(GEN_CHUNK_ROWS, rows - start))
+        chunk.to_csv(tmp_path, mode="a" if start else "w", header=not start, index=False)
+    os.replace(tmp_path, path)
+    return path
+
+
+# ==================================================
+# 单个用例 (在子进程中执行)
+# ==================================================
+def run_pipeline(task, path):
+    """执行一次完整工具链 (run + 无界面 view)，返回 (总耗时 ms, step_metrics)"""
+    from agent_brain import plan_workflow
+    import instrumentation
+    import pipeline_executor
+    import render_cache
+
+    workflow, context = plan_workflow(QUERIES[task])
+    context["target_file"] = path   # 绝对路径，loader 直接读取
+    context["username"] = "benchmark"
+    t0 = time.perf_counter()
+    pipeline = pipeline_executor.PipelineRun(workflow, context)
+    pipeline.run_all()
+    if pipeline.failed:
+        raise RuntimeError(f"{task} 执行失败: {pipeline.error}")
+    render_cache.clear_cache()
+    for tool_id in workflow:
+        with instrumentation.measure(context, tool_id, "view"):
+            pipeline_executor.load_tool(tool_id).view(context)
+    return (time.perf_counter() - t0) * 1000, context["step_metrics"]
+
+
+def run_case(task, path, repeat):
+    import data_ingest
+    import instrumentation
+    shutil.rmtree(os.path.dirname(data_ingest.columnar_path(path)), ignore_errors=True)
+    runs = [run_pipeline(task, path) for _ in range(repeat)]
+    cold_total, cold_metrics = runs[0]
+    warm = runs[1:] or runs
+
+    steps = {}
+    for tool_id, phases in cold_metrics.items():
+        for phase, record in phases.items():
+            steps[f"{tool_id}.{phase}"] = {
+                "cold_ms": record["wall_ms"],
+                "warm_ms": statistics.median(m[tool_id][phase]["wall_ms"] for _, m in warm),
+                "cpu_ms": statistics.median(m[tool_id][phase]["cpu_ms"] for _, m in warm),
+                "peak_rss_delta_mb": record["peak_rss_delta_mb"],
+                "rows_out": record["rows_out"],
+            }
+    return {
+        "cold_ms": cold_total,
+        "warm_ms": statistics.median(total for total, _ in warm),
+        "peak_rss_mb": instrumentation.peak_rss_mb(),
+        "file_mb": os.path.getsize(path) / 1024 / 1024,
+        "steps": steps,
+    }
+
+
+def _worker(task, path, repeat):
+    # 报告写入隔离到临时目录 (需在导入 storage 之前设置)
+    workdir = tempfile.mkdtemp(prefix="petro-bench-")
+    os.environ["PETRO_DB_FILE"] = os.path.join(workdir, "petro.db")
+    os.environ["PETRO_REPORT_JOURNAL"] = os.path.join(workdir, "reports.journal.jsonl")
+    import logging
+    import runtime_config
+    import storage
+    logging.getLogger("streamlit").setLevel(logging.ERROR)
+    runtime_config.set_production_mode(True)
+    storage.init_db()
+    try:
+        print(json.dumps(run_case(task, path, repeat), ensure_ascii=False))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def measure(task, path, repeat):
+    """在独立子进程中执行用例，峰值内存只反映该用例"""
+    cmd = [sys.executable, os.path.abspath(__file__), "--worker", task, path, "--repeat", str(repeat)]
+    proc = subprocess.run(cmd, cwd=ROOT, capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else "子进程异常退出")
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+# ==================================================
+# 回退对比
+# ==================================================
+def compare(results, baseline, tolerance=0.2, floor_ms=5.0):
+    """返回回退列表 [(用例, 指标, 基线 ms, 当前 ms)]"""
+    regressions = []
+    for case, current in results.items():
+        base = baseline.get(case)
+        if not base:
+            continue
+        pairs = [("warm_ms", base["warm_ms"], current["warm_ms"])]
+        pairs += [(f"{step}.warm_ms", base["steps"][step]["warm_ms"], m["warm_ms"])
+                  for step, m in current["steps"].items() if step in base["steps"]]
+        for metric, before, after in pairs:
+            if after > before * (1 + tolerance) and after - before > floor_ms:
+                regressions.append((case, metric, before, after))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=float, nargs="*", default=DEFAULT_SIZES, help="数据行数 (可写 1e6)")
+    parser.add_argument("--tasks", nargs="*", choices=list(QUERIES), default=list(QUERIES))
+    parser.add_argument("--repeat", type=int, default=3, help="每个用例的执行轮数 (首轮为冷启动)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--data-dir", default=DEFAULT_DATA_DIR, help="合成数据目录 (可复用)")
+    parser.add_argument("--save", default=None, help="保存结果 JSON")
+    parser.add_argument("--baseline", default=None, help="对比的基线结果 JSON")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="允许的相对变慢比例")
+    parser.add_argument("--floor-ms", type=float, default=5.0, help="噪声下限 (ms)，小于该差值不计为回退")
+    parser.add_argument("--worker", nargs=2, metavar=("TASK", "PATH"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        _worker(args.worker[0], args.worker[1], args.repeat)
+        return
+
+    results = {}
+    for rows in (int(s) for s in args.sizes):
+        for task in args.tasks:
+            case = f"{task}@{rows}"
+            t0 = time.perf_counter()
+            path = generate(task, rows, args.data_dir, args.seed)
+            gen_s = time.perf_counter() - t0
+            result = measure(task, path, args.repeat)
+            results[case] = result
+            print(f"== {case:<16} 文件 {result['file_mb']:8.1f} MB (生成 {gen_s:5.1f} s) | "
+                  f"冷 {result['cold_ms']:9.1f} ms | 热 {result['warm_ms']:9.1f} ms | "
+                  f"峰值内存 {result['peak_rss_mb']:7.0f} MB")
+            for step, m in result["steps"].items():
+                print(f"   {step:<28} 冷 {m['cold_ms']:9.1f} | 热 {m['warm_ms']:9.1f} | CPU {m['cpu_ms']:9.1f} ms"
+                      f" | 内存增量 {m['peak_rss_delta_mb'] or 0:7.1f} MB")
+
+    meta = {"python": sys.version.split()[0], "seed": args.seed, "repeat": args.repeat,
+            "created": time.strftime("%Y-%m-%d %H:%M:%S")}
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump({"meta": meta, "results": results}, f, ensure_ascii=False, indent=2)
+        print(f"\n结果已保存: {args.save}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.tolerance, args.floor_ms)
+        if regressions:
+            print(f"\n⚠️ 发现 {len(regressions)} 处性能回退 (> {args.tolerance:.0%} 且 > {args.floor_ms:g} ms):")
+            for case, metric, before, after in regressions:
+                print(f"  - {case} {metric}: {before:.1f} -> {after:.1f} ms ({after / before - 1:+.0%})")
+            sys.exit(1)
+        print("\n未发现性能回退")
+
+
+if __name__ == "__main__":
+    main()
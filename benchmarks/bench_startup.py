@@ -0,0 +1,74 @@
+# benchmarks/bench_startup.py
+"""
+启动耗时基准：工具注册表 vs 逐个导入
+
+每轮都在新的子进程中测量 (冷进程)，对比：
+- 逐个 import 全部工具模块 (注册表之前的做法)
+- 注册表静态扫描 (discover + tool_meta)，即界面首屏需要的工作
+- 后台预热完成后再取全部工具模块的耗时 (用户进入分析页时的实际等待)
+
+用法: python benchmarks/bench_startup.py [--runs 5]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBES = {
+    "逐个导入全部工具": """
+import importlib, os, time
+t0 = time.perf_counter()
+for name in sorted(os.listdir("tools")):
+    if name.startswith("tool_") and name.endswith(".py"):
+        importlib.import_module("tools." + name[:-3])
+result = {"ms": (time.perf_counter() - t0) * 1000}
+""",
+    "注册表扫描 (首屏)": """
+import time
+t0 = time.perf_counter()
+import tool_registry
+meta = tool_registry.tool_meta()
+result = {"ms": (time.perf_counter() - t0) * 1000, "tools": len(meta), "invalid": len(tool_registry.invalid_tools())}
+""",
+    "预热后取全部模块": """
+import time
+import tool_registry
+tool_registry.preload(background=False)
+t0 = time.perf_counter()
+for tool_id in tool_registry.discover():
+    tool_registry.load(tool_id)
+result = {"ms": (time.perf_counter() - t0) * 1000, "preload_ms": tool_registry.preload_stats()["elapsed_ms"]}
+""",
+}
+
+
+def measure(code):
+    """在新的子进程中执行探针，返回其 result 字典"""
+    script = code + "\nimport json; print(json.dumps(result))\n"
+    out = subprocess.run([sys.executable, "-c", script], cwd=ROOT, capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5, help="每项测量的子进程数")
+    args = parser.parse_args()
+
+    print(f"每项 {args.runs} 个冷进程，取中位数\n")
+    for label, code in PROBES.items():
+        results = [measure(code) for _ in range(args.runs)]
+        line = f"{label:<16} {statistics.median(r['ms'] for r in results):9.1f} ms"
+        extra = {k: statistics.median(r[k] for r in results) for k in results[0] if k != "ms"}
+        if "preload_ms" in extra:
+            line += f"  (后台预热本身 {extra.pop('preload_ms'):.1f} ms)"
+        if extra:
+            line += "  " + json.dumps(extra, ensure_ascii=False)
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+# benchmarks/bench_task_latency.py
+"""
+各任务类型的端到端延时基准
+
+不启动界面，按 agent_brain 规划的工具链依次执行每个工具的 run()，
+分别统计首轮 (冷缓存) 与后续轮次 (热缓存) 的总耗时及逐步耗时。
+默认生产模式；加 --demo 可对比演示模式下的演示性延时。
+
+用法: python benchmarks/bench_task_latency.py [--runs 5] [--demo]
+"""
+import argparse
+import importlib
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+QUERIES = {
+    "产量预测": "分析7月产量趋势",
+    "风险预测": "扫描8月生产风险",
+    "注水调配": "生成7月注水调配方案",
+}
+
+
+def run_once(query):
+    """执行一次完整工具链，返回 (总耗时, {工具: 耗时})"""
+    from agent_brain import plan_workflow
+    workflow, context = plan_workflow(query)
+    context['username'] = "benchmark"
+    steps = {}
+    start = time.perf_counter()
+    for tool_id in workflow:
+        module = importlib.import_module(f"tools.{tool_id}")
+        t0 = time.perf_counter()
+        module.run(context)
+        steps[tool_id] = time.perf_counter() - t0
+    return time.perf_counter() - start, steps
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5, help="每个任务的执行轮数 (首轮为冷缓存)")
+    parser.add_argument("--demo", action="store_true", help="使用演示模式 (保留演示性延时)")
+    args = parser.parse_args()
+
+    # 报告写入隔离到临时目录，数据文件仍从仓库 data/ 读取
+    workdir = tempfile.mkdtemp(prefix="petro-bench-")
+    os.environ["PETRO_DB_FILE"] = os.path.join(workdir, "petro.db")
+    os.environ["PETRO_REPORT_JOURNAL"] = os.path.join(workdir, "reports.journal.jsonl")
+    os.chdir(ROOT)
+
+    import runtime_config
+    import storage
+    runtime_config.set_production_mode(not args.demo)
+    storage.init_db()
+
+    mode = "演示模式" if args.demo else "生产模式"
+    print(f"{mode} | 每个任务 {args.runs} 轮\n")
+    for task, query in QUERIES.items():
+        results = [run_once(query) for _ in range(args.runs)]
+        cold_total, cold_steps = results[0]
+        warm = results[1:] or results
+        warm_total = statistics.median(total for total, _ in warm)
+        print(f"== {task} ==  冷启动 {cold_total * 1000:8.1f} ms | 热缓存中位数 {warm_total * 1000:8.1f} ms")
+        for tool_id in cold_steps:
+            warm_step = statistics.median(steps[tool_id] for _, steps in warm)
+            print(f"   {tool_id:<24} 冷 {cold_steps[tool_id] * 1000:8.1f} ms | 热 {warm_step * 1000:8.1f} ms")
+        print()
+
+
+if __name__ == "__main__":
+    main()
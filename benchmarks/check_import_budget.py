@@ -0,0 +1,65 @@
+# benchmarks/check_import_budget.py
+"""
+冷启动导入预算检查 (超出预算时以非零状态退出，可接入 CI)
+
+- 应用入口 (登录 / 审批页) 不得加载任何重依赖，导入耗时不超过预算
+- 分析页工具全部预热后仍不得加载 matplotlib / graphviz (只在绘图时按需导入)
+耗时取多次冷进程的中位数；预算可用参数覆盖，机器较慢时适当放宽。
+
+用法: python benchmarks/check_import_budget.py [--runs 3] [--entry-ms 1000] [--tools-ms 2500]
+"""
+import argparse
+import os
+import statistics
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import import_profile
+
+ENTRY_PROBE, TOOLS_PROBE = list(import_profile.PROBES)
+# 探针 -> 不允许出现的重依赖
+FORBIDDEN = {
+    ENTRY_PROBE: import_profile.HEAVY_MODULES,
+    TOOLS_PROBE: ("matplotlib", "graphviz"),
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=3, help="每个探针的冷进程数")
+    parser.add_argument("--entry-ms", type=float, default=1000, help="应用入口导入耗时预算 (ms)")
+    parser.add_argument("--tools-ms", type=float, default=2500, help="分析页工具导入耗时预算 (ms)")
+    args = parser.parse_args()
+    budgets = {ENTRY_PROBE: args.entry_ms, TOOLS_PROBE: args.tools_ms}
+
+    failures = []
+    for name, statement in import_profile.PROBES.items():
+        reports = [import_profile.profile(statement) for _ in range(args.runs)]
+        broken = next((r for r in reports if not r["ok"]), None)
+        if broken:
+            failures.append(f"{name}: 导入失败 {broken['error']}")
+            continue
+        median_ms = statistics.median(r["import_ms"] for r in reports)
+        heavy = sorted({m for r in reports for m in r["heavy"]} & set(FORBIDDEN[name]))
+        ok = median_ms <= budgets[name] and not heavy
+        print(f"{'✅' if ok else '❌'} {name:<16} {median_ms:8.1f} ms / 预算 {budgets[name]:.0f} ms"
+              f"  重依赖: {', '.join(reports[0]['heavy']) or '无'}")
+        for p in reports[0]["packages"][:5]:
+            print(f"     {p['package']:<20} {p['self_ms']:8.1f} ms  ({p['modules']} 个模块)")
+        if median_ms > budgets[name]:
+            failures.append(f"{name}: 导入耗时 {median_ms:.1f} ms 超出预算 {budgets[name]:.0f} ms")
+        if heavy:
+            failures.append(f"{name}: 加载了不应出现的重依赖 {', '.join(heavy)}")
+
+    if failures:
+        print("\n冷启动预算检查未通过:")
+        for line in failures:
+            print(f"  - {line}")
+        sys.exit(1)
+    print("\n冷启动预算检查通过")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+# benchmarks/stress_report_writes.py
+"""
+报告写入的多进程压力测试
+
+多个进程同时提交报告、抢着审批 / 驳回同一批待办、并反复触发日志压缩，
+结束后校验：没有丢失的提交、每份报告最多被成功处理一次、日志视图与 SQLite 快照一致。
+
+用法: python benchmarks/stress_report_writes.py [--submitters 4] [--approvers 4] [--reports 200]
+"""
+import argparse
+import multiprocessing as mp
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def _submitter(worker_id, count):
+    import storage
+    import report_journal
+    storage.init_db()
+    ids = []
+    for n in range(count):
+        rid = f"STRESS-{worker_id}-{n}"
+        report_journal.submit_report({"id": rid, "submitter": f"user{worker_id}", "task_name": "压力测试"})
+        ids.append(rid)
+    return "submit", ids
+
+
+def _approver(worker_id, deadline):
+    import storage
+    import report_journal
+    storage.init_db()
+    rng = random.Random(worker_id)
+    wins, conflicts = [], 0
+    while time.time() < deadline:
+        pending = report_journal.list_reports(status="pending", limit=20)
+        if not pending:
+            time.sleep(0.01)
+            continue
+        report = rng.choice(pending)
+        action = rng.choice(("approved", "rejected"))
+        try:
+            if action == "approved":
+                report_journal.approve_report(report["id"], expected_version=report["version"])
+            else:
+                report_journal.reject_report(report["id"], feedback="stress", expected_version=report["version"])
+            wins.append((report["id"], action))
+        except report_journal.ReportConflictError:
+            conflicts += 1
+    return "approve", (wins, conflicts)
+
+
+def _compactor(deadline):
+    import storage
+    import report_journal
+    storage.init_db()
+    rounds = 0
+    while time.time() < deadline:
+        report_journal.compact()
+        rounds += 1
+        time.sleep(0.05)
+    return "compact", rounds
+
+
+def _dispatch(args):
+    kind, params = args
+    return {"submit": _submitter, "approve": _approver, "compact": _compactor}[kind](*params)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--submitters", type=int, default=4)
+    parser.add_argument("--approvers", type=int, default=4)
+    parser.add_argument("--reports", type=int, default=200, help="每个提交进程的报告数")
+    parser.add_argument("--seconds", type=float, default=5.0, help="审批 / 压缩进程运行时长")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="petro-stress-")
+    os.chdir(workdir)
+    os.environ["PETRO_DB_FILE"] = os.path.join(workdir, "petro.db")
+    os.environ["PETRO_REPORT_JOURNAL"] = os.path.join(workdir, "reports.journal.jsonl")
+
+    import storage
+    import report_journal
+    storage.init_db()
+
+    deadline = time.time() + args.seconds
+    jobs = [("submit", (w, args.reports)) for w in range(args.submitters)]
+    jobs += [("approve", (w, deadline)) for w in range(args.approvers)]
+    jobs += [("compact", (deadline,))]
+
+    start = time.perf_counter()
+    with mp.get_context("spawn").Pool(len(jobs)) as pool:
+        results = pool.map(_dispatch, jobs)
+    elapsed = time.perf_counter() - start
+
+    submitted, wins, conflicts, rounds = [], [], 0, 0
+    for kind, payload in results:
+        if kind == "submit":
+            submitted.extend(payload)
+        elif kind == "approve":
+            wins.extend(payload[0])
+            conflicts += payload[1]
+        else:
+            rounds = payload
+
+    report_journal.compact()
+    view = {r["id"]: r for r in report_journal.list_reports()}
+    snapshot = {r["id"]: r for r in storage.list_reports()}
+
+    errors = []
+    missing = set(submitted) - set(view)
+    if missing:
+        errors.append(f"丢失提交 {len(missing)} 条")
+    won_ids = [rid for rid, _ in wins]
+    if len(won_ids) != len(set(won_ids)):
+        errors.append(f"重复审批 {len(won_ids) - len(set(won_ids))} 次")
+    for rid, action in wins:
+        if view.get(rid, {}).get("status") != action:
+            errors.append(f"{rid} 状态应为 {action}，实际 {view.get(rid, {}).get('status')}")
+    processed = sum(1 for r in view.values() if r["status"] != "pending")
+    if processed != len(set(won_ids)):
+        errors.append(f"已处理 {processed} 条，但成功审批记录 {len(set(won_ids))} 条")
+    for rid, report in view.items():
+        snap = snapshot.get(rid)
+        if snap is None or (snap["status"], snap["version"]) != (report["status"], report["version"]):
+            errors.append(f"{rid} 视图与快照不一致")
+            break
+
+    print(f"目录: {workdir}")
+    print(f"提交 {len(submitted)} | 审批成功 {len(wins)} | 版本冲突 {conflicts} | 压缩 {rounds} 轮 | "
+          f"耗时 {elapsed:.2f}s")
+    if errors:
+        print("❌ 校验失败:")
+        for e in errors[:20]:
+            print("  -", e)
+        sys.exit(1)
+    print("✅ 校验通过")
+
+
+if __name__ == "__main__":
+    main()
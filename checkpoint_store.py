@@ -0,0 +1,215 @@
+# checkpoint_store.py
+"""
+工具链检查点：按工作流 ID 持久化每个已完成步骤的输出
+
+目录结构: checkpoints/<workflow_id>/
+- manifest.json：工具链、初始上下文、源文件指纹、已完成步骤 (状态 / 信息 / 输出的编码) 与已放行的 gate
+- DataFrame 输出写成 Arrow IPC 列式文件 (读取时 memory map)，ndarray 写成 .npy，其余输出编码进 JSON
+- 只保存工具在 OUTPUTS 中声明的字段；无法序列化的值 (回调函数、模块等) 不写入，
+  声明的输出存在无法序列化的值时该步骤不记检查点，恢复时重新执行
+- 源数据文件在检查点之后被修改，检查点作废
+"""
+import json
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+
+import tool_registry
+from safe_io import atomic_write_json
+
+CHECKPOINT_DIR = os.environ.get("PETRO_CHECKPOINT_DIR", "checkpoints")
+# 超过保留天数的检查点在创建新工作流时清理
+TTL_DAYS = float(os.environ.get("PETRO_CHECKPOINT_TTL_DAYS", "7"))
+# 初始上下文中需要持久化的字段 (其余由工具步骤产生)
+BASE_KEYS = ("month", "task_name", "target_file", "stream_mode", "username", "query", "water_budget")
+
+logger = logging.getLogger(__name__)
+_lock = threading.Lock()
+
+
+class Unserializable(Exception):
+    """输出中存在无法写入检查点的值"""
+
+
+def new_id():
+    return f"{time.strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8]}"
+
+
+def _dir(workflow_id):
+    # ID 可能来自 URL 参数，只允许字母数字与连字符
+    if not re.fullmatch(r"[0-9A-Za-z-]+", str(workflow_id)):
+        raise ValueError(f"非法的工作流 ID: {workflow_id!r}")
+    return os.path.join(CHECKPOINT_DIR, workflow_id)
+
+
+def _manifest_path(workflow_id):
+    return os.path.join(_dir(workflow_id), "manifest.json")
+
+
+def _source_fingerprint(context):
+    path = os.path.join("data", context.get("target_file", ""))
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [st.st_size, st.st_mtime_ns]
+
+
+# ==================================================
+# 编码
+# ==================================================
+def _encode(value, directory, stem):
+    """把输出值编码为 JSON 兼容结构，大对象写到旁路文件"""
+    import numpy as np
+    import pandas as pd
+    if isinstance(value, pd.DataFrame):
+        import data_ingest
+        if data_ingest.pa is None:
+            raise Unserializable("DataFrame 检查点需要 pyarrow")
+        name = f"{stem}.arrow"
+        data_ingest.write_columnar(value, os.path.join(directory, name))
+        return {"__frame__": name}
+    if isinstance(value, np.ndarray):
+        if value.dtype == object:
+            raise Unserializable(f"{stem}: object 数组")
+        name = f"{stem}.npy"
+        np.save(os.path.join(directory, name), value, allow_pickle=False)
+        return {"__array__": name}
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, dict):
+        if not all(isinstance(k, str) for k in value):
+            raise Unserializable(f"{stem}: 字典键不是字符串")
+        return {k: _encode(v, directory, f"{stem}.{k}") for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_encode(v, directory, f"{stem}.{i}") for i, v in enumerate(value)]
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    raise Unserializable(f"{stem}: 不支持的类型 {type(value).__name__}")
+
+
+def _decode(value, directory):
+    if isinstance(value, dict):
+        if set(value) == {"__frame__"}:
+            import data_ingest
+            return data_ingest.read_columnar(os.path.join(directory, value["__frame__"]))
+        if set(value) == {"__array__"}:
+            import numpy as np
+            return np.load(os.path.join(directory, value["__array__"]), allow_pickle=False)
+        return {k: _decode(v, directory) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_decode(v, directory) for v in value]
+    return value
+
+
+# ==================================================
+# 读写
+# ==================================================
+def _read(workflow_id):
+    try:
+        with open(_manifest_path(workflow_id), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def create(workflow_id, workflow, context):
+    """新工作流：写入初始清单 (只保存可 JSON 序列化的初始字段)"""
+    prune()
+    base = {k: context[k] for k in BASE_KEYS if k in context}
+    manifest = {"workflow_id": workflow_id, "workflow": list(workflow), "base_context": base,
+                "source": _source_fingerprint(context), "steps": {}, "released": [],
+                "created_at": time.time(), "updated_at": time.time()}
+    with _lock:
+        os.makedirs(_dir(workflow_id), exist_ok=True)
+        atomic_write_json(_manifest_path(workflow_id), manifest)
+
+
+def save_step(workflow_id, index, step, context):
+    """记录一个已完成步骤的输出；输出无法序列化时返回 False (该步骤恢复时重新执行)"""
+    tool_id = step["tool"]
+    outputs = (tool_registry.discover().get(tool_id) or {}).get("outputs")
+    if outputs is None:
+        return False
+    directory = _dir(workflow_id)
+    stem = f"{index:02d}_{tool_id}"
+    try:
+        encoded = {key: _encode(context[key], directory, f"{stem}.{key}") for key in outputs if key in context}
+        metrics = context.get("step_metrics", {}).get(tool_id)
+        record = {"tool": tool_id, "message": step["message"], "elapsed_ms": step["elapsed_ms"],
+                  "outputs": encoded, "metrics": _encode(metrics, directory, f"{stem}.metrics")}
+    except Unserializable as e:
+        logger.warning("%s 未记录检查点: %s", tool_id, e)
+        return False
+    with _lock:
+        manifest = _read(workflow_id)
+        if manifest is None:
+            return False
+        manifest["steps"][str(index)] = record
+        manifest["updated_at"] = time.time()
+        atomic_write_json(_manifest_path(workflow_id), manifest)
+    return True
+
+
+def mark_released(workflow_id, index):
+    with _lock:
+        manifest = _read(workflow_id)
+        if manifest is None or index in manifest["released"]:
+            return
+        manifest["released"].append(index)
+        manifest["updated_at"] = time.time()
+        atomic_write_json(_manifest_path(workflow_id), manifest)
+
+
+def load(workflow_id):
+    """
+    读取检查点，返回 {"workflow", "context", "steps": {下标: 记录}, "released"}。
+    不存在、工具链已变化或源数据已修改时返回 None。
+    """
+    manifest = _read(workflow_id)
+    if manifest is None:
+        return None
+    context = dict(manifest["base_context"])
+    if manifest["source"] != _source_fingerprint(context):
+        return None
+    directory = _dir(workflow_id)
+    steps = {}
+    try:
+        for key in sorted(manifest["steps"], key=int):
+            record = manifest["steps"][key]
+            index = int(key)
+            if index >= len(manifest["workflow"]) or manifest["workflow"][index] != record["tool"]:
+                return None
+            context.update(_decode(record["outputs"], directory))
+            if record.get("metrics"):
+                context.setdefault("step_metrics", {})[record["tool"]] = _decode(record["metrics"], directory)
+            steps[index] = record
+    except (OSError, ValueError) as e:
+        logger.warning("%s 检查点损坏，重新执行: %s", workflow_id, e)
+        return None
+    context["workflow_id"] = workflow_id
+    return {"workflow": manifest["workflow"], "context": context, "steps": steps,
+            "released": manifest["released"]}
+
+
+def owner(workflow_id):
+    manifest = _read(workflow_id)
+    return manifest["base_context"].get("username") if manifest else None
+
+
+def prune(ttl_days=TTL_DAYS):
+    """清理超过保留期的检查点"""
+    if not os.path.isdir(CHECKPOINT_DIR):
+        return
+    deadline = time.time() - ttl_days * 86400
+    for name in os.listdir(CHECKPOINT_DIR):
+        path = os.path.join(CHECKPOINT_DIR, name)
+        try:
+            if os.path.getmtime(os.path.join(path, "manifest.json")) < deadline:
+                shutil.rmtree(path, ignore_errors=True)
+        except OSError:
+            continue
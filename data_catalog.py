@@ -0,0 +1,131 @@
+# data_catalog.py
+"""
+进程级数据目录缓存
+
+同一进程内所有会话共享解析好的 DataFrame：
+- 缓存键为 (绝对路径, mtime, 文件大小)，文件被覆盖 / 修改后自动失效
+- LRU 淘汰，按 DataFrame 实际内存字节数设置总上限
+- 同一文件并发未命中时只解析一次 (single-flight)
+- 提供命中 / 未命中 / 淘汰计数
+"""
+import os
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+# 缓存总内存上限 (字节)，可用环境变量 PETRO_DATA_CACHE_MB 调整
+MAX_CACHE_BYTES = int(os.environ.get("PETRO_DATA_CACHE_MB", "512")) * 1024 * 1024
+
+_lock = threading.Lock()
+_entries = OrderedDict()   # path -> (stamp, df, nbytes)
+_loading = {}              # path -> Lock，防止同一文件被并发重复解析
+_stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+_total_bytes = 0
+
+
+def _stamp(path):
+    st = os.stat(path)
+    return st.st_mtime_ns, st.st_size
+
+
+def _frame_bytes(df):
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+def _drop(path, counter=None):
+    global _total_bytes
+    entry = _entries.pop(path, None)
+    if entry is not None:
+        _total_bytes -= entry[2]
+        if counter:
+            _stats[counter] += 1
+
+
+def _lookup(path, stamp):
+    """命中返回 DataFrame 并刷新 LRU 顺序；过期条目顺带清除"""
+    entry = _entries.get(path)
+    if entry is None:
+        return None
+    if entry[0] != stamp:
+        _drop(path, "invalidations")
+        return None
+    _entries.move_to_end(path)
+    return entry[1]
+
+
+def _store(path, stamp, df):
+    global _total_bytes
+    nbytes = _frame_bytes(df)
+    _drop(path)
+    if nbytes > MAX_CACHE_BYTES:
+        # 单个文件超过上限时不缓存，避免把其它条目全部挤出
+        return
+    _entries[path] = (stamp, df, nbytes)
+    _total_bytes += nbytes
+    while _total_bytes > MAX_CACHE_BYTES and _entries:
+        oldest = next(iter(_entries))
+        _drop(oldest, "evictions")
+
+
+def load_frame(path, loader=None):
+    """
+    读取数据文件 (默认 pd.read_csv)，命中缓存时不再解析。
+    返回浅拷贝：调用方可以增删 / 替换列，但不要原地修改单元格的值。
+    """
+    loader = loader or pd.read_csv
+    path = os.path.abspath(path)
+    stamp = _stamp(path)
+
+    with _lock:
+        df = _lookup(path, stamp)
+        if df is not None:
+            _stats["hits"] += 1
+            return df.copy(deep=False)
+        path_lock = _loading.setdefault(path, threading.Lock())
+
+    with path_lock:
+        # 等锁期间可能已被其它线程加载完成
+        with _lock:
+            df = _lookup(path, stamp)
+            if df is not None:
+                _stats["hits"] += 1
+                return df.copy(deep=False)
+            _stats["misses"] += 1
+        df = loader(path)
+        with _lock:
+            _store(path, stamp, df)
+            _loading.pop(path, None)
+    return df.copy(deep=False)
+
+
+def is_cached(path):
+    """文件当前是否在缓存中且未过期"""
+    path = os.path.abspath(path)
+    try:
+        stamp = _stamp(path)
+    except FileNotFoundError:
+        return False
+    with _lock:
+        entry = _entries.get(path)
+        return entry is not None and entry[0] == stamp
+
+
+def cache_stats():
+    """返回缓存统计 (命中率、条目数、占用字节等)"""
+    with _lock:
+        lookups = _stats["hits"] + _stats["misses"]
+        return {
+            **_stats,
+            "entries": len(_entries),
+            "bytes": _total_bytes,
+            "max_bytes": MAX_CACHE_BYTES,
+            "hit_rate": _stats["hits"] / lookups if lookups else 0.0,
+        }
+
+
+def clear_cache():
+    global _total_bytes
+    with _lock:
+        _entries.clear()
+        _total_bytes = 0
@@ -0,0 +1,174 @@
+# data_ingest.py
+"""
+列式数据接入：CSV / XLSX -> 带类型的 Arrow 列式文件
+
+- 每种任务 (产量预测 / 风险预测 / 注水调配) 声明一份列类型 schema，类型转换只在接入时做一次
+- 转换结果写成未压缩的 Arrow IPC 文件，读取时 memory_map 零拷贝加载
+- 未安装 pyarrow 时回退为 CSV 解析 + 同样的类型转换
+"""
+import logging
+import os
+import tempfile
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc  # noqa: F401
+except ImportError:
+    pa = None
+
+UPLOAD_DIR = os.path.join("data", "uploads")
+# 每个 record batch 的行数上限，流式读取时按 batch 切片
+BATCH_ROWS = 200_000
+
+# 列类型转换规则变化时加一，旧规则生成的列式副本不再复用
+SCHEMA_VERSION = 2
+
+logger = logging.getLogger(__name__)
+
+# 列类型声明：datetime / float / percent(百分数 '88%' 或 88 -> 0.88) / category / string
+TASK_SCHEMAS = {
+    "产量预测": {
+        "date": "datetime",
+        "predicted_yield": "float",
+    },
+    "风险预测": {
+        "井号": "string",
+        "预测风险类型": "category",
+        "预测风险概率": "percent",
+        "预测发生时间": "datetime",
+        "建议干预措施": "string",
+    },
+    "注水调配": {
+        "井号": "string",
+        "建议配注": "float",
+        "预计增压": "float",
+        "配注类型": "category",
+        "执行优先级": "category",
+    },
+}
+
+
+def task_from_filename(file_name):
+    """从 '7月+产量预测.csv' 这样的文件名解析任务类型"""
+    stem = os.path.splitext(os.path.basename(file_name))[0]
+    task = stem.split("+", 1)[-1]
+    return task if task in TASK_SCHEMAS else None
+
+
+def _to_percent(series):
+    # 声明为 percent 的列一律按百分数解析再除以 100，不按数值范围猜测：
+    # '0.5%' 是 0.005，且流式分块时每块的换算方式一致
+    if pd.api.types.is_numeric_dtype(series):
+        values = series.astype("float64")
+    else:
+        text = series.astype("string").str.strip()
+        values = pd.to_numeric(text.str.rstrip("%"), errors="coerce").astype("float64")
+    return values / 100
+
+
+def apply_schema(df, task, columns=None):
+    """按任务 schema 转换列类型，未声明的列保持原样；columns 指定时只转换其中的列"""
+    schema = TASK_SCHEMAS.get(task)
+    if not schema:
+        return df
+    df = df.copy(deep=False)
+    for col, kind in schema.items():
+        if col not in df.columns or (columns is not None and col not in columns):
+            continue
+        if kind == "datetime":
+            if not pd.api.types.is_datetime64_any_dtype(df[col]):
+                df[col] = pd.to_datetime(df[col], errors="coerce")
+        elif kind == "float":
+            df[col] = pd.to_numeric(df[col], errors="coerce").astype("float64")
+        elif kind == "percent":
+            df[col] = _to_percent(df[col])
+        elif kind == "category":
+            df[col] = df[col].astype("category")
+        elif kind == "string":
+            df[col] = df[col].astype("string")
+    return df
+
+
+def read_source(path):
+    """读取原始 CSV / XLSX 文件"""
+    if path.lower().endswith((".xlsx", ".xls")):
+        return pd.read_excel(path)
+    return pd.read_csv(path)
+
+
+def columnar_path(src_path):
+    stem = os.path.splitext(os.path.basename(src_path))[0]
+    return os.path.join(os.path.dirname(src_path) or ".", ".columnar", f"{stem}.v{SCHEMA_VERSION}.arrow")
+
+
+def columnar_fresh(src_path, arrow_path):
+    if not os.path.exists(arrow_path):
+        return False
+    return os.stat(arrow_path).st_mtime_ns >= os.stat(src_path).st_mtime_ns
+
+
+def write_columnar(df, arrow_path):
+    """
+    写出未压缩的 Arrow IPC 文件 (先写临时文件再原子替换)。
+    临时文件名唯一，同一源文件被多个会话 / 预热进程同时接入时不会互相覆盖写到一半的文件。
+    """
+    directory = os.path.dirname(arrow_path)
+    os.makedirs(directory, exist_ok=True)
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    fd, tmp_path = tempfile.mkstemp(prefix=".tmp-", suffix=".arrow", dir=directory)
+    os.close(fd)
+    try:
+        with pa.OSFile(tmp_path, "wb") as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table, max_chunksize=BATCH_ROWS)
+        os.replace(tmp_path, arrow_path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    return arrow_path
+
+
+def read_columnar(arrow_path):
+    """memory_map 方式读取 Arrow 文件，数值列无需解析直接映射 (映射随 DataFrame 释放)"""
+    source = pa.memory_map(arrow_path, "r")
+    table = pa.ipc.open_file(source).read_all()
+    return table.to_pandas(split_blocks=True, self_destruct=True)
+
+
+def ingest(src_path, task=None):
+    """
+    接入一个源文件：按 schema 转类型并生成列式副本，返回列式文件路径。
+    未安装 pyarrow 时返回 None。
+    """
+    if pa is None:
+        return None
+    task = task or task_from_filename(src_path)
+    arrow_path = columnar_path(src_path)
+    if not columnar_fresh(src_path, arrow_path):
+        write_columnar(apply_schema(read_source(src_path), task), arrow_path)
+    return arrow_path
+
+
+def load_typed(src_path, task=None):
+    """读取带类型的数据：优先列式副本，CSV 解析作为回退"""
+    task = task or task_from_filename(src_path)
+    if pa is not None:
+        try:
+            return read_columnar(ingest(src_path, task))
+        except (OSError, pa.ArrowException) as e:
+            logger.warning("列式转换失败，回退 CSV: %s", e)
+    return apply_schema(read_source(src_path), task)
+
+
+def ingest_upload(uploaded_file, task, upload_dir=UPLOAD_DIR):
+    """接入页面上传的 CSV / XLSX：落盘后走同样的列式转换，返回带类型的 DataFrame"""
+    os.makedirs(upload_dir, exist_ok=True)
+    src_path = os.path.join(upload_dir, os.path.basename(uploaded_file.name))
+    with open(src_path, "wb") as f:
+        f.write(uploaded_file.getbuffer())
+    return load_typed(src_path, task)
@@ -0,0 +1,154 @@
+# data_stream.py
+"""
+大文件流式加载：按固定行数分块读取，只保留分块聚合结果
+
+- 有新鲜的 Arrow 列式副本时按 record batch 从 memory map 切片读取，否则 read_csv(chunksize)
+- 每种任务有一组增量聚合器 (产量: 日均/极值；风险: 类型计数/Top-K；注水: 合计/分优先级)
+- 聚合状态大小只与天数 / 井数 / K 有关，与总行数无关，峰值内存≈一个分块
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+import async_runtime
+import data_ingest
+
+CHUNK_ROWS = int(os.environ.get("PETRO_CHUNK_ROWS", "200000"))
+# 超过该大小的文件自动走流式模式
+STREAM_THRESHOLD_BYTES = int(os.environ.get("PETRO_STREAM_THRESHOLD_MB", "256")) * 1024 * 1024
+TOP_K = 50
+HIGH_RISK_THRESHOLD = 0.6
+
+
+def should_stream(path):
+    return os.path.getsize(path) >= STREAM_THRESHOLD_BYTES
+
+
+def iter_chunks(path, task=None, chunk_rows=CHUNK_ROWS):
+    """按 chunk_rows 行迭代带类型的数据分块"""
+    task = task or data_ingest.task_from_filename(path)
+    arrow_path = data_ingest.columnar_path(path)
+    if data_ingest.pa is not None and data_ingest.columnar_fresh(path, arrow_path):
+        pa = data_ingest.pa
+        reader = pa.ipc.open_file(pa.memory_map(arrow_path, "r"))
+        for i in range(reader.num_record_batches):
+            batch = reader.get_batch(i)
+            for offset in range(0, batch.num_rows, chunk_rows):
+                yield batch.slice(offset, chunk_rows).to_pandas()
+        return
+    if path.lower().endswith((".xlsx", ".xls")):
+        # Excel 无法流式解析，整表读入后再切块
+        df = data_ingest.apply_schema(data_ingest.read_source(path), task)
+        for offset in range(0, len(df), chunk_rows):
+            yield df.iloc[offset:offset + chunk_rows]
+        return
+    for chunk in pd.read_csv(path, chunksize=chunk_rows):
+        yield data_ingest.apply_schema(chunk, task)
+
+
+# ==================================================
+# 产量预测：极值 + 按日汇总 (供趋势图使用)
+# ==================================================
+def _trend_init():
+    return {"min": np.inf, "max": -np.inf, "sum": 0.0, "daily": None}
+
+
+def _trend_update(acc, chunk):
+    values = chunk["predicted_yield"]
+    acc["min"] = min(acc["min"], values.min())
+    acc["max"] = max(acc["max"], values.max())
+    acc["sum"] += float(values.sum())
+    if "date" in chunk.columns:
+        daily = values.groupby(chunk["date"].dt.floor("D")).agg(["sum", "count"])
+        acc["daily"] = daily if acc["daily"] is None else acc["daily"].add(daily, fill_value=0)
+
+
+def _trend_finalize(acc, rows):
+    daily = acc.pop("daily")
+    if daily is not None:
+        frame = pd.DataFrame({"date": daily.index, "predicted_yield": (daily["sum"] / daily["count"]).values})
+    else:
+        frame = pd.DataFrame(columns=["date", "predicted_yield"])
+    acc["mean"] = acc["sum"] / rows if rows else np.nan
+    return frame
+
+
+# ==================================================
+# 风险预测：类型计数 + 高风险数 + Top-K
+# ==================================================
+def _risk_init():
+    return {"type_counts": pd.Series(dtype="int64"), "high_risk": 0, "top": None}
+
+
+def _risk_update(acc, chunk):
+    if "预测风险类型" in chunk.columns:
+        counts = chunk["预测风险类型"].value_counts()
+        acc["type_counts"] = acc["type_counts"].add(counts.astype("int64"), fill_value=0)
+    if "预测风险概率" in chunk.columns:
+        prob = chunk["预测风险概率"]
+        acc["high_risk"] += int((prob > HIGH_RISK_THRESHOLD).sum())
+        top = chunk.nlargest(TOP_K, "预测风险概率")
+        acc["top"] = top if acc["top"] is None else pd.concat([acc["top"], top]).nlargest(TOP_K, "预测风险概率")
+
+
+def _risk_finalize(acc, rows):
+    acc["type_counts"] = acc["type_counts"].astype("int64").sort_values(ascending=False)
+    top = acc.pop("top")
+    return top.reset_index(drop=True) if top is not None else pd.DataFrame()
+
+
+# ==================================================
+# 注水调配：配注合计 + 分优先级合计 + 涉及井数
+# ==================================================
+def _water_init():
+    return {"target_col": None, "total": 0.0, "by_priority": pd.Series(dtype="float64"), "wells": set(), "head": None}
+
+
+def _water_update(acc, chunk):
+    if acc["target_col"] is None:
+        acc["target_col"] = next((c for c in ("调整量", "建议配注") if c in chunk.columns), "")
+        acc["head"] = chunk.head(1000)
+    col = acc["target_col"]
+    if col:
+        acc["total"] += float(chunk[col].sum())
+        if "执行优先级" in chunk.columns:
+            by_priority = chunk[col].groupby(chunk["执行优先级"], observed=True).sum()
+            acc["by_priority"] = acc["by_priority"].add(by_priority, fill_value=0)
+    if "井号" in chunk.columns:
+        acc["wells"].update(chunk["井号"].unique())
+
+
+def _water_finalize(acc, rows):
+    acc["well_count"] = len(acc.pop("wells"))
+    head = acc.pop("head")
+    return head if head is not None else pd.DataFrame()
+
+
+AGGREGATORS = {
+    "产量预测": (_trend_init, _trend_update, _trend_finalize),
+    "风险预测": (_risk_init, _risk_update, _risk_finalize),
+    "注水调配": (_water_init, _water_update, _water_finalize),
+}
+
+
+def aggregate(path, task=None, chunk_rows=CHUNK_ROWS):
+    """
+    流式遍历文件并计算任务聚合结果。
+    返回 (preview, stats)：preview 是有界大小的 DataFrame (日均曲线 / Top-K / 前 1000 行)，
+    stats 包含行数、分块数、最大分块内存以及任务相关的汇总值。
+    """
+    task = task or data_ingest.task_from_filename(path)
+    init, update, finalize = AGGREGATORS.get(task, (dict, lambda acc, chunk: None, lambda acc, rows: pd.DataFrame()))
+    acc = init()
+    rows = chunks = peak_chunk_bytes = 0
+    for chunk in iter_chunks(path, task, chunk_rows):
+        async_runtime.checkpoint()  # 每块检查一次：用户提交新指令后尽快停止扫描
+        update(acc, chunk)
+        rows += len(chunk)
+        chunks += 1
+        peak_chunk_bytes = max(peak_chunk_bytes, int(chunk.memory_usage(deep=True).sum()))
+    preview = finalize(acc, rows)
+    stats = {"task": task, "rows": rows, "chunks": chunks, "chunk_rows": chunk_rows,
+             "peak_chunk_bytes": peak_chunk_bytes, **acc}
+    return preview, stats
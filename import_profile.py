@@ -0,0 +1,75 @@
+# import_profile.py
+"""
+冷启动导入耗时分析
+
+在全新的子进程中以 `python -X importtime` 执行导入语句，解析 stderr 中的逐模块耗时并按顶层包汇总。
+用于诊断页展示与 benchmarks/check_import_budget.py 的预算检查。
+"""
+import os
+import re
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# 只应在分析路径上加载的重依赖
+HEAVY_MODULES = ("numpy", "pandas", "matplotlib", "pyarrow", "graphviz")
+
+# 诊断页 / 预算检查使用的探针：名称 -> 导入语句
+PROBES = {
+    "应用入口 (登录 / 审批页)": "import main",
+    "分析页工具 (全部预热)": "import tool_registry; [tool_registry.load(t) for t in tool_registry.discover()]",
+}
+
+_LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def parse_importtime(text):
+    """解析 -X importtime 输出，返回 [{module, self_us, cumulative_us, depth}]"""
+    entries = []
+    for line in text.splitlines():
+        match = _LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, module = match.groups()
+            entries.append({"module": module, "self_us": int(self_us), "cumulative_us": int(cumulative_us),
+                            "depth": (len(indent) - 1) // 2})
+    return entries
+
+
+def summarize(entries, top=15):
+    """按顶层包汇总自身耗时，返回耗时最高的若干个包 [{package, self_ms, modules}]"""
+    packages = {}
+    for e in entries:
+        package = e["module"].split(".")[0]
+        item = packages.setdefault(package, {"package": package, "self_ms": 0.0, "modules": 0})
+        item["self_ms"] += e["self_us"] / 1000
+        item["modules"] += 1
+    return sorted(packages.values(), key=lambda p: -p["self_ms"])[:top]
+
+
+def profile(statement, python=sys.executable, cwd=ROOT, timeout=120):
+    """在新进程中执行导入语句，返回耗时报告"""
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE="1")
+    t0 = time.perf_counter()
+    proc = subprocess.run([python, "-X", "importtime", "-c", statement], cwd=cwd, env=env,
+                          capture_output=True, text=True, timeout=timeout)
+    wall_ms = (time.perf_counter() - t0) * 1000
+    entries = parse_importtime(proc.stderr)
+    loaded = {e["module"].split(".")[0] for e in entries}
+    return {
+        "statement": statement,
+        "ok": proc.returncode == 0,
+        "error": proc.stderr.strip().splitlines()[-1] if proc.returncode else "",
+        "wall_ms": wall_ms,
+        # 顶层 (depth 0) 条目的累计耗时之和即全部导入耗时
+        "import_ms": sum(e["cumulative_us"] for e in entries if e["depth"] == 0) / 1000,
+        "modules": len(entries),
+        "heavy": [m for m in HEAVY_MODULES if m in loaded],
+        "packages": summarize(entries),
+    }
+
+
+def loaded_heavy():
+    """当前进程中已经加载的重依赖"""
+    return [m for m in HEAVY_MODULES if m in sys.modules]
@@ -0,0 +1,205 @@
+# inference_service.py
+"""
+进程内 CPU 推理服务：跨会话微批处理
+
+- 各会话的工具步骤 (线程中执行) 调用 infer() 提交一批输入行，得到对应的输出行
+- 后台工作线程取到第一个请求后，最多再等 MAX_WAIT_MS 收集其它会话的请求；
+  队列中的请求都已收进本批时 (排队的提交方都在阻塞等结果) 立即开始计算，
+  按 (模型, 权重版本) 分组，把输入行拼接后做一次向量化前向计算，再按行数切回各请求
+- 服务空闲 (没有未完成的请求) 时直接在提交方线程计算，单会话没有排队和线程切换的开销；
+  这类请求不进队列，也不计入收集批次时等待的请求数
+- 等待结果有超时 (默认与工具步骤超时相同)，工作线程意外退出时下一次提交会重新启动它
+- 不同用户的专属权重是不同的 batch_key，不会混在一起计算
+- 记录每个请求从提交到拿到结果的真实延迟，按模型给出 P50 / P95 / P99
+"""
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+import numpy as np
+
+import async_runtime
+
+MAX_WAIT_MS = float(os.environ.get("PETRO_INFER_WAIT_MS", "2"))
+MAX_BATCH_ROWS = int(os.environ.get("PETRO_INFER_BATCH_ROWS", "262144"))
+# 每个模型保留最近多少个请求的延迟用于计算分位数
+LATENCY_WINDOW = 4096
+# infer() 默认等待结果的上限 (秒)
+REQUEST_TIMEOUT = async_runtime.STEP_TIMEOUT
+
+_queue = queue.Queue()
+_lock = threading.Lock()
+_worker = None
+_worker_pid = None
+_outstanding = 0   # 已提交、尚未返回结果的请求数 (含在提交方线程直接计算的)
+_queued = 0        # 其中进入队列、由工作线程计算的请求数
+_stats = {}   # 模型key -> 统计
+
+
+class _Request:
+    __slots__ = ("model_key", "batch_key", "params", "rows", "forward", "future", "submitted")
+
+    def __init__(self, model_key, batch_key, params, rows, forward):
+        self.model_key = model_key
+        self.batch_key = batch_key
+        self.params = params
+        self.rows = rows
+        self.forward = forward
+        self.future = Future()
+        self.submitted = time.perf_counter()
+
+
+# ==================================================
+# 提交
+# ==================================================
+def submit(model_key, batch_key, params, rows, forward):
+    """
+    提交一次推理，返回 concurrent.futures.Future。
+    rows: 二维输入 (行数 × 特征)；forward(params, rows) -> 与输入同行数的输出；
+    batch_key 相同的请求共享同一份 params (通常是模型版本目录)，可以合并计算。
+    """
+    global _outstanding, _queued
+    _ensure_worker()
+    request = _Request(model_key, batch_key, params, np.asarray(rows, dtype=np.float64), forward)
+    with _lock:
+        idle = _outstanding == 0
+        _outstanding += 1
+        if not idle:
+            # 计数与入队在同一把锁内完成，工作线程看到的排队数不会多于队列中实际的请求
+            _queued += 1
+            _queue.put(request)
+    if idle:
+        _run_group([request])
+    return request.future
+
+
+def infer(model_key, batch_key, params, rows, forward, timeout=REQUEST_TIMEOUT):
+    """同步推理 (在工具步骤的线程中调用)；timeout 秒内没有结果时抛出 TimeoutError"""
+    return submit(model_key, batch_key, params, rows, forward).result(timeout)
+
+
+def _ensure_worker():
+    # fork 出的子进程没有父进程的工作线程，按 pid 重新启动；线程意外退出时同样重启
+    global _worker, _worker_pid
+    with _lock:
+        if _worker_pid != os.getpid() or not _worker.is_alive():
+            _worker = threading.Thread(target=_work_loop, name="inference-batcher", daemon=True)
+            _worker.start()
+            _worker_pid = os.getpid()
+
+
+# ==================================================
+# 微批处理
+# ==================================================
+def _collect():
+    """阻塞取第一个请求，再在等待窗口内尽量多取，返回一批请求"""
+    batch = [_queue.get()]
+    rows = len(batch[0].rows)
+    deadline = time.perf_counter() + MAX_WAIT_MS / 1000
+    while rows < MAX_BATCH_ROWS:
+        with _lock:
+            if len(batch) >= _queued:
+                break
+        remaining = deadline - time.perf_counter()
+        try:
+            request = _queue.get(timeout=remaining) if remaining > 0 else _queue.get_nowait()
+        except queue.Empty:
+            break
+        batch.append(request)
+        rows += len(request.rows)
+    return batch
+
+
+def _run_group(group, queued=False):
+    global _outstanding, _queued
+    head = group[0]
+    t0 = time.perf_counter()
+    try:
+        inputs = group[0].rows if len(group) == 1 else np.concatenate([r.rows for r in group])
+        outputs = head.forward(head.params, inputs)
+        splits = np.cumsum([len(r.rows) for r in group])[:-1]
+        for request, part in zip(group, np.split(outputs, splits)):
+            request.future.set_result(part)
+    except Exception as e:
+        for request in group:
+            if not request.future.done():
+                request.future.set_exception(e)
+    done = time.perf_counter()
+    with _lock:
+        _outstanding -= len(group)
+        if queued:
+            _queued -= len(group)
+    _record(head.model_key, group, (done - t0) * 1000, done, queued)
+
+
+def _work_loop():
+    while True:
+        batch = _collect()
+        groups = {}
+        for request in batch:
+            groups.setdefault((request.model_key, request.batch_key), []).append(request)
+        for group in groups.values():
+            _run_group(group, queued=True)
+
+
+# ==================================================
+# 统计
+# ==================================================
+def _record(model_key, group, compute_ms, done, queued):
+    with _lock:
+        s = _stats.setdefault(model_key, {"requests": 0, "inline": 0, "batches": 0, "rows": 0, "compute_ms": 0.0,
+                                          "latency": deque(maxlen=LATENCY_WINDOW)})
+        s["requests"] += len(group)
+        if queued:
+            s["batches"] += 1
+        else:
+            s["inline"] += len(group)
+        s["rows"] += sum(len(r.rows) for r in group)
+        s["compute_ms"] += compute_ms
+        s["latency"].extend((done - r.submitted) * 1000 for r in group)
+
+
+def stats():
+    """
+    按模型汇总：请求数、空闲时直接计算的请求数、微批次数、平均每批请求数 (只算排队的请求)、
+    前向计算耗时与延迟分位数 (ms)
+    """
+    with _lock:
+        snapshot = {key: dict(s, latency=list(s["latency"])) for key, s in _stats.items()}
+    result = {}
+    for key, s in sorted(snapshot.items()):
+        p50, p95, p99 = np.percentile(s["latency"], [50, 95, 99]) if s["latency"] else (0.0, 0.0, 0.0)
+        result[key] = {
+            "requests": s["requests"],
+            "inline": s["inline"],
+            "batches": s["batches"],
+            "rows": s["rows"],
+            "requests_per_batch": (s["requests"] - s["inline"]) / s["batches"] if s["batches"] else 0.0,
+            "compute_ms": s["compute_ms"],
+            "p50_ms": float(p50), "p95_ms": float(p95), "p99_ms": float(p99),
+        }
+    return result
+
+
+def prometheus_lines():
+    """延迟分位数与计数的 Prometheus 文本 (由 instrumentation.prometheus_text 拼接)"""
+    lines = ["# HELP petro_inference_latency_seconds 推理请求延迟 (提交到拿到结果)",
+             "# TYPE petro_inference_latency_seconds summary"]
+    data = stats()
+    for key, s in data.items():
+        for q, field in (("0.5", "p50_ms"), ("0.95", "p95_ms"), ("0.99", "p99_ms")):
+            lines.append(f'petro_inference_latency_seconds{{model="{key}",quantile="{q}"}} {s[field] / 1000:.6f}')
+        lines.append(f'petro_inference_latency_seconds_count{{model="{key}"}} {s["requests"]}')
+    lines.append("# HELP petro_inference_batches_total 推理微批次数")
+    lines.append("# TYPE petro_inference_batches_total counter")
+    for key, s in data.items():
+        lines.append(f'petro_inference_batches_total{{model="{key}"}} {s["batches"]}')
+    return lines
+
+
+def reset():
+    with _lock:
+        _stats.clear()
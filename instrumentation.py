@@ -0,0 +1,184 @@
+# instrumentation.py
+"""
+工具步骤的耗时与资源埋点
+
+每次执行工具的 run() / view() 记录：
+- wall_ms：墙钟耗时；cpu_ms：执行线程的 CPU 时间 (time.thread_time)
+- rss_mb：结束时的常驻内存；peak_rss_delta_mb：进程峰值 RSS 在本次执行期间的增量
+- rows_in / rows_out：执行前后 context['df'] 的行数
+- cache_hits：执行期间数据缓存 / 渲染缓存 / 模型缓存的命中次数 (进程级计数器的差值，并发步骤之间可能互相计入)
+
+结果写入 context['step_metrics'][工具ID][阶段]，同时以 JSON 结构化日志输出到 logger "petro.metrics"，
+并在进程内累计，可导出为 Prometheus 文本格式 (prometheus_text / write_prometheus)。
+"""
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import resource  # Windows 下没有，峰值 RSS 记为 None
+except ImportError:
+    resource = None
+
+logger = logging.getLogger("petro.metrics")
+
+_lock = threading.Lock()
+_totals = {}   # (tool_id, phase) -> 累计值
+
+
+# ==================================================
+# 资源采样
+# ==================================================
+def rss_mb():
+    """当前常驻内存 (MB)；只在 Linux 上可用"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 单位为 KB，macOS 为字节
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+
+def _rows(context):
+    df = context.get("df")
+    return len(df) if hasattr(df, "__len__") else None
+
+
+def _cache_hits():
+    """已加载的缓存模块的命中计数之和 (不为了埋点而导入 pandas 等重依赖)"""
+    hits = 0
+    for name in ("data_catalog", "render_cache", "model_store"):
+        module = sys.modules.get(name)
+        if module is not None:
+            hits += module.cache_stats()["hits"]
+    return hits
+
+
+# ==================================================
+# 埋点
+# ==================================================
+@contextmanager
+def measure(context, tool_id, phase):
+    """包住一次 run / view 调用，结束后记录指标 (异常也会记录，并标记 ok=False)"""
+    start = {"wall": time.perf_counter(), "cpu": time.thread_time(), "peak": peak_rss_mb(),
+             "rows": _rows(context), "hits": _cache_hits()}
+    ok = False
+    try:
+        yield
+        ok = True
+    finally:
+        peak = peak_rss_mb()
+        record = {
+            "tool": tool_id,
+            "phase": phase,
+            "ok": ok,
+            "wall_ms": (time.perf_counter() - start["wall"]) * 1000,
+            "cpu_ms": (time.thread_time() - start["cpu"]) * 1000,
+            "rss_mb": rss_mb(),
+            "peak_rss_delta_mb": peak - start["peak"] if peak is not None else None,
+            "rows_in": start["rows"],
+            "rows_out": _rows(context),
+            "cache_hits": _cache_hits() - start["hits"],
+        }
+        _record(context, record)
+
+
+def call(context, tool_id, phase, func):
+    """在埋点中调用 func(context) (供线程池执行同步的 run)"""
+    with measure(context, tool_id, phase):
+        return func(context)
+
+
+async def call_async(context, tool_id, phase, coro):
+    with measure(context, tool_id, phase):
+        return await coro
+
+
+def _record(context, record):
+    context.setdefault("step_metrics", {}).setdefault(record["tool"], {})[record["phase"]] = record
+    with _lock:
+        total = _totals.setdefault((record["tool"], record["phase"]), {
+            "calls": 0, "errors": 0, "wall_ms": 0.0, "cpu_ms": 0.0, "rows_out": 0, "cache_hits": 0,
+            "peak_rss_delta_mb": 0.0})
+        total["calls"] += 1
+        total["errors"] += 0 if record["ok"] else 1
+        total["wall_ms"] += record["wall_ms"]
+        total["cpu_ms"] += record["cpu_ms"]
+        total["rows_out"] += record["rows_out"] or 0
+        total["cache_hits"] += record["cache_hits"]
+        total["peak_rss_delta_mb"] = max(total["peak_rss_delta_mb"], record["peak_rss_delta_mb"] or 0.0)
+    logger.info(json.dumps(record, ensure_ascii=False))
+
+
+def workflow_totals(context, phase="run"):
+    """本次工作流中某阶段的汇总 (墙钟 / CPU 之和，内存取最大值)"""
+    records = [m[phase] for m in context.get("step_metrics", {}).values() if phase in m]
+    return {
+        "steps": len(records),
+        "wall_ms": sum(r["wall_ms"] for r in records),
+        "cpu_ms": sum(r["cpu_ms"] for r in records),
+        "rss_mb": max((r["rss_mb"] for r in records if r["rss_mb"] is not None), default=None),
+        "cache_hits": sum(r["cache_hits"] for r in records),
+    }
+
+
+# ==================================================
+# Prometheus 导出
+# ==================================================
+_PROM_METRICS = (
+    # (指标名, 累计字段, 类型, 换算, 说明)
+    ("petro_step_calls_total", "calls", "counter", 1, "工具步骤调用次数"),
+    ("petro_step_errors_total", "errors", "counter", 1, "工具步骤异常次数"),
+    ("petro_step_wall_seconds_total", "wall_ms", "counter", 1 / 1000, "工具步骤墙钟耗时累计"),
+    ("petro_step_cpu_seconds_total", "cpu_ms", "counter", 1 / 1000, "工具步骤 CPU 时间累计"),
+    ("petro_step_rows_out_total", "rows_out", "counter", 1, "工具步骤输出行数累计"),
+    ("petro_step_cache_hits_total", "cache_hits", "counter", 1, "工具步骤期间的缓存命中次数"),
+    ("petro_step_peak_rss_delta_bytes", "peak_rss_delta_mb", "gauge", 1024 * 1024, "单次执行的最大峰值内存增量"),
+)
+
+
+def _number(value):
+    return f"{value:.6f}".rstrip("0").rstrip(".")
+
+
+def prometheus_text():
+    """进程内累计指标的 Prometheus 文本格式"""
+    with _lock:
+        totals = {key: dict(value) for key, value in _totals.items()}
+    lines = []
+    for name, field, kind, scale, help_text in _PROM_METRICS:
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for (tool_id, phase), total in sorted(totals.items()):
+            lines.append(f'{name}{{tool="{tool_id}",phase="{phase}"}} {_number(total[field] * scale)}')
+    rss = rss_mb()
+    if rss is not None:
+        lines.append("# HELP petro_process_resident_memory_bytes 进程常驻内存")
+        lines.append("# TYPE petro_process_resident_memory_bytes gauge")
+        lines.append(f"petro_process_resident_memory_bytes {rss * 1024 * 1024:.0f}")
+    service = sys.modules.get("inference_service")
+    if service is not None:
+        lines.extend(service.prometheus_lines())
+    return "\n".join(lines) + "\n"
+
+
+def write_prometheus(path):
+    """写出 Prometheus 文本文件 (可供 node_exporter textfile collector 采集)"""
+    from safe_io import atomic_write_bytes
+    atomic_write_bytes(path, prometheus_text().encode("utf-8"))
+
+
+def reset():
+    with _lock:
+        _totals.clear()
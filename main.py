@@ -1,35 +1,37 @@
 import streamlit as st
-import importlib
 import time
 import random
 import json
 import os
 import datetime
-import graphviz
+import concurrent.futures
+import storage
+import instrumentation
+import report_journal
+import runtime_config
+import pipeline_executor
+import checkpoint_store
+import model_store
+import tool_registry
+import data_ingest
+from safe_io import atomic_write_json
 from agent_brain import plan_workflow
 
 st.set_page_config(page_title="油气生产一体化智能系统", layout="wide", page_icon="🛢️")
 
-USER_DB_FILE = "users.json"
-REPORT_DB_FILE = "reports.json"
-
-TOOL_META = {
-    "tool_data_loader": {"name": "多源数据集成加载", "icon": "📂"},
-    "tool_data_cleaner": {"name": "异常值清洗引擎", "icon": "🧹"},
-    "tool_feature_eng": {"name": "时序特征工程构建", "icon": "🔧"},
-    "tool_correlation": {"name": "多维因子关联分析", "icon": "🕸️"},
-    "tool_model_inference": {"name": "深度学习模型推理", "icon": "🧠"},
-    "tool_trend_algo": {"name": "产量趋势预测算法", "icon": "📈"},
-    "tool_risk_algo": {"name": "生产风险扫描引擎", "icon": "⚠️"},
-    "tool_water_algo": {"name": "智能配注优化模型", "icon": "💧"},
-    "tool_report_gen": {"name": "AI 决策报告生成", "icon": "📝"},
-    "tool_approval_flow": {"name": "自动审批流程推送", "icon": "📤"},
-}
+# 工具元信息来自注册表 (静态扫描 tools/tool_*.py 的 META，不导入模块)
+TOOL_META = tool_registry.tool_meta()
+
+# 需要用户在界面上确认后才能继续的步骤 (数据确认 / 模型训练决策)
+INTERACTIVE_STEPS = ("tool_data_loader", "tool_trend_algo", "tool_risk_algo", "tool_water_algo")
 
 MODELS_LIST = [
-    {"id": "model_trend", "name": "产量趋势预测模型 (LSTM-V2)", "last_update": "2024-05-20"},
-    {"id": "model_risk", "name": "风险预警分类器 (XGBoost)", "last_update": "2024-06-01"},
-    {"id": "model_water", "name": "配注优化强化学习模型 (DQN)", "last_update": "2024-04-15"},
+    {"id": "model_trend", "name": "产量趋势预测模型 (LSTM-V2)", "last_update": "2024-05-20",
+     "tool": "tool_trend_algo", "task": "产量预测"},
+    {"id": "model_risk", "name": "风险预警分类器 (XGBoost)", "last_update": "2024-06-01",
+     "tool": "tool_risk_algo", "task": "风险预测"},
+    {"id": "model_water", "name": "配注优化强化学习模型 (DQN)", "last_update": "2024-04-15",
+     "tool": "tool_water_algo", "task": "注水调配"},
 ]
 
 # --- CSS 样式 ---
@@ -54,69 +56,6 @@ st.markdown("""
 
 
 
-def init_db():
-    default_users = {
-        "mr.gong": {"password": "123456", "role": "admin", "model_states": {}},  # 新增 model_states
-        "user": {"password": "123", "role": "user", "model_states": {}}  # 新增 model_states
-    }
-
-    with open(USER_DB_FILE, "r", encoding='utf-8') as f:
-        users = json.load(f)
-        changed = False
-        for u in users:
-            # 补全 model_states
-            if "model_states" not in users[u]:
-                users[u]["model_states"] = {}
-                changed = True
-            # [新增] 补全 history
-            if "history" not in users[u]:
-                users[u]["history"] = []
-                changed = True
-        if changed:
-            save_data(USER_DB_FILE, users)
-
-
-    if not os.path.exists(USER_DB_FILE):
-        # 加上 encoding='utf-8'
-        with open(USER_DB_FILE, "w", encoding='utf-8') as f:
-            json.dump(default_users, f, ensure_ascii=False, indent=4)
-    else:
-        # 读取也要加
-        with open(USER_DB_FILE, "r", encoding='utf-8') as f:
-            users = json.load(f)
-        if "mr.gong" not in users:
-            users["mr.gong"] = default_users["mr.gong"]
-            with open(USER_DB_FILE, "w", encoding='utf-8') as f:
-                json.dump(users, f, ensure_ascii=False, indent=4)
-
-    with open(USER_DB_FILE, "r", encoding='utf-8') as f:
-        users = json.load(f)
-        changed = False
-        for u in users:
-            if "model_states" not in users[u]:
-                users[u]["model_states"] = {}
-                changed = True
-        if changed:
-            save_data(USER_DB_FILE, users)
-
-    if not os.path.exists(REPORT_DB_FILE):
-        # 加上 encoding='utf-8'
-        with open(REPORT_DB_FILE, "w", encoding='utf-8') as f:
-            json.dump([], f)
-
-
-def load_data(file):
-    # 加上 encoding='utf-8'
-    with open(file, "r", encoding='utf-8') as f:
-        return json.load(f)
-
-
-def save_data(file, data):
-    with open(file, "w", encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=4)
-
-
-
 HISTORY_BASE_DIR = "user_history"
 
 
@@ -129,7 +68,7 @@ def ensure_user_history_dir(username):
 
 
 def save_session_to_disk(username, session_data, history_id=None, custom_title=None):
-    """保存当前会话到磁盘，并更新 users.json 中的索引"""
+    """保存当前会话到磁盘，并更新数据库中的历史索引"""
     user_dir = ensure_user_history_dir(username)
 
     # 1. 确定 ID 和 文件名
@@ -139,15 +78,10 @@ def save_session_to_disk(username, session_data, history_id=None, custom_title=N
     filename = f"{history_id}.json"
     file_path = os.path.join(user_dir, filename)
 
-    # 2. 保存会话内容文件
-    with open(file_path, "w", encoding='utf-8') as f:
-        json.dump(session_data, f, ensure_ascii=False, indent=4)
-
-    # 3. 更新用户的历史索引 (users.json)
-    users = load_data(USER_DB_FILE)
-    if "history" not in users[username]:
-        users[username]["history"] = []
+    # 2. 保存会话内容文件 (临时文件 + 原子替换，避免写一半)
+    atomic_write_json(file_path, session_data)
 
+    # 3. 更新用户的历史索引 (数据库)
     # 如果没提供标题，尝试从数据中生成
     if not custom_title:
         # 尝试获取任务名，没有则取第一句对话
@@ -159,9 +93,6 @@ def save_session_to_disk(username, session_data, history_id=None, custom_title=N
     timestamp_str = datetime.datetime.now().strftime("%Y-%m-%d %H:%M")
     title_display = f"📅 {timestamp_str} | {custom_title}"
 
-    # 检查是否已存在该 ID (如果是更新旧存档)
-    existing_idx = next((i for i, item in enumerate(users[username]["history"]) if item["id"] == history_id), -1)
-
     history_item = {
         "id": history_id,
         "title": title_display,  # 存完整的显示标题
@@ -169,25 +100,15 @@ def save_session_to_disk(username, session_data, history_id=None, custom_title=N
         "updated_at": timestamp_str
     }
 
-    if existing_idx != -1:
-        # 更新旧记录 (移到最前)
-        users[username]["history"].pop(existing_idx)
-        users[username]["history"].insert(0, history_item)
-    else:
-        # 插入新记录
-        users[username]["history"].insert(0, history_item)
-
-    save_data(USER_DB_FILE, users)
+    # 已存在的 ID 会被更新并移到最前
+    storage.upsert_history(username, history_item)
     return history_id
 
 
 def load_session_from_disk(username, history_id):
     """从磁盘读取会话内容"""
-    users = load_data(USER_DB_FILE)
-    history_list = users.get(username, {}).get("history", [])
-
-    # 找到对应的文件路径
-    target_item = next((item for item in history_list if item["id"] == history_id), None)
+    # 按索引找到对应的文件路径
+    target_item = storage.get_history_item(username, history_id)
     if target_item and os.path.exists(target_item["file_path"]):
         with open(target_item["file_path"], "r", encoding='utf-8') as f:
             return json.load(f)
@@ -196,9 +117,7 @@ def load_session_from_disk(username, history_id):
 
 def submit_report_to_manager(username, task_name, context):
     """普通用户提交报告"""
-    reports = load_data(REPORT_DB_FILE)
     new_report = {
-        "id": f"RPT-{int(time.time())}",
         "submitter": username,
         "task_name": task_name,
         "submit_time": datetime.datetime.now().strftime("%Y-%m-%d %H:%M"),
@@ -209,8 +128,7 @@ def submit_report_to_manager(username, task_name, context):
         "summary": context.get('trend_summary') or context.get('risk_summary') or context.get(
             'water_summary') or "自动生成的分析报告"
     }
-    reports.insert(0, new_report)  # 最新在最前
-    save_data(REPORT_DB_FILE, reports)
+    report_journal.submit_report(new_report)
 
 
 def init_session():
@@ -233,17 +151,17 @@ def render_login_page():
         st.caption("Enterprise Edition V3.2")
 
         tab1, tab2 = st.tabs(["🔐 账号登录", "📝 员工注册"])
-        users = load_data(USER_DB_FILE)
 
         # --- 登录 ---
         with tab1:
             username = st.text_input("用户名", key="login_user")
             password = st.text_input("密码", type="password", key="login_pass")
             if st.button("登录", use_container_width=True):
-                if username in users and users[username]['password'] == password:
+                user = storage.get_user(username)
+                if user and user['password'] == password:
                     st.session_state.logged_in = True
                     st.session_state.username = username
-                    st.session_state.role = users[username].get('role', 'user')
+                    st.session_state.role = user.get('role', 'user')
 
                     # 路由判断
                     if st.session_state.role == 'admin':
@@ -253,7 +171,7 @@ def render_login_page():
                         st.session_state.current_page = "analysis"
                         st.success(f"登录成功！正在加载 {username} 的工作环境...")
 
-                    time.sleep(1)
+                    runtime_config.pause(1)
                     st.rerun()
                 else:
                     st.error("用户名或密码错误")
@@ -265,18 +183,73 @@ def render_login_page():
             if st.button("注册并初始化", use_container_width=True):
                 if new_user.lower() == "mr.wang" or "admin" in new_user.lower():
                     st.error("❌ 无法注册管理层账号，请联系IT部门。")
-                elif new_user in users:
+                elif storage.get_user(new_user):
                     st.error("用户已存在")
                 elif new_user and new_pass:
                     with st.spinner(f"正在为 {new_user} 分配独立空间..."):
-                        time.sleep(1)
-                        users[new_user] = {
-                            "password": new_pass,
-                            "role": "user",
-                            "model_path": f"/usr/local/ai_models/{new_user}/"
-                        }
-                        save_data(USER_DB_FILE, users)
-                    st.success("注册成功！请登录。")
+                        runtime_config.pause(1)
+                        created = storage.create_user(new_user, new_pass, role="user",
+                                                      model_path=model_store.user_dir(new_user))
+                    if created:
+                        st.success("注册成功！请登录。")
+                    else:
+                        st.error("用户已存在")
+
+
+def user_model_states(username):
+    """用户各模型的状态 {模型key: "private"}，以模型仓库中是否有专属版本为准"""
+    states = {key: "private" for key in model_store.private_models(username)}
+    # 旧版只在用户表里记了 "private" 标记：有公共权重可复制时迁移为真正的专属版本
+    legacy = (storage.get_user(username) or {}).get("model_states", {})
+    for key, state in legacy.items():
+        if state == "private" and key not in states:
+            if model_store.fork(key, username, {"source": "旧版状态迁移", "kind": "copy"}) is not None:
+                states[key] = "private"
+                storage.set_model_state(username, key, None)
+    return states
+
+
+def fit_private_model(tool_id, username, frame):
+    """
+    用训练数据拟合专属权重 (工具的 fit_weights)，返回 (weights, meta)。
+    工具不支持训练、数据缺少训练所需的字段或拟合失败时返回 None，保存时发布为当前版本的副本。
+    """
+    fit = getattr(tool_registry.load(tool_id), "fit_weights", None)
+    if fit is None or frame is None or frame.empty:
+        return None
+    try:
+        return fit(frame, username)
+    except (ValueError, KeyError, ArithmeticError) as e:
+        st.warning(f"训练数据拟合失败: {e}")
+        return None
+
+
+def publish_private_model(model_key, username, fitted, source):
+    """发布专属版本：有拟合结果时发布拟合出的权重，否则复制当前生效的版本并标记为副本 (kind=copy)。返回版本号"""
+    if fitted is None:
+        return model_store.fork(model_key, username, {"source": source, "kind": "copy"})
+    weights, meta = fitted
+    base = model_store.resolve(model_key, username)
+    if base is not None:
+        meta = dict(meta, base_scope=base.scope, base_version=base.version)
+    return model_store.publish(model_key, weights, username, dict(meta, source=source, kind="fitted"))
+
+
+def training_frame(uploaded_file, task, context=None):
+    """训练数据：优先页面上传的文件 (按任务 schema 接入)，否则用本次分析的数据"""
+    if uploaded_file is not None:
+        try:
+            return data_ingest.ingest_upload(uploaded_file, task)
+        except (OSError, ValueError) as e:
+            st.error(f"训练数据读取失败: {e}")
+            return None
+    return (context or {}).get('df')
+
+
+def fit_caption(fitted):
+    if fitted is None:
+        return "数据缺少训练所需的字段，保存时发布为当前版本的副本 (权重未更新)"
+    return fitted[1]["fit"]["summary"]
 
 
 @st.dialog("🧠 AI 模型与工具库全景")
@@ -288,23 +261,12 @@ def show_model_library_modal():
                                  placeholder="输入关键字查找，例如 '预测' 或 '风险'").strip().lower()
 
     # 2. 准备数据
-    users = load_data(USER_DB_FILE)
     # 获取当前用户的模型状态字典
-    user_states = users.get(st.session_state.username, {}).get("model_states", {})
+    user_states = user_model_states(st.session_state.username)
 
     public_tools = []
     private_tools = []
 
-    # ================= 修改开始：定义映射关系 =================
-    # 核心修复：建立 工具ID (Tool ID) -> 数据库存储的模型ID (DB Key) 的映射
-    # 只有这三个是深度学习模型，其他工具 ID 保持不变
-    tool_map = {
-        "tool_trend_algo": "model_trend",
-        "tool_risk_algo": "model_risk",
-        "tool_water_algo": "model_water"
-    }
-    # ========================================================
-
     # 3. 遍历并分类
     for tool_id, meta in TOOL_META.items():
         # 搜索过滤逻辑
@@ -312,9 +274,9 @@ def show_model_library_modal():
             continue
 
         # ================= 修改开始：使用映射查找状态 =================
-        # 如果这个工具在映射表中（说明它是深度模型），就用映射后的 ID 去查库
+        # 深度模型工具在 META 中声明了 model_key，用它去查库
         # 否则（比如数据清洗工具），直接用工具 ID 查
-        db_key = tool_map.get(tool_id, tool_id)
+        db_key = tool_registry.model_key(tool_id)
 
         # 判断状态 (用 db_key 去查)
         state = user_states.get(db_key, "untrained")
@@ -366,10 +328,8 @@ def render_sidebar():
     with st.sidebar:
         # --- 1. 消息通知区域 (置顶) ---
         if st.session_state.role == 'user':
-            reports = load_data(REPORT_DB_FILE)
-            # 筛选：当前用户 + 状态是 rejected
-            rejected_list = [r for r in reports if
-                             r['submitter'] == st.session_state.username and r.get('status') == 'rejected']
+            # 筛选：当前用户 + 状态是 rejected (走索引查询)
+            rejected_list = report_journal.list_reports(status='rejected', submitter=st.session_state.username)
 
             if rejected_list:
                 st.error(f"🔔 您有 {len(rejected_list)} 条驳回通知")
@@ -384,12 +344,8 @@ def render_sidebar():
 
                     # 清除通知按钮
                     if st.button("我知道了 (清除通知)", key="cls_msg", use_container_width=True):
-                        # 逻辑：保留那些【不是(当前用户且被驳回)】的报告
-                        new_reports = [
-                            x for x in reports
-                            if not (x['submitter'] == st.session_state.username and x.get('status') == 'rejected')
-                        ]
-                        save_data(REPORT_DB_FILE, new_reports)
+                        # 逻辑：当前用户被驳回的报告流转为 cleared (保留归档，不再提示)
+                        report_journal.clear_rejected(st.session_state.username)
                         st.rerun()
                 st.divider()
 
@@ -412,8 +368,7 @@ def render_sidebar():
         # --- 3. 历史存档 (只读) ---
         st.markdown("### 🕒 历史存档")
 
-        users = load_data(USER_DB_FILE)
-        user_history = users.get(st.session_state.username, {}).get("history", [])
+        user_history = storage.list_history(st.session_state.username)
 
         # 如果没有历史，显示默认
         if not user_history:
@@ -430,7 +385,13 @@ def render_sidebar():
                 label = item['title']
 
             if st.button(label, key=f"hist_{item['id']}", type=btn_type, use_container_width=True):
-                # 因为没有保存文件，这里仅做提示
+                # 有检查点的存档直接恢复到工作台 (已完成的步骤不重新执行)，旧存档仅做提示
+                session = load_session_from_disk(st.session_state.username, item["id"])
+                if session and session.get("workflow_id") and \
+                        resume_workflow(session["workflow_id"], session.get("messages")):
+                    st.session_state.current_history_id = item["id"]
+                    st.session_state.current_page = "analysis"
+                    st.rerun()
                 st.toast(f"📄 这是一个归档记录：{item['title']}")
 
         st.divider()
@@ -446,7 +407,18 @@ def render_sidebar():
                          type="primary" if st.session_state.current_page == "training" else "secondary"):
                 st.session_state.current_page = "training"
                 st.rerun()
+        else:
+            st.markdown("### 🧭 导航菜单")
+            if st.button("📋 审批工作台", use_container_width=True,
+                         type="primary" if st.session_state.current_page == "manager_dashboard" else "secondary"):
+                st.session_state.current_page = "manager_dashboard"
+                st.rerun()
+        if st.button("🩺 启动诊断", use_container_width=True,
+                     type="primary" if st.session_state.current_page == "diagnostics" else "secondary"):
+            st.session_state.current_page = "diagnostics"
+            st.rerun()
 
+        if st.session_state.role == 'user':
             if st.session_state.current_page == "analysis":
                 st.write("")
                 # ==========================================
@@ -467,43 +439,31 @@ def render_sidebar():
                             except:
                                 task_name = "未命名任务"
 
-                        timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M")
-                        title_display = f"📅 {timestamp} | {task_name}"
-
-                        # --- B. 更新左侧历史列表 (写入 users.json) ---
-                        users = load_data(USER_DB_FILE)
-                        username = st.session_state.username
-
-                        if "history" not in users[username]:
-                            users[username]["history"] = []
-
-                        # 创建记录项 (注意：这里我们故意不保存 file_path 对应的物理文件)
-                        new_record = {
-                            "id": str(int(time.time())),  # 唯一ID
-                            "title": title_display,  # 显示的标题
-                            "file_path": "",  # 留空
-                            "updated_at": timestamp
-                        }
-
-                        # 插入到最前面
-                        users[username]["history"].insert(0, new_record)
-                        save_data(USER_DB_FILE, users)
+                        # --- B. 保存对话与工作流 ID，并更新左侧历史列表 (写入数据库) ---
+                        # 工作流的中间结果已按步骤写入检查点，存档只记录 ID，调取时从检查点恢复
+                        session_data = {"messages": st.session_state.messages,
+                                        "workflow_id": (ctx or {}).get("workflow_id")}
+                        save_session_to_disk(st.session_state.username, session_data, custom_title=task_name)
 
                         st.toast("✅ 历史记录已归档")
-                        time.sleep(0.5)
+                        runtime_config.pause(0.5)
 
                     # 2. 彻底清空工作台
                     st.session_state.messages = [
                         {"role": "assistant", "content": "您好！我是您的专属AI生产指挥官。请告诉我要分析的任务。"}]
                     st.session_state.current_workflow = None
                     st.session_state.current_context = None
+                    if st.session_state.get("pipeline_run"):
+                        st.session_state.pipeline_run.cancel()
+                    st.session_state.pipeline_run = None
+                    st.query_params.pop("wf", None)
                     st.session_state.workflow_step = 0
                     st.session_state.workflow_finished = False
                     st.session_state.current_history_id = None
 
                     # 清除临时状态
                     keys_to_del = [k for k in st.session_state.keys() if
-                                   k.startswith("submitted_") or k.startswith("trained_")]
+                                   k.startswith(("submitted_", "trained_", "fitted_", "train_source_"))]
                     for k in keys_to_del:
                         del st.session_state[k]
 
@@ -527,25 +487,11 @@ def render_manager_page():
     st.caption(f"当前用户: 宫老师 (mr.gong) | 部门: 生产运行科 | 权限: Level-5")
 
     # --- [新增] 统计数据持久化逻辑 ---
-    STATS_FILE = "manager_stats.json"
-
-    # 1. 初始化或读取统计数据
-    if not os.path.exists(STATS_FILE):
-        # 如果文件不存在，给一个初始值（比如本周已经处理了15个），假装系统一直在运行
-        stats_data = {"processed_count": 15}
-        with open(STATS_FILE, "w", encoding='utf-8') as f:
-            json.dump(stats_data, f)
-    else:
-        with open(STATS_FILE, "r", encoding='utf-8') as f:
-            stats_data = json.load(f)
+    # 1. 读取统计数据 (没有记录时给一个初始值，假装系统一直在运行)
+    current_processed = storage.get_stat("processed_count", 15)
 
-    current_processed = stats_data.get("processed_count", 15)
-
-    # 2. 读取报告数据
-    reports = []
-    if os.path.exists("reports.json"):
-        with open("reports.json", "r", encoding='utf-8') as f:
-            reports = json.load(f)
+    # 2. 读取待审批报告 (内存物化视图，按状态索引)
+    reports = report_journal.list_reports(status="pending")
 
     # 3. 顶部仪表盘
     pending_count = len(reports)
@@ -573,11 +519,7 @@ def render_manager_page():
     # 5. 待办列表 (遍历显示)
     st.subheader(f"📋 待办事项 ({pending_count})")
 
-    # 使用副本遍历，防止删除时索引错位
-    # 注意：这里直接用enumerate可能会有删除索引问题，演示版简单处理即可
     for i, report in enumerate(reports):
-        if report.get('status') != 'pending':
-            continue
         with st.container(border=True):
             c1, c2 = st.columns([4, 1])
 
@@ -609,40 +551,38 @@ def render_manager_page():
 
                 # --- 定义一个更新统计数据的内部函数 ---
                 def update_stats():
-                    new_count = current_processed + 1
-                    with open(STATS_FILE, "w", encoding='utf-8') as f:
-                        json.dump({"processed_count": new_count}, f)
+                    storage.incr_stat("processed_count", default=15)
                     st.session_state['just_processed'] = True  # 触发UI上的绿色小箭头
 
                 # --- 同意按钮 ---
                 if st.button("✅ 批准执行", key=f"app_{i}", type="primary", use_container_width=True):
-                    # 1. 更新统计 (数字+1)
-                    update_stats()
-
-                    # 2. 删除报告
-                    reports.pop(i)
-                    with open("reports.json", "w", encoding='utf-8') as f:
-                        json.dump(reports, f, ensure_ascii=False, indent=4)
-
-                    st.toast("审批已通过！报告已归档。")
-                    time.sleep(0.5)
+                    # 1. 报告归档 (状态流转为 approved，带版本校验，防止多人重复审批)
+                    try:
+                        report_journal.approve_report(report['id'], expected_version=report['version'])
+                    except report_journal.ReportConflictError:
+                        st.warning("该报告已被其他审批人处理，列表已刷新。")
+                    else:
+                        # 2. 更新统计 (数字+1)
+                        update_stats()
+                        st.toast("审批已通过！报告已归档。")
+                    runtime_config.pause(0.5)
                     st.rerun()
 
                 # --- 驳回按钮 ---
                 if st.button("❌ 驳回重做", key=f"rej_{i}", use_container_width=True):
-                    # 1. 更新统计 (数字+1)
-                    update_stats()
-
-                    # 2. 【关键修改】不删除，而是改状态，并写入反馈意见
-                    reports[i]['status'] = 'rejected'
+                    # 1. 【关键修改】不删除，而是改状态，并写入反馈意见
                     # 这里为了演示简单写死，你也可以加个 st.text_input 让经理输入
-                    reports[i]['feedback'] = "数据特征工程存在异常，请重新检查相关性分析结果。"
-
-                    # 3. 保存回文件
-                    save_data(REPORT_DB_FILE, reports)
-
-                    st.toast("已驳回！通知已发送给提交人。")
-                    time.sleep(0.5)
+                    try:
+                        report_journal.reject_report(report['id'],
+                                                     feedback="数据特征工程存在异常，请重新检查相关性分析结果。",
+                                                     expected_version=report['version'])
+                    except report_journal.ReportConflictError:
+                        st.warning("该报告已被其他审批人处理，列表已刷新。")
+                    else:
+                        # 2. 更新统计 (数字+1)
+                        update_stats()
+                        st.toast("已驳回！通知已发送给提交人。")
+                    runtime_config.pause(0.5)
                     st.rerun()
 
 
@@ -664,8 +604,20 @@ def render_training_page():
         # 找到对应的模型ID
         model_info = next(item for item in MODELS_LIST if item["name"] == selected_model)
 
-        st.info(f"上次更新时间: {model_info['last_update']}")
-        st.warning("提示: 更新参数将触发热加载，不影响当前生产任务。")
+        # 以模型仓库中当前生效的版本为准 (专属优先)，仓库里还没有时显示出厂日期
+        username = st.session_state.username
+        scope = username if model_store.current_version(model_info["id"], username) else None
+        history = model_store.versions(model_info["id"], scope)
+        if history:
+            latest = history[-1]
+            updated = datetime.datetime.fromtimestamp(latest["published_at"]).strftime("%Y-%m-%d %H:%M")
+            copy_note = " (副本，权重未重新训练)" if latest.get("kind") == "copy" else ""
+            st.info(f"当前版本: {'专属' if scope else '公共'} V{latest['version']}{copy_note} | 更新时间: {updated}")
+            if latest.get("fit"):
+                st.caption(f"训练结果: {latest['fit']['summary']}")
+        else:
+            st.info(f"上次更新时间: {model_info['last_update']}")
+        st.warning("提示: 更新参数将发布新版本并热加载，正在执行的推理继续使用旧版本。")
 
     # 右侧：上传与更新面板
     with col_detail:
@@ -678,7 +630,7 @@ def render_training_page():
 
             # 步骤 2: 验证与更新
             if uploaded_file is not None:
-                st.success(f"✅ 文件已校验: {uploaded_file.name} (12.8 MB)")
+                st.success(f"✅ 文件已上传: {uploaded_file.name} ({uploaded_file.size / 1024 ** 2:.1f} MB)")
 
                 st.markdown("**Step 2: 执行参数更新**")
 
@@ -692,9 +644,7 @@ def render_training_page():
                         ("正在读取 CSV 数据...", 0.5),
                         ("数据清洗与归一化...", 1.0),
                         (f"加载用户 {st.session_state.username} 的私有权重...", 1.0),
-                        ("启动反向传播 (Epoch 1/5)...", 1.5),
-                        ("启动反向传播 (Epoch 5/5)...", 1.5),
-                        ("验证集评估 (Accuracy: 98.2%)...", 1.0),
+                        ("拟合模型参数...", 1.5),
                         ("参数序列化与热部署...", 1.0)
                     ]
 
@@ -703,11 +653,69 @@ def render_training_page():
                         # 进度条逻辑
                         percent = int(((i) / total_steps) * 100)
                         my_bar.progress(percent, text=f"🔄 {msg}")
-                        time.sleep(sleep_time)
+                        runtime_config.pause(sleep_time)
 
+                    frame = training_frame(uploaded_file, model_info["task"])
+                    fitted = fit_private_model(model_info["tool"], username, frame)
+                    version = publish_private_model(model_info["id"], username, fitted, uploaded_file.name)
                     my_bar.progress(100, text="✅ 更新完成")
-                    st.balloons()
-                    st.success(f"🎉 模型 `{selected_model}` 参数已更新至版本 V{random.randint(3, 9)}.0！")
+                    if version is None:
+                        st.error("该模型还没有可用的基线权重，请先在对话分析中运行一次对应工具。")
+                    elif fitted is None:
+                        st.warning(f"⚠️ {fit_caption(fitted)}：已发布专属版本 V{version}。")
+                    else:
+                        st.balloons()
+                        st.success(f"🎉 模型 `{selected_model}` 参数已更新至专属版本 V{version}！{fit_caption(fitted)}")
+
+
+def render_diagnostics_page():
+    import import_profile
+    st.title("🩺 启动诊断")
+    st.caption("在全新子进程中以 python -X importtime 测量冷启动导入耗时，重依赖应只出现在分析路径上")
+
+    # 1. 当前进程状态
+    stats = tool_registry.preload_stats()
+    col1, col2, col3 = st.columns(3)
+    col1.metric("已发现工具", stats["discovered"], delta=f"{stats['invalid']} 个不合法" if stats["invalid"] else None,
+                delta_color="inverse")
+    col2.metric("已预热模块", stats["loaded"])
+    col3.metric("预热耗时", f"{stats['elapsed_ms']:.0f} ms" if stats["elapsed_ms"] is not None else "未开始")
+    loaded = import_profile.loaded_heavy()
+    st.caption(f"本进程已加载的重依赖: {', '.join(loaded) if loaded else '无'}")
+    models = model_store.cache_stats()
+    st.caption(f"模型权重缓存: {models['entries']}/{models['max_entries']} 个版本，命中率 {models['hit_rate']:.0%}，"
+               f"淘汰 {models['evictions']} 次")
+    for tool_id, reason in tool_registry.invalid_tools().items():
+        st.error(f"工具 {tool_id} 未注册: {reason}")
+
+    st.divider()
+
+    # 2. 冷启动分析 (每个探针起一个子进程，结果保存在会话中)
+    if st.button("▶️ 运行冷启动分析", type="primary"):
+        with st.spinner("正在逐个启动子进程测量导入耗时..."):
+            st.session_state.import_reports = {name: import_profile.profile(statement)
+                                               for name, statement in import_profile.PROBES.items()}
+
+    for name, report in st.session_state.get("import_reports", {}).items():
+        with st.container(border=True):
+            st.markdown(f"**{name}** `{report['statement']}`")
+            if not report["ok"]:
+                st.error(report["error"])
+                continue
+            c1, c2, c3 = st.columns(3)
+            c1.metric("导入耗时", f"{report['import_ms']:.0f} ms")
+            c2.metric("进程总耗时", f"{report['wall_ms']:.0f} ms")
+            c3.metric("导入模块数", report["modules"])
+            st.caption(f"重依赖: {', '.join(report['heavy']) if report['heavy'] else '无'}")
+            st.dataframe([{"包": p["package"], "自身耗时 (ms)": round(p["self_ms"], 1), "模块数": p["modules"]}
+                          for p in report["packages"]], use_container_width=True, hide_index=True)
+
+    # 3. 本进程内工具步骤的累计指标 (Prometheus 文本格式)
+    st.divider()
+    st.markdown("#### 📈 工具步骤指标")
+    metrics_text = instrumentation.prometheus_text()
+    st.code(metrics_text, language="text")
+    st.download_button("⬇️ 下载 metrics.prom", metrics_text, file_name="metrics.prom")
 
 
 def render_deep_model_logic(tool_name, tool_meta_name, context):
@@ -718,16 +726,10 @@ def render_deep_model_logic(tool_name, tool_meta_name, context):
     2. 训练/微调完成 -> 返回 True (显示图表)，但流程暂停等待按钮。
     3. 微调后若选择移除 -> 删库、清状态，下次需重练。
     """
-    users = load_data(USER_DB_FILE)
     username = st.session_state.username
-    user_models = users[username].get("model_states", {})
+    user_models = user_model_states(username)
 
-    tool_map = {
-        "tool_trend_algo": "model_trend",
-        "tool_risk_algo": "model_risk",
-        "tool_water_algo": "model_water"
-    }
-    db_key = tool_map.get(tool_name, tool_name)
+    db_key = tool_registry.model_key(tool_name)
     current_status = user_models.get(db_key, "untrained")
 
     # 如果流程已结束（回看历史），直接放行渲染
@@ -755,8 +757,8 @@ def render_deep_model_logic(tool_name, tool_meta_name, context):
                 st.info("检测到您是首次使用该模型，需要初始化训练参数。")
 
                 st.markdown("##### Step 1: 导入训练数据集")
-                uploaded_train = st.file_uploader("请上传历史生产数据 (CSV/Parquet)",
-                                                  type=["csv", "parquet"],
+                uploaded_train = st.file_uploader("请上传历史生产数据 (CSV/XLSX)",
+                                                  type=["csv", "xlsx"],
                                                   key=f"up_train_{tool_name}")
 
                 st.markdown("##### Step 2: 执行训练")
@@ -766,13 +768,12 @@ def render_deep_model_logic(tool_name, tool_meta_name, context):
                     if uploaded_train:
                         st.toast(f"已加载数据: {uploaded_train.name}")
 
-                    my_bar = st.progress(0, text="正在分配计算资源...")
-                    for percent in range(100):
-                        time.sleep(0.02)
-                        my_bar.progress(percent + 1,
-                                        text=f"Training Epoch {percent // 20}/5 | Loss: {random.uniform(0.1, 0.5):.4f}")
-                    my_bar.empty()
-
+                    with st.spinner("正在用训练数据拟合模型参数..."):
+                        task = data_ingest.task_from_filename(context.get('target_file') or '')
+                        frame = training_frame(uploaded_train, task, context)
+                        st.session_state[f"fitted_{tool_name}"] = fit_private_model(tool_name, username, frame)
+                    st.session_state[f"train_source_{tool_name}"] = (uploaded_train.name if uploaded_train
+                                                                     else context.get('target_file'))
                     st.session_state[f"trained_{tool_name}"] = True
                     st.rerun()
                 
@@ -780,7 +781,11 @@ def render_deep_model_logic(tool_name, tool_meta_name, context):
 
             else:
                 # 2. 训练已完成 -> 允许看图 -> 等待决策
-                st.success(f"✅ 训练完成 | 准确率: {random.uniform(94.0, 98.0):.1f}%")
+                fitted = st.session_state.get(f"fitted_{tool_name}")
+                if fitted is None:
+                    st.warning(f"⚠️ {fit_caption(fitted)}")
+                else:
+                    st.success(f"✅ 训练完成 | {fit_caption(fitted)}")
                 
                 with st.container():
                     st.markdown("##### 🕵️ 结果评估与决策")
@@ -789,17 +794,20 @@ def render_deep_model_logic(tool_name, tool_meta_name, context):
                     col_a, col_b = st.columns(2)
                     
                     if col_a.button("💾 效果不错，存入专属库", key=f"btn_yes_{tool_name}", type="primary", use_container_width=True):
-                        users[username]["model_states"][db_key] = "private"
-                        save_data(USER_DB_FILE, users)
-                        st.toast("模型已保存至专属空间")
+                        version = publish_private_model(db_key, username, fitted,
+                                                        st.session_state.get(f"train_source_{tool_name}"))
+                        if version is None:
+                            st.toast("模型权重尚未就绪，保存失败")
+                        else:
+                            st.toast(f"模型已保存至专属空间 (V{version}{'，当前版本副本' if fitted is None else ''})")
                         st.session_state[f"{tool_name}_ready_next"] = True
-                        time.sleep(0.5)
+                        runtime_config.pause(0.5)
                         st.rerun()
 
                     if col_b.button("➡️ 仅本次使用，继续", key=f"btn_no_{tool_name}", use_container_width=True):
                         st.toast("使用临时模型继续")
                         st.session_state[f"{tool_name}_ready_next"] = True
-                        time.sleep(0.5)
+                        runtime_config.pause(0.5)
                         st.rerun()
 
                 return True
@@ -826,7 +834,9 @@ def render_deep_model_logic(tool_name, tool_meta_name, context):
             elif st.session_state[mode_key] == "direct":
                 if not st.session_state.get(f"{tool_name}_simulated"):
                     with st.spinner("正在加载专属权重并执行推理..."):
-                        time.sleep(1.5)
+                        artifact = model_store.load(db_key, username)
+                    if artifact is not None:
+                        st.toast(f"已加载专属模型 V{artifact.version}")
                     st.session_state[f"{tool_name}_simulated"] = True
                 
                 st.session_state[f"{tool_name}_ready_next"] = True
@@ -837,19 +847,18 @@ def render_deep_model_logic(tool_name, tool_meta_name, context):
                 # A. 微调未完成 -> 阻塞
                 if not st.session_state.get(f"{tool_name}_ft_done"):
                     st.markdown("##### 📤 上传增量校准数据")
-                    ft_file = st.file_uploader("拖拽新数据到此处...", type=["csv"], key=f"ft_up_{tool_name}")
+                    ft_file = st.file_uploader("拖拽新数据到此处...", type=["csv", "xlsx"], key=f"ft_up_{tool_name}")
                     
                     start_ft = st.button("🚀 启动增量训练 (Fine-tuning)", key=f"start_ft_{tool_name}", type="primary")
 
                     if start_ft:
                         if ft_file:
                             st.toast(f"收到增量数据: {ft_file.name}")
-                        prog_bar = st.progress(0, text="启动增量训练...")
-                        for i in range(100):
-                            time.sleep(0.03)
-                            prog_bar.progress(i + 1, text=f"Fine-tuning... | Loss: {random.uniform(0.01, 0.1):.4f}")
-                        prog_bar.empty()
-                        
+                        with st.spinner("正在以专属权重为起点拟合增量数据..."):
+                            task = data_ingest.task_from_filename(context.get('target_file') or '')
+                            frame = training_frame(ft_file, task, context)
+                            st.session_state[f"{tool_name}_ft_fitted"] = fit_private_model(tool_name, username, frame)
+                        st.session_state[f"{tool_name}_ft_source"] = ft_file.name if ft_file else context.get('target_file')
                         st.session_state[f"{tool_name}_ft_done"] = True
                         st.rerun()
                     
@@ -857,7 +866,11 @@ def render_deep_model_logic(tool_name, tool_meta_name, context):
 
                 else:
                     # B. 微调完成 -> 允许看图 -> 等待决策
-                    st.success(f"✅ 微调完成 | 新增样本: 128 | 准确率提升: +{random.uniform(0.5, 1.2):.2f}%")
+                    fitted = st.session_state.get(f"{tool_name}_ft_fitted")
+                    if fitted is None:
+                        st.warning(f"⚠️ {fit_caption(fitted)}")
+                    else:
+                        st.success(f"✅ 微调完成 | {fit_caption(fitted)}")
                     
                     with st.container():
                         st.markdown("##### 🕵️ 微调效果评估")
@@ -868,18 +881,20 @@ def render_deep_model_logic(tool_name, tool_meta_name, context):
                         # 按钮 1: 保存
                         if btn1.button("💾 保存并更新版本", key=f"save_ft_{tool_name}", type="primary",
                                        use_container_width=True):
-                            st.toast(f"✅ 模型 {db_key} 版本已更新至 V{random.randint(4, 9)}.0")
+                            version = publish_private_model(db_key, username, fitted,
+                                                            st.session_state.get(f"{tool_name}_ft_source"))
+                            st.toast(f"✅ 模型 {db_key} 版本已更新至 V{version}"
+                                     + ("，当前版本副本 (权重未更新)" if fitted is None else ""))
                             st.session_state[f"{tool_name}_ready_next"] = True
-                            time.sleep(1)
+                            runtime_config.pause(1)
                             st.rerun()
 
                         # 按钮 2: 效果不好，直接移除 (重置状态)
                         if btn2.button("🗑️ 效果不佳，直接移除", key=f"del_ft_{tool_name}", use_container_width=True):
                             # --- 核心修改逻辑 ---
-                            # 1. 从数据库移除
-                            if db_key in users[username]["model_states"]:
-                                del users[username]["model_states"][db_key]
-                                save_data(USER_DB_FILE, users)
+                            # 1. 从模型仓库移除 (之后回退到公共版本)
+                            if db_key in user_models:
+                                model_store.remove(db_key, username)
                             
                             # 2. 清除训练状态缓存
                             st.session_state.pop(f"trained_{tool_name}", None)
@@ -887,7 +902,7 @@ def render_deep_model_logic(tool_name, tool_meta_name, context):
                             # 3. 提示并允许本次流程继续 (使用刚才算的临时结果)
                             st.toast("⚠️ 模型已从专属库移除，下次使用需重新训练")
                             st.session_state[f"{tool_name}_ready_next"] = True
-                            time.sleep(1)
+                            runtime_config.pause(1)
                             st.rerun()
                             
                     # 返回 True，允许下方显示图表
@@ -896,14 +911,42 @@ def render_deep_model_logic(tool_name, tool_meta_name, context):
     return False
 
 
+def resume_workflow(workflow_id, messages=None):
+    """从检查点把工作流恢复到当前会话 (刷新页面 / 调取历史存档)，成功返回 True"""
+    if checkpoint_store.owner(workflow_id) != st.session_state.username:
+        return False
+    pipeline = pipeline_executor.PipelineRun.resume(workflow_id, gates=INTERACTIVE_STEPS)
+    if pipeline is None:
+        return False
+    if st.session_state.get("pipeline_run"):
+        st.session_state.pipeline_run.cancel()
+
+    ctx = pipeline.context
+    ctx['render_model_ui'] = render_deep_model_logic
+    st.session_state.current_workflow = pipeline.workflow
+    st.session_state.current_context = ctx
+    st.session_state.pipeline_run = pipeline
+    st.session_state.workflow_step = pipeline.cursor
+    st.session_state.workflow_finished = pipeline.finished
+    st.session_state.messages = messages or [
+        {"role": "assistant", "content": "您好！我是您的专属AI生产指挥官。请告诉我要分析的任务。"},
+        {"role": "user", "content": ctx.get("query") or ctx.get("task_name", "")},
+    ]
+    st.query_params["wf"] = workflow_id
+    return True
+
+
 def render_analysis_page():
     st.title("💬 油气生产一体化智能系统")
 
-    # 1. 初始化聊天记录
+    # 1. 初始化聊天记录 (刷新页面后按 URL 中的工作流 ID 从检查点恢复)
     if "messages" not in st.session_state:
-        st.session_state.messages = [
-            {"role": "assistant", "content": "您好！我是您的专属AI生产指挥官。请告诉我要分析的任务。"}
-        ]
+        workflow_id = st.query_params.get("wf")
+        if not (workflow_id and resume_workflow(workflow_id)):
+            st.query_params.pop("wf", None)
+            st.session_state.messages = [
+                {"role": "assistant", "content": "您好！我是您的专属AI生产指挥官。请告诉我要分析的任务。"}
+            ]
 
     # 2. 显示历史消息
     for msg in st.session_state.messages:
@@ -921,6 +964,10 @@ def render_analysis_page():
         st.session_state.workflow_finished = False
         st.session_state.current_workflow = None
         st.session_state.current_context = None
+        # 上一条指令的工具链可能还在后台执行，取消在途步骤
+        if st.session_state.get("pipeline_run"):
+            st.session_state.pipeline_run.cancel()
+        st.session_state.pipeline_run = None
 
         # 清除所有工具相关的临时 flag，防止“抢跑”
         keys_to_clear = [
@@ -928,9 +975,8 @@ def render_analysis_page():
             if k.endswith("_ready_next")
                or k.endswith("_ft_done")
                or k.endswith("_mode")
-               or k.endswith("_simulated")
-               or k.startswith("trained_")
-               or k.endswith("_run_completed")
+               or k.endswith(("_simulated", "_ft_fitted", "_ft_source"))
+               or k.startswith(("trained_", "fitted_", "train_source_"))
         ]
         for k in keys_to_clear:
             del st.session_state[k]
@@ -946,7 +992,7 @@ def render_analysis_page():
         last_msg = st.session_state.messages[-1]
         if not st.session_state.get("current_workflow") and last_msg["role"] == "user":
             with st.chat_message("assistant"):
-                # AI 思考过程模拟
+                # AI 思考过程模拟 (生产模式下跳过)
                 thinking_box = st.empty()
                 thoughts = [
                     "🤔 正在解析自然语言指令...",
@@ -956,45 +1002,78 @@ def render_analysis_page():
                     "🛠️ 正在编排 Agent 工具链 (CoT)...",
                     "✨ 方案生成完毕，准备执行。"
                 ]
-                for thought in thoughts:
-                    thinking_box.markdown(f"_{thought}_")
-                    time.sleep(random.uniform(0.3, 0.8))
+                if not runtime_config.is_production():
+                    for thought in thoughts:
+                        thinking_box.markdown(f"_{thought}_")
+                        time.sleep(random.uniform(0.3, 0.8))
                 thinking_box.empty()
 
                 wf, ctx = plan_workflow(last_msg["content"])
                 # 注入模型控制函数
                 ctx['render_model_ui'] = render_deep_model_logic
+                ctx['username'] = st.session_state.username
+                ctx['query'] = last_msg["content"]
                 st.session_state.current_workflow = wf
                 st.session_state.current_context = ctx
+                # 工具的 run() 交给执行器，每步只执行一次；界面只订阅进度并渲染视图。
+                # 每步完成后写检查点，工作流 ID 放进 URL，刷新页面后从第一个未完成的步骤继续
+                pipeline = pipeline_executor.PipelineRun(wf, ctx, gates=INTERACTIVE_STEPS, checkpoint=True)
+                st.session_state.pipeline_run = pipeline
+                st.query_params["wf"] = pipeline.workflow_id
 
         # 获取状态数据
         workflow = st.session_state.get("current_workflow")
         context = st.session_state.get("current_context")
-        current_step = st.session_state.get("workflow_step", 0)
+        pipeline = st.session_state.get("pipeline_run")
         is_finished = st.session_state.get("workflow_finished", False)
 
-        if workflow:
+        # 执行器在后台事件循环中向后推进，直到遇到需要用户确认的步骤 (已执行过的步骤不会重复执行)。
+        # 脚本线程只轮询进度：用户此时提交新指令会中断本次刷新，并在下一次刷新时取消这条工具链
+        if pipeline and not is_finished:
+            progress_box = st.empty()
+            future = pipeline.start()
+            while not future.done():
+                running = [s["tool"] for s in pipeline.steps if s["status"] == pipeline_executor.RUNNING]
+                done = sum(1 for s in pipeline.steps if s["status"] == pipeline_executor.DONE)
+                names = "、".join(TOOL_META.get(t, {"name": t})["name"] for t in running)
+                progress_box.progress(done / len(pipeline.steps),
+                                      text=f"⏳ {names or '调度中'} 正在执行... ({done}/{len(pipeline.steps)})")
+                concurrent.futures.wait([future], timeout=0.1)
+            progress_box.empty()
+            st.session_state.workflow_step = pipeline.cursor
+        current_step = st.session_state.get("workflow_step", 0)
+        # 等待用户确认的步骤 (DAG 下可能同时有多个)
+        active_steps = set(pipeline.waiting) if pipeline and not is_finished else set()
+
+        if workflow and pipeline:
             # ================= [新增功能 1] 工作流可视化 =================
             with st.chat_message("assistant"):
                 st.markdown(f"#### 🗺️ AI 任务执行路径规划")
+                import graphviz  # 只有分析页需要绘制流程图
                 graph = graphviz.Digraph()
                 graph.attr(rankdir='LR', size='10,4')
                 graph.attr('node', shape='box', style='filled,rounded',
                            fontname='Microsoft YaHei', fillcolor='#e3f2fd', color='#2196f3')
 
+                # 按工具声明的输入 / 输出推导出的真实依赖图，同一列的步骤可并发执行
                 for idx, tool_id in enumerate(workflow):
                     meta = TOOL_META.get(tool_id, {"name": tool_id})
-                    if idx < current_step:
-                        fill, pen = '#c8e6c9', '#4caf50'  # 绿
-                    elif idx == current_step and not is_finished:
+                    status = pipeline.steps[idx]["status"]
+                    if status == pipeline_executor.FAILED:
+                        fill, pen = '#ffcdd2', '#e53935'  # 红
+                    elif status == pipeline_executor.CANCELLED:
+                        fill, pen = '#eeeeee', '#9e9e9e'  # 灰
+                    elif idx in active_steps:
                         fill, pen = '#fff9c4', '#fbc02d'  # 黄
+                    elif status == pipeline_executor.DONE:
+                        fill, pen = '#c8e6c9', '#4caf50'  # 绿
                     else:
                         fill, pen = '#e3f2fd', '#2196f3'  # 蓝
 
                     node_label = f"{idx + 1}. {meta['name']}"
                     graph.node(str(idx), node_label, fillcolor=fill, color=pen)
-                    if idx > 0:
-                        graph.edge(str(idx - 1), str(idx), color='#b0bec5')
+                for src, dst in pipeline.edges:
+                    graph.edge(str(src), str(dst), color='#b0bec5')
 
                 st.graphviz_chart(graph, use_container_width=True)
                 st.divider()
@@ -1002,12 +1081,13 @@ def render_analysis_page():
             # --- 定义内部渲染函数 ---
             def render_tool_steps():
                 for i, tool_id in enumerate(workflow):
-                    # 如果还没完成整个流程，且当前遍历到的步骤 > 当前实际步骤，停止渲染后续
-                    if not is_finished and i > current_step:
-                        break
+                    step = pipeline.steps[i]
+                    # 如果还没完成整个流程，尚未执行的步骤不渲染
+                    if not is_finished and step["status"] == pipeline_executor.PENDING:
+                        continue
 
                     meta = TOOL_META.get(tool_id, {"name": tool_id, "icon": "🔧"})
-                    is_current_active = (i == current_step) and not is_finished
+                    is_current_active = i in active_steps
 
                     if is_finished:
                         step_title = f"Step {i + 1}: {meta['name']} (✅ 已完成)"
@@ -1018,40 +1098,43 @@ def render_analysis_page():
                         expander_open = is_current_active
 
                     with st.expander(step_title, expanded=expander_open):
-                        try:
-                            module = importlib.import_module(f"tools.{tool_id}")
-
-                            # 【优化】后台逻辑防抖：防止 UI 交互导致 run() 重复执行
-                            # 只有当前步骤激活，且之前没跑过 run，才执行
-                            step_run_key = f"step_{i}_run_completed"
+                        if step["status"] == pipeline_executor.FAILED:
+                            st.error(f"执行出错: {step['message']}")
+                            continue
+                        if step["status"] == pipeline_executor.CANCELLED:
+                            st.warning("⏹️ 该步骤已取消")
+                            continue
+
+                        # 执行中只渲染当前步骤的视图，已完成的步骤只显示执行结果，
+                        # 避免每次刷新都重绘全部历史视图；全部完成后再统一展示详情
+                        if not is_finished and not is_current_active:
+                            m = context.get("step_metrics", {}).get(tool_id, {}).get("run")
+                            if m:
+                                rows = f" | 📄 {m['rows_in']} → {m['rows_out']} 行" if m["rows_out"] is not None else ""
+                                st.caption(f"{step['message']} | ⏱️ {m['wall_ms']:.0f} ms (CPU {m['cpu_ms']:.0f} ms)"
+                                           f"{rows} | 缓存命中 {m['cache_hits']}")
+                            else:
+                                # 旧检查点恢复的步骤可能没有耗时记录
+                                elapsed = f" | ⏱️ {step['elapsed_ms']:.0f} ms" if step['elapsed_ms'] is not None else ""
+                                st.caption(f"{step['message']}{elapsed}")
+                            continue
 
-                            if is_current_active:
-                                if not st.session_state.get(step_run_key):
-                                    delay_bar = st.progress(0, text=f"⏳ {meta['name']} 正在执行...")
-                                    for k in range(100):
-                                        time.sleep(0.01)
-                                        delay_bar.progress(k + 1)
-                                    delay_bar.empty()
-
-                                    # 执行工具的后台逻辑
-                                    module.run(context)
-                                    # 标记该步 run 已跑完
-                                    st.session_state[step_run_key] = True
+                        try:
+                            module = pipeline_executor.load_tool(tool_id)
 
                             # 渲染 UI 视图 (模型交互逻辑在这里触发)
                             if hasattr(module, 'view'):
-                                module.view(context)
+                                with instrumentation.measure(context, tool_id, "view"):
+                                    module.view(context)
 
-                            # 流程控制：决定何时跳到下一步
+                            # 流程控制：用户确认后放行执行器，继续执行后续步骤
                             if is_current_active:
-                                deep_models = ["tool_trend_algo", "tool_risk_algo", "tool_water_algo"]
-
                                 # A. 如果是深度模型
-                                if tool_id in deep_models:
+                                if tool_id in ("tool_trend_algo", "tool_risk_algo", "tool_water_algo"):
                                     # 【关键修复】只有当 ready_next 标志位被逻辑函数置为 True 时，才跳转
                                     if st.session_state.get(f"{tool_id}_ready_next"):
-                                        time.sleep(0.5)
-                                        st.session_state.workflow_step += 1
+                                        runtime_config.pause(0.5)
+                                        pipeline.release(i)
                                         st.rerun()
                                     # 否则这里什么都不做，静静等待用户操作
 
@@ -1059,15 +1142,9 @@ def render_analysis_page():
                                 elif tool_id == "tool_data_loader":
                                     st.write("---")
                                     if st.button("⬇️ 数据确认无误，执行下一步", key=f"next_step_{i}", type="primary"):
-                                        st.session_state.workflow_step += 1
+                                        pipeline.release(i)
                                         st.rerun()
 
-                                # C. 普通工具 (Cleaner, Feature, etc.)
-                                else:
-                                    time.sleep(0.8)  # 简单展示后自动跳转
-                                    st.session_state.workflow_step += 1
-                                    st.rerun()
-
                         except Exception as e:
                             st.error(f"执行出错: {e}")
 
@@ -1076,12 +1153,12 @@ def render_analysis_page():
                 with st.expander("✅ 所有步骤执行完毕 (点击查看详情/操作历史)"):
                     render_tool_steps()
             else:
-                status_label = f"🚀 正在执行: {context.get('task_name')} (Step {current_step + 1}/{len(workflow)})"
+                status_label = f"🚀 正在执行: {context.get('task_name')} (Step {min(current_step + 1, len(workflow))}/{len(workflow)})"
                 with st.status(status_label, expanded=True) as status:
                     render_tool_steps()
 
             # 判断结束
-            if not is_finished and current_step >= len(workflow):
+            if not is_finished and pipeline.finished:
                 st.session_state.workflow_finished = True
                 st.rerun()
 
@@ -1102,7 +1179,7 @@ def render_analysis_page():
 
 
 if __name__ == "__main__":
-    init_db()  # 初始化文件
+    storage.init_db()  # 初始化数据库 (首次启动自动迁移旧 JSON)
     init_session()
 
     if not st.session_state.logged_in:
@@ -1111,10 +1188,14 @@ if __name__ == "__main__":
         render_sidebar()  # 侧边栏常驻
 
         # 根据角色和页面路由
-        if st.session_state.role == 'admin':
+        if st.session_state.current_page == "diagnostics":
+            render_diagnostics_page()
+        elif st.session_state.role == 'admin':
             render_manager_page()
         else:
             if st.session_state.current_page == "analysis":
+                # 工程师进入分析路径后才在后台预导入工具及其重依赖 (每个进程只执行一次)
+                tool_registry.preload()
                 render_analysis_page()
             elif st.session_state.current_page == "training":
                 render_training_page()
@@ -0,0 +1,295 @@
+# model_store.py
+"""
+模型权重仓库：按版本保存公共 / 用户专属权重，内存映射加载，进程内 LRU 共享
+
+目录结构: models/
+- public/<模型key>/v0001/           公共版本
+- users/<用户名>/<模型key>/v0001/   用户专属版本 (存在时优先于公共版本)
+- 每个版本目录：每个权重数组一个 .npy + meta.json；<模型key>/CURRENT 记录当前生效的版本号
+
+- 发布新版本：先写临时目录再整体 rename，最后原子替换 CURRENT，已发布的版本目录不再修改
+- 读取：np.load(mmap_mode="r") 只读映射，同一版本在进程内只加载一次，所有会话共享
+- 热更新：resolve() 每次检查 CURRENT，新版本是新的缓存键；正在推理的调用持有旧版本的
+  Artifact 引用，映射在引用释放前一直有效，不会被中途替换
+- 每个模型只保留最近 KEEP_VERSIONS 个版本 (Linux 下删除已映射的文件不影响持有方)
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from safe_io import atomic_write_json, file_lock
+
+MODEL_DIR = os.environ.get("PETRO_MODEL_DIR", "models")
+CACHE_ENTRIES = int(os.environ.get("PETRO_MODEL_CACHE", "32"))
+KEEP_VERSIONS = 3
+PUBLIC = "public"
+
+# 已加载的一个模型版本；weights 为只读数组 (内存映射) 字典
+Artifact = namedtuple("Artifact", "model_key scope version weights meta path")
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_cache = OrderedDict()      # (版本目录, inode, mtime) -> Artifact
+_pointers = {}              # CURRENT 文件路径 -> (mtime_ns, 版本)
+_stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+
+def _safe_name(name):
+    # 用户名 / 模型 key 会拼进路径，只允许字母数字、下划线、点和连字符 (含中文)
+    name = str(name)
+    if not re.fullmatch(r"[\w.-]+", name) or name in (".", ".."):
+        raise ValueError(f"非法的名称: {name!r}")
+    return name
+
+
+def _user_dir_name(username):
+    # 用户名不受登录规则限制 (邮箱、含空格等)：能直接做目录名的保持原样，其余映射为稳定的哈希名；
+    # "~" 不在合法名称的字符集内，映射后的名字不会与其他用户的原样目录名冲突
+    username = str(username)
+    if re.fullmatch(r"[\w.-]+", username) and username not in (".", ".."):
+        return username
+    return "~" + hashlib.sha256(username.encode("utf-8")).hexdigest()[:24]
+
+
+def model_dir(model_key, username=None):
+    """模型在某个作用域 (用户名，None 为公共) 下的目录"""
+    if username is None:
+        return os.path.join(MODEL_DIR, PUBLIC, _safe_name(model_key))
+    return os.path.join(MODEL_DIR, "users", _user_dir_name(username), _safe_name(model_key))
+
+
+def user_dir(username):
+    return os.path.join(MODEL_DIR, "users", _user_dir_name(username))
+
+
+# ==================================================
+# 版本指针
+# ==================================================
+def current_version(model_key, username=None):
+    """当前生效的版本号，没有时返回 None (按文件 mtime 缓存，未变化时不重新读取)"""
+    path = os.path.join(model_dir(model_key, username), "CURRENT")
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+    cached = _pointers.get(path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            version = int(json.load(f)["version"])
+    except (OSError, ValueError, KeyError):
+        return None
+    _pointers[path] = (mtime, version)
+    return version
+
+
+def versions(model_key, username=None):
+    """已发布的版本列表 [{version, published_at, ...meta}]，按版本号升序"""
+    base = model_dir(model_key, username)
+    result = []
+    for name in sorted(os.listdir(base)) if os.path.isdir(base) else []:
+        if not re.fullmatch(r"v\d+", name):
+            continue
+        try:
+            with open(os.path.join(base, name, "meta.json"), "r", encoding="utf-8") as f:
+                result.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    return result
+
+
+def _version_dir(base, version):
+    return os.path.join(base, f"v{version:04d}")
+
+
+# ==================================================
+# 发布 / 删除
+# ==================================================
+def publish(model_key, weights, username=None, meta=None):
+    """
+    发布新版本并设为当前版本，返回版本号。
+    weights: {名称: 数组}；meta: 附加的 JSON 信息 (训练数据来源、基线版本等)
+    """
+    base = model_dir(model_key, username)
+    os.makedirs(base, exist_ok=True)
+    with file_lock(os.path.join(base, "publish")):
+        return _publish_locked(base, model_key, weights, username, meta)
+
+
+def publish_if_absent(model_key, default, username=None, meta=None):
+    """
+    还没有任何版本时才发布 default() -> (weights, meta)，返回当前版本号。
+    在发布锁内重新检查 CURRENT，并发的首次调用 (多个会话 / 步骤同时启动) 只会发布一个 v1。
+    """
+    base = model_dir(model_key, username)
+    os.makedirs(base, exist_ok=True)
+    with file_lock(os.path.join(base, "publish")):
+        version = current_version(model_key, username)
+        if version is not None:
+            return version
+        weights, default_meta = default()
+        return _publish_locked(base, model_key, weights, username, dict(default_meta, **(meta or {})))
+
+
+def _publish_locked(base, model_key, weights, username, meta):
+    # 调用方已持有 base/publish 锁
+    import numpy as np
+    existing = [int(name[1:]) for name in os.listdir(base) if re.fullmatch(r"v\d+", name)]
+    version = max(existing, default=0) + 1
+    tmp = tempfile.mkdtemp(prefix=".tmp-", dir=base)
+    try:
+        arrays = {}
+        for name, value in weights.items():
+            array = np.ascontiguousarray(value)
+            np.save(os.path.join(tmp, f"{_safe_name(name)}.npy"), array, allow_pickle=False)
+            arrays[name] = {"shape": list(array.shape), "dtype": str(array.dtype)}
+        record = dict(meta or {}, model_key=model_key, scope=username or PUBLIC, version=version,
+                      published_at=time.time(), arrays=arrays)
+        atomic_write_json(os.path.join(tmp, "meta.json"), record)
+        os.rename(tmp, _version_dir(base, version))
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+    atomic_write_json(os.path.join(base, "CURRENT"), {"version": version})
+    _prune(base, version)
+    return version
+
+
+def _prune(base, current):
+    old = sorted(int(name[1:]) for name in os.listdir(base) if re.fullmatch(r"v\d+", name))
+    for version in old[:-KEEP_VERSIONS]:
+        if version != current:
+            # Windows 下被映射的文件删不掉，下次发布时再试
+            shutil.rmtree(_version_dir(base, version), ignore_errors=True)
+
+
+def remove(model_key, username):
+    """删除用户的专属模型 (之后回退到公共版本)；已在推理中的调用不受影响"""
+    base = model_dir(model_key, username)
+    if not os.path.isdir(base):
+        return
+    with file_lock(os.path.join(base, "publish")):
+        # 与发布互斥；锁文件本身保留，等待同一把锁的发布方拿到锁后目录仍然有效
+        # 先撤掉 CURRENT，读取方立即回退到公共版本
+        pointer = os.path.join(base, "CURRENT")
+        _pointers.pop(pointer, None)
+        if os.path.exists(pointer):
+            os.remove(pointer)
+        for name in os.listdir(base):
+            path = os.path.join(base, name)
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            elif name != "publish.lock":
+                os.remove(path)
+
+
+def fork(model_key, username, meta=None):
+    """把用户当前生效的版本 (专属优先，否则公共) 复制为用户专属的新版本，返回版本号；没有可复制的版本时返回 None"""
+    base = resolve(model_key, username)
+    if base is None:
+        return None
+    inherited = {k: v for k, v in base.meta.items()
+                 if k not in ("model_key", "scope", "version", "published_at", "arrays", "source", "kind", "fit")}
+    inherited.update(base_scope=base.scope, base_version=base.version)
+    return publish(model_key, dict(base.weights), username, dict(inherited, **(meta or {})))
+
+
+def private_models(username):
+    """用户拥有专属版本的模型 {模型key: 当前版本号}"""
+    base = user_dir(username)
+    if not os.path.isdir(base):
+        return {}
+    result = {}
+    for key in os.listdir(base):
+        if os.path.isdir(os.path.join(base, key)):
+            version = current_version(key, username)
+            if version is not None:
+                result[key] = version
+    return result
+
+
+# ==================================================
+# 加载
+# ==================================================
+def _load(model_key, username, version):
+    import numpy as np
+    path = _version_dir(model_dir(model_key, username), version)
+    with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    weights = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r", allow_pickle=False)
+               for name in meta["arrays"]}
+    return Artifact(model_key, username or PUBLIC, version, weights, meta, path)
+
+
+def load(model_key, username=None, version=None):
+    """加载指定作用域的某个版本 (默认当前版本)，不存在时返回 None"""
+    version = version or current_version(model_key, username)
+    if version is None:
+        return None
+    path = _version_dir(model_dir(model_key, username), version)
+    try:
+        # 目录被删除后重新发布的同号版本是另一个 inode，不会误用旧缓存
+        st = os.stat(path)
+    except OSError:
+        return None
+    key = (path, st.st_ino, st.st_mtime_ns)
+    with _lock:
+        artifact = _cache.get(key)
+        if artifact is not None:
+            _cache.move_to_end(key)
+            _stats["hits"] += 1
+            return artifact
+        _stats["misses"] += 1
+    try:
+        artifact = _load(model_key, username, version)
+    except (OSError, ValueError, KeyError) as e:
+        logger.warning("%s v%s 加载失败: %s", model_key, version, e)
+        return None
+    with _lock:
+        artifact = _cache.setdefault(key, artifact)
+        _cache.move_to_end(key)
+        while len(_cache) > CACHE_ENTRIES:
+            _cache.popitem(last=False)
+            _stats["evictions"] += 1
+    return artifact
+
+
+def resolve(model_key, username=None, default=None):
+    """
+    推理时取模型：用户专属当前版本优先，其次公共当前版本。
+    公共版本不存在且提供了 default() -> (weights, meta) 时，先发布为公共 v1 (并发调用只发布一次)。
+    """
+    if username:
+        artifact = load(model_key, username)
+        if artifact is not None:
+            return artifact
+    artifact = load(model_key)
+    if artifact is None and default is not None:
+        try:
+            publish_if_absent(model_key, default, meta={"source": "内置默认参数"})
+        except OSError as e:
+            logger.warning("%s 默认权重未能写入: %s", model_key, e)
+        artifact = load(model_key)
+    return artifact
+
+
+def cache_stats():
+    with _lock:
+        total = _stats["hits"] + _stats["misses"]
+        return dict(_stats, entries=len(_cache), max_entries=CACHE_ENTRIES,
+                    hit_rate=_stats["hits"] / total if total else 0.0)
+
+
+def clear_cache():
+    with _lock:
+        _cache.clear()
+        _pointers.clear()
@@ -0,0 +1,361 @@
+# pipeline_executor.py
+"""
+无界面的工具链执行器 (DAG 调度)
+
+- 接收 agent_brain.plan_workflow 生成的 (workflow, context)，每个工具的 run() 只执行一次
+- 依赖关系由工具模块声明的 INPUTS / OUTPUTS (上下文字段) 推导：
+  读某字段的步骤依赖此前最后一个写该字段的步骤；写某字段的步骤还要等此前读 / 写过它的步骤结束。
+  未声明的工具视为屏障，依赖前面所有步骤
+- 依赖都已满足的步骤在 async_runtime 的后台事件循环中并发执行，每步带超时 (META["timeout"])
+- start() 立即返回，调用方轮询 steps / 返回的 future；advance() 阻塞直到本轮推进结束
+- cancel() 取消正在执行的步骤 (界面上用户提交新指令时调用)，被取消的步骤标记为 cancelled
+- 进度通过订阅回调推送 (回调在事件循环线程上触发，界面应轮询 steps 而不是在回调里直接渲染)
+- gates 中的步骤执行完后暂停其下游，等调用方 release() 放行 (对应界面上需要用户确认的步骤)；
+  无界面场景不传 gates，一次跑完
+- checkpoint=True 时每个完成的步骤都写入 checkpoint_store (按 workflow_id)，
+  PipelineRun.resume() 从第一个未完成的步骤继续
+
+命令行用法: python pipeline_executor.py "分析7月产量趋势" [--user cli] [--demo] [--checkpoint]
+           python pipeline_executor.py --resume <workflow_id>
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import CancelledError
+
+import async_runtime
+import checkpoint_store
+import tool_registry
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+MAX_WORKERS = int(os.environ.get("PETRO_PIPELINE_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+logger = logging.getLogger(__name__)
+
+
+def load_tool(tool_id):
+    return tool_registry.load(tool_id)
+
+
+def step_timeout(tool_id):
+    spec = tool_registry.discover().get(tool_id) or {"meta": {}}
+    return float(spec["meta"].get("timeout", async_runtime.STEP_TIMEOUT))
+
+
+def build_dependencies(workflow):
+    """根据工具声明的 INPUTS / OUTPUTS 推导每一步依赖的前序步骤下标 (读注册表的静态声明，不导入模块)"""
+    specs = tool_registry.discover()
+    decls = []
+    for tool_id in workflow:
+        spec = specs.get(tool_id) or {}
+        inputs, outputs = spec.get("inputs"), spec.get("outputs")
+        decls.append(None if inputs is None or outputs is None else (set(inputs), set(outputs)))
+
+    deps = []
+    for i, decl in enumerate(decls):
+        if decl is None:
+            deps.append(set(range(i)))
+            continue
+        inputs, outputs = decl
+        mine = set()
+        for key in inputs:
+            # 读：依赖最后一个写该字段的前序步骤
+            writer = next((j for j in range(i - 1, -1, -1) if decls[j] is None or key in decls[j][1]), None)
+            if writer is not None:
+                mine.add(writer)
+        for j in range(i):
+            # 写：不能早于此前读 / 写同一字段的步骤；屏障步骤之后的步骤都要等它
+            if decls[j] is None or outputs & (decls[j][0] | decls[j][1]):
+                mine.add(j)
+        deps.append(mine)
+    return deps
+
+
+def reduce_edges(deps):
+    """传递规约后的依赖边 (j, i)，用于绘图"""
+    ancestors = []
+    for i, mine in enumerate(deps):
+        anc = set(mine)
+        for j in mine:
+            anc |= ancestors[j]
+        ancestors.append(anc)
+    edges = []
+    for i, mine in enumerate(deps):
+        for j in sorted(mine):
+            if not any(j in ancestors[k] for k in mine if k != j):
+                edges.append((j, i))
+    return edges
+
+
+class PipelineRun:
+    """一次工具链执行的状态：每步的状态 / 返回信息 / 耗时，以及步骤间依赖"""
+
+    def __init__(self, workflow, context, gates=(), max_workers=MAX_WORKERS, checkpoint=False, workflow_id=None):
+        self.workflow = list(workflow)
+        self.context = context
+        self.gates = set(gates)
+        self.max_workers = max_workers
+        self.checkpoint = checkpoint
+        self.workflow_id = workflow_id or context.get("workflow_id") or checkpoint_store.new_id()
+        context["workflow_id"] = self.workflow_id
+        self.deps = build_dependencies(self.workflow)
+        self.edges = reduce_edges(self.deps)
+        self.steps = [{"tool": tool_id, "status": PENDING, "message": "", "elapsed_ms": None}
+                      for tool_id in self.workflow]
+        self.error = None
+        self.cancelled = False
+        self.resumed = set()   # 从检查点恢复、本次没有重新执行的步骤
+        self._released = set()
+        self._subscribers = []
+        self._events = [threading.Event() for _ in self.workflow]   # 每步的取消标记
+        self._future = None
+        self._lock = threading.RLock()
+        if checkpoint and workflow_id is None:
+            checkpoint_store.create(self.workflow_id, self.workflow, context)
+
+    @classmethod
+    def resume(cls, workflow_id, gates=(), max_workers=MAX_WORKERS):
+        """从检查点恢复：已完成的步骤直接标记完成 (不重新执行)，没有可用检查点时返回 None"""
+        saved = checkpoint_store.load(workflow_id)
+        if saved is None:
+            return None
+        run = cls(saved["workflow"], saved["context"], gates=gates, max_workers=max_workers,
+                  checkpoint=True, workflow_id=workflow_id)
+        for index, record in saved["steps"].items():
+            run.steps[index].update(status=DONE, message=record["message"], elapsed_ms=record["elapsed_ms"])
+        run.resumed = set(saved["steps"])
+        run._released.update(saved["released"])
+        return run
+
+    def settled(self, index):
+        """该步已完成且不再阻塞下游 (非 gate 或已放行)"""
+        return self.steps[index]["status"] == DONE and (self.workflow[index] not in self.gates
+                                                         or index in self._released)
+
+    @property
+    def waiting(self):
+        """已执行完、等待用户放行的 gate 步骤"""
+        return [i for i, s in enumerate(self.steps) if s["status"] == DONE and not self.settled(i)]
+
+    @property
+    def cursor(self):
+        """第一个尚未结束的步骤 (全部结束时等于步骤总数)"""
+        return next((i for i in range(len(self.workflow)) if not self.settled(i)), len(self.workflow))
+
+    @property
+    def finished(self):
+        return self.cursor >= len(self.workflow)
+
+    @property
+    def failed(self):
+        return self.error is not None
+
+    def subscribe(self, callback):
+        """订阅进度事件，返回取消订阅的函数"""
+        self._subscribers.append(callback)
+        return lambda: self._subscribers.remove(callback)
+
+    def _emit(self, index):
+        event = dict(self.steps[index], index=index, total=len(self.workflow),
+                     done=sum(1 for s in self.steps if s["status"] == DONE))
+        for callback in list(self._subscribers):
+            callback(event)
+
+    def _ready(self):
+        return [i for i, s in enumerate(self.steps)
+                if s["status"] == PENDING and all(self.settled(j) for j in self.deps[i])]
+
+    async def _run_step(self, index):
+        step = self.steps[index]
+        t0 = time.perf_counter()
+        try:
+            module = await asyncio.to_thread(load_tool, step["tool"])
+            message = await async_runtime.run_tool(step["tool"], module, self.context, self._events[index],
+                                                   step_timeout(step["tool"]))
+            # 耗时要在写检查点之前记下，恢复时才有值
+            step["elapsed_ms"] = (time.perf_counter() - t0) * 1000
+            step["message"] = message or ""
+            step["status"] = DONE
+            self._forget_render_digests(index)
+            if self.checkpoint:
+                await asyncio.to_thread(self._save_checkpoint, index)
+        except (asyncio.CancelledError, async_runtime.StepCancelled):
+            step["message"] = "已取消"
+            step["status"] = CANCELLED
+        except Exception as e:
+            step["message"] = str(e)
+            step["status"] = FAILED
+            self.error = e
+        if step["status"] != DONE:
+            step["elapsed_ms"] = (time.perf_counter() - t0) * 1000
+
+    async def advance_async(self):
+        """
+        并发执行所有依赖已满足的步骤，直到剩余步骤都被未放行的 gate 阻塞、出错、被取消或全部完成。
+        已执行过的步骤不会重复执行。
+        """
+        running = {}
+        try:
+            while True:
+                if not self.failed and not self.cancelled:
+                    for index in self._ready()[:max(self.max_workers - len(running), 0)]:
+                        self.steps[index]["status"] = RUNNING
+                        self._emit(index)
+                        running[asyncio.ensure_future(self._run_step(index))] = index
+                if not running:
+                    break
+                finished, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                for task in finished:
+                    self._emit(running.pop(task))
+        except asyncio.CancelledError:
+            # 整轮被取消：等待在途步骤收尾 (线程中的步骤在下一个检查点退出)
+            for task in running:
+                task.cancel()
+            await asyncio.gather(*running, return_exceptions=True)
+            for index in running.values():
+                self._emit(index)
+            raise
+        return self.cursor
+
+    def start(self):
+        """在后台事件循环中推进 (不阻塞)，返回 concurrent.futures.Future；正在推进时返回同一个 future"""
+        with self._lock:
+            if self._future is None or self._future.done():
+                self._future = async_runtime.submit(self.advance_async())
+            return self._future
+
+    def advance(self):
+        """推进并阻塞等待本轮结束，可以在每次界面刷新时安全调用"""
+        future = self.start()
+        try:
+            future.result()
+        except CancelledError:
+            pass
+        return self.cursor
+
+    def cancel(self):
+        """取消执行：未开始的步骤不再调度，正在执行的步骤收到取消信号"""
+        with self._lock:
+            self.cancelled = True
+            for event in self._events:
+                event.set()
+            if self._future is not None:
+                self._future.cancel()
+
+    def _forget_render_digests(self, index):
+        """
+        步骤可能原地修改了上下文中的 DataFrame (读到的输入或写回的输出)，
+        清除渲染缓存按对象记下的内容摘要；未声明输入输出的工具按整个上下文处理
+        """
+        render_cache = sys.modules.get("render_cache")   # 只有界面进程会导入
+        if render_cache is None:
+            return
+        spec = tool_registry.discover().get(self.workflow[index]) or {}
+        inputs, outputs = spec.get("inputs"), spec.get("outputs")
+        keys = self.context.keys() if inputs is None or outputs is None else set(inputs) | set(outputs)
+        render_cache.forget([self.context.get(key) for key in list(keys)])
+
+    def _save_checkpoint(self, index):
+        try:
+            checkpoint_store.save_step(self.workflow_id, index, self.steps[index], self.context)
+        except Exception as e:
+            # 检查点只影响恢复，写入失败不影响本次执行
+            logger.warning("%s 检查点写入失败: %s", self.steps[index]['tool'], e)
+
+    def release(self, index):
+        """
+        放行 gate 步骤并在后台继续执行下游，立即返回 start() 的 future (不阻塞)；
+        界面随后刷新，由轮询循环显示进度、响应取消
+        """
+        with self._lock:
+            self._released.add(index)
+        # 用户确认期间视图可能替换或修改了数据
+        self._forget_render_digests(index)
+        if self.checkpoint:
+            # 用户确认期间视图可能改写了输出 (如上传替换数据)，放行时重新记录
+            self._save_checkpoint(index)
+            checkpoint_store.mark_released(self.workflow_id, index)
+        return self.start()
+
+    def run_all(self):
+        """忽略 gates 一次跑完 (命令行 / 批处理)"""
+        with self._lock:
+            self._released.update(range(len(self.workflow)))
+        return self.advance()
+
+
+def run_query(query, username="cli", on_progress=None, checkpoint=False):
+    """规划并执行一条指令，返回 PipelineRun"""
+    from agent_brain import plan_workflow
+    workflow, context = plan_workflow(query)
+    context["username"] = username
+    context["query"] = query
+    pipeline = PipelineRun(workflow, context, checkpoint=checkpoint)
+    if on_progress:
+        pipeline.subscribe(on_progress)
+    pipeline.run_all()
+    return pipeline
+
+
+def _print_progress(event):
+    if event["status"] == RUNNING:
+        return
+    mark = {DONE: "✅", CANCELLED: "⏹️"}.get(event["status"], "❌")
+    print(f"[{event['index'] + 1}/{event['total']}] {mark} {event['tool']:<24} "
+          f"{event['elapsed_ms']:8.1f} ms  {event['message']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="无界面执行一条分析指令")
+    parser.add_argument("query", nargs="?", help="自然语言指令，例如 '分析7月产量趋势'")
+    parser.add_argument("--user", default="cli", help="报告提交人")
+    parser.add_argument("--demo", action="store_true", help="使用演示模式 (保留演示性延时)")
+    parser.add_argument("--metrics", default=None, help="写出 Prometheus 文本格式的步骤指标 ('-' 输出到终端)")
+    parser.add_argument("--checkpoint", action="store_true", help="每步完成后写入检查点")
+    parser.add_argument("--resume", default=None, metavar="WORKFLOW_ID", help="从检查点继续执行")
+    args = parser.parse_args()
+    if not args.query and not args.resume:
+        parser.error("需要指令或 --resume")
+
+    import instrumentation
+    import runtime_config
+    import storage
+    runtime_config.set_production_mode(not args.demo)
+    storage.init_db()
+
+    if args.resume:
+        pipeline = PipelineRun.resume(args.resume)
+        if pipeline is None:
+            print(f"工作流 {args.resume} 没有可用的检查点 (不存在或源数据已修改)")
+            sys.exit(1)
+        print(f"从检查点恢复 {len(pipeline.resumed)}/{len(pipeline.workflow)} 个步骤")
+        pipeline.subscribe(_print_progress)
+        pipeline.run_all()
+    else:
+        pipeline = run_query(args.query, username=args.user, on_progress=_print_progress,
+                             checkpoint=args.checkpoint)
+    ctx = pipeline.context
+    if pipeline.failed:
+        print(f"执行失败: {pipeline.error}")
+        sys.exit(1)
+    summary = ctx.get('trend_summary') or ctx.get('risk_summary') or ctx.get('water_summary') or "分析完成。"
+    print(f"\n{ctx.get('task_name')} 执行完成: {summary}")
+    if pipeline.checkpoint:
+        print(f"工作流 ID: {pipeline.workflow_id}")
+    if args.metrics == "-":
+        print("\n" + instrumentation.prometheus_text(), end="")
+    elif args.metrics:
+        instrumentation.write_prometheus(args.metrics)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+# render_cache.py
+"""
+工具视图的渲染缓存
+
+Streamlit 每次刷新都会重新执行 view()。对于输入没有变化的步骤，直接回放上次渲染的产物：
+- 图表缓存为 PNG 字节，表格缓存为 HTML，报告缓存为 Markdown 文本
+- 缓存键为 (工具 ID, 视图读取的输入的内容哈希, 变体)，输入变化后自动失效
+- 进程级 LRU，按产物字节数设置总上限；DataFrame / ndarray 的内容哈希按对象缓存，不会每次刷新都重算
+- 按对象缓存的哈希发现不了原地修改：工具步骤写回上下文后由执行器调用 forget() 清除相关对象的摘要，
+  视图不应原地修改上下文中的数据
+"""
+import hashlib
+import io
+import os
+import threading
+import weakref
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+# 缓存总上限 (字节)，可用环境变量 PETRO_RENDER_CACHE_MB 调整
+MAX_CACHE_BYTES = int(os.environ.get("PETRO_RENDER_CACHE_MB", "128")) * 1024 * 1024
+# 表格 HTML 最多渲染的行数
+MAX_TABLE_ROWS = 1000
+
+_lock = threading.Lock()
+_entries = OrderedDict()   # key -> (artifact, nbytes)
+_stats = {"hits": 0, "misses": 0, "evictions": 0}
+_total_bytes = 0
+_object_digests = {}       # id(obj) -> (weakref, digest)
+
+
+# ==================================================
+# 内容哈希
+# ==================================================
+def _object_digest(obj, compute):
+    """大对象按身份缓存摘要 (对象被回收后条目随之清除)"""
+    entry = _object_digests.get(id(obj))
+    if entry is not None and entry[0]() is obj:
+        return entry[1]
+    digest = compute(obj)
+    ref = weakref.ref(obj, lambda _, key=id(obj): _object_digests.pop(key, None))
+    _object_digests[id(obj)] = (ref, digest)
+    return digest
+
+
+def forget(value):
+    """清除 value (可嵌套 dict / list) 中 DataFrame / ndarray 的摘要缓存，下次按当前内容重新计算"""
+    if isinstance(value, (pd.DataFrame, pd.Series, np.ndarray)):
+        _object_digests.pop(id(value), None)
+    elif isinstance(value, dict):
+        for item in value.values():
+            forget(item)
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            forget(item)
+
+
+def _frame_digest(df):
+    h = hashlib.blake2b(digest_size=16)
+    h.update(repr(list(df.columns)).encode("utf-8"))
+    h.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    return h.digest()
+
+
+def _array_digest(arr):
+    return hashlib.blake2b(np.ascontiguousarray(arr).tobytes(), digest_size=16).digest()
+
+
+def _update(h, value):
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        h.update(_object_digest(value, _frame_digest))
+    elif isinstance(value, np.ndarray):
+        h.update(_object_digest(value, _array_digest))
+    elif isinstance(value, dict):
+        for k in sorted(value, key=repr):
+            h.update(repr(k).encode("utf-8"))
+            _update(h, value[k])
+    elif isinstance(value, (list, tuple)):
+        h.update(b"[")
+        for item in value:
+            _update(h, item)
+        h.update(b"]")
+    else:
+        h.update(repr(value).encode("utf-8"))
+
+
+def content_hash(inputs):
+    """视图输入的内容哈希 (支持 DataFrame / ndarray / dict / list / 标量的任意嵌套)"""
+    h = hashlib.blake2b(digest_size=16)
+    _update(h, inputs)
+    return h.hexdigest()
+
+
+# ==================================================
+# 缓存存取
+# ==================================================
+def _get(key):
+    with _lock:
+        entry = _entries.get(key)
+        if entry is None:
+            _stats["misses"] += 1
+            return None
+        _entries.move_to_end(key)
+        _stats["hits"] += 1
+        return entry[0]
+
+
+def _put(key, artifact):
+    global _total_bytes
+    nbytes = len(artifact)
+    if nbytes > MAX_CACHE_BYTES:
+        return
+    with _lock:
+        old = _entries.pop(key, None)
+        if old is not None:
+            _total_bytes -= old[1]
+        _entries[key] = (artifact, nbytes)
+        _total_bytes += nbytes
+        while _total_bytes > MAX_CACHE_BYTES and _entries:
+            _, (_, size) = _entries.popitem(last=False)
+            _total_bytes -= size
+            _stats["evictions"] += 1
+
+
+def cached(tool_id, inputs, build, variant=""):
+    """命中返回缓存产物，否则调用 build() 生成并缓存；返回 (产物, 是否命中)"""
+    key = (tool_id, content_hash(inputs), variant)
+    artifact = _get(key)
+    if artifact is not None:
+        return artifact, True
+    artifact = build()
+    _put(key, artifact)
+    return artifact, False
+
+
+def seen(tool_id, inputs, variant=""):
+    """该输入是否已经渲染过 (用于跳过打字机等只需播放一次的效果)"""
+    key = (tool_id, content_hash(inputs), variant)
+    with _lock:
+        return key in _entries
+
+
+# ==================================================
+# Streamlit 回放
+# ==================================================
+def figure_png(fig, dpi=120):
+    import matplotlib.pyplot as plt
+    buf = io.BytesIO()
+    fig.savefig(buf, format="png", dpi=dpi, bbox_inches="tight")
+    plt.close(fig)
+    return buf.getvalue()
+
+
+def pyplot(tool_id, inputs, build_fig, variant=""):
+    """渲染 matplotlib 图表：build_fig() 只在未命中时调用，结果以 PNG 回放"""
+    png, hit = cached(tool_id, inputs, lambda: figure_png(build_fig()), variant)
+    st.image(png, use_container_width=True)
+    return hit
+
+
+def styled_table(tool_id, inputs, build_styler, variant="", height=420):
+    """渲染带样式的表格：build_styler() 只在未命中时调用，结果以 HTML 回放"""
+    def build():
+        html = build_styler().to_html()
+        return f'<div style="max-height:{height}px;overflow:auto">{html}</div>'.encode("utf-8")
+
+    html, hit = cached(tool_id, inputs, build, variant)
+    st.html(html.decode("utf-8"))
+    return hit
+
+
+def cache_stats():
+    with _lock:
+        total = _stats["hits"] + _stats["misses"]
+        return dict(_stats, entries=len(_entries), bytes=_total_bytes, max_bytes=MAX_CACHE_BYTES,
+                    hit_rate=_stats["hits"] / total if total else 0.0)
+
+
+def clear_cache():
+    global _total_bytes
+    with _lock:
+        _entries.clear()
+        _total_bytes = 0
+        for key in _stats:
+            _stats[key] = 0
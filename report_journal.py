@@ -0,0 +1,337 @@
+# report_journal.py
+"""
+报告审批流的追加式事件日志 (append-only JSONL)
+
+- 提交 / 批准 / 驳回 / 清除通知 均只向日志末尾追加一行事件，I/O 与历史报告总量无关
+- 进程内维护一份物化视图 (报告字典 + 按状态的索引)，按文件偏移增量回放日志
+- 后台线程定期压缩：把日志事件批量落入 SQLite 快照 (storage.reports) 后清空日志
+- 跨进程并发：追加与压缩都持有日志的建议锁；审批类操作带乐观版本校验
+"""
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+import storage
+from safe_io import file_lock, atomic_write_bytes
+
+JOURNAL_FILE = os.environ.get("PETRO_REPORT_JOURNAL", "reports.journal.jsonl")
+
+logger = logging.getLogger(__name__)
+
+# 压缩触发条件：累计事件数 / 日志字节数 任一超限，或定时检查
+COMPACT_MAX_EVENTS = 500
+COMPACT_MAX_BYTES = 4 * 1024 * 1024
+COMPACT_INTERVAL = 60
+
+EVENT_TYPES = ("submitted", "approved", "rejected", "cleared")
+
+_lock = threading.RLock()
+_compact_signal = threading.Event()
+_compactor = None
+
+# 物化视图状态
+_reports = {}       # id -> report (插入顺序即提交顺序)
+_by_status = {}     # status -> {id: None} (有序集合)
+_offset = 0         # 已回放到的日志字节偏移
+_journal_ino = None  # 当前回放的日志文件 inode，压缩替换文件后会变化
+_loaded_for = None  # 视图对应的 (DB 文件, 日志文件)
+_pending_events = 0
+
+
+class ReportConflictError(Exception):
+    """报告已被其他会话处理或修改 (乐观版本校验失败)"""
+
+
+# ==================================================
+# 物化视图
+# ==================================================
+def _index_set(report, status):
+    old = report.get("status")
+    if old in _by_status:
+        _by_status[old].pop(report["id"], None)
+    report["status"] = status
+    _by_status.setdefault(status, {})[report["id"]] = None
+
+
+def _apply(event):
+    etype = event["type"]
+    if etype == "submitted":
+        report = dict(event["report"])
+        if report["id"] in _reports:
+            return
+        status = report.pop("status", "pending") or "pending"
+        report["version"] = 1
+        _reports[report["id"]] = report
+        _index_set(report, status)
+    elif etype in ("approved", "rejected"):
+        report = _reports.get(event["id"])
+        if report is not None:
+            report["feedback"] = event.get("feedback", "")
+            report["version"] = event["version"]
+            _index_set(report, etype)
+    elif etype == "cleared":
+        for rid, version in zip(event["ids"], event["versions"]):
+            report = _reports.get(rid)
+            if report is not None:
+                report["version"] = version
+                _index_set(report, "cleared")
+
+
+def _reload():
+    """从 SQLite 快照 + 完整日志重建视图"""
+    global _offset, _journal_ino, _loaded_for
+    while True:
+        generation = storage.get_report_generation()
+        _reports.clear()
+        _by_status.clear()
+        for report in reversed(storage.list_reports()):
+            _reports[report["id"]] = report
+            _by_status.setdefault(report["status"], {})[report["id"]] = None
+        _offset = 0
+        _journal_ino = _stat_ino()
+        # 快照读取期间若发生压缩，快照与日志可能错位，重读一次
+        if _replay_tail() and storage.get_report_generation() == generation:
+            break
+    _loaded_for = (storage.DB_FILE, JOURNAL_FILE)
+
+
+def _stat_ino():
+    try:
+        return os.stat(JOURNAL_FILE).st_ino
+    except FileNotFoundError:
+        return None
+
+
+def _replay_tail():
+    """
+    从当前偏移回放新增的完整事件行 (不完整的末行留到下次)。
+    返回 False 表示日志已被其它进程压缩替换，需要重建视图。
+    """
+    global _offset
+    try:
+        f = open(JOURNAL_FILE, "rb")
+    except FileNotFoundError:
+        return _journal_ino is None
+    with f:
+        if os.fstat(f.fileno()).st_ino != _journal_ino:
+            return False
+        f.seek(_offset)
+        chunk = f.read()
+    end = chunk.rfind(b"\n")
+    if end < 0:
+        return True
+    for line in chunk[:end].splitlines():
+        if line.strip():
+            _apply(json.loads(line))
+    _offset += end + 1
+    return True
+
+
+def refresh():
+    """同步其它会话 / 进程追加的事件到本地视图"""
+    with _lock:
+        if _loaded_for != (storage.DB_FILE, JOURNAL_FILE) or not _replay_tail():
+            _reload()
+
+
+# ==================================================
+# 事件写入
+# ==================================================
+def _append_locked(*events):
+    """
+    在已持有日志锁的前提下追加事件 (多条事件合并为一次 write，O(1) I/O)。
+    提交的报告 ID 已存在时抛出 ReportConflictError，整批都不写入。
+    """
+    global _pending_events
+    lines = []
+    submitted = set()
+    for event in events:
+        if event["type"] not in EVENT_TYPES:
+            raise ValueError(f"未知的报告事件类型: {event['type']}")
+        if event["type"] == "submitted":
+            if event["id"] in _reports or event["id"] in submitted:
+                raise ReportConflictError(f"报告 {event['id']} 已存在")
+            submitted.add(event["id"])
+        event.setdefault("ts", time.time())
+        lines.append(json.dumps(event, ensure_ascii=False) + "\n")
+    with open(JOURNAL_FILE, "ab") as f:
+        f.write("".join(lines).encode("utf-8"))
+    refresh()
+    _pending_events += len(events)
+    if _pending_events >= COMPACT_MAX_EVENTS or _offset >= COMPACT_MAX_BYTES:
+        _compact_signal.set()
+
+
+def append_event(event):
+    """加锁追加一条事件到日志末尾并更新本地视图"""
+    with _lock, file_lock(JOURNAL_FILE):
+        refresh()
+        _append_locked(event)
+    _ensure_compactor()
+
+
+def _transition(report_id, etype, expected_version=None, **payload):
+    """
+    审批状态流转 (仅允许从 pending 出发)。
+    在日志锁内先同步视图再校验版本，保证并发审批人只有一个能成功。
+    """
+    with _lock, file_lock(JOURNAL_FILE):
+        refresh()
+        report = _reports.get(report_id)
+        if report is None:
+            raise ReportConflictError(f"报告 {report_id} 不存在")
+        if expected_version is not None and report["version"] != expected_version:
+            raise ReportConflictError(f"报告 {report_id} 已被修改 (版本 {report['version']} != {expected_version})")
+        if report["status"] != "pending":
+            raise ReportConflictError(f"报告 {report_id} 已被处理 (当前状态: {report['status']})")
+        # 事件携带流转后的版本号，重复回放时结果不变
+        version = report["version"] + 1
+        _append_locked({"type": etype, "id": report_id, "version": version, **payload})
+    _ensure_compactor()
+    return version
+
+
+def _submitted_event(report):
+    report = dict(report)
+    # 未指定 ID 时分配随机 ID，同一秒内的并发提交不会撞号
+    if not report.get("id"):
+        report["id"] = f"RPT-{uuid.uuid4().hex}"
+    report.setdefault("status", "pending")
+    report.setdefault("feedback", "")
+    report.pop("version", None)
+    return {"type": "submitted", "id": report["id"], "report": report}
+
+
+def submit_report(report):
+    """提交新报告 (默认状态 pending)，返回报告 ID；指定的 ID 已存在时抛出 ReportConflictError"""
+    event = _submitted_event(report)
+    append_event(event)
+    return event["id"]
+
+
+def submit_reports(reports):
+    """批量提交报告：一次加锁、一次写入，返回报告 ID 列表"""
+    events = [_submitted_event(r) for r in reports]
+    if events:
+        with _lock, file_lock(JOURNAL_FILE):
+            refresh()
+            _append_locked(*events)
+        _ensure_compactor()
+    return [e["id"] for e in events]
+
+
+def approve_report(report_id, expected_version=None):
+    """批准报告，返回新版本号；已被他人处理时抛出 ReportConflictError"""
+    return _transition(report_id, "approved", expected_version)
+
+
+def reject_report(report_id, feedback="", expected_version=None):
+    """驳回报告，返回新版本号；已被他人处理时抛出 ReportConflictError"""
+    return _transition(report_id, "rejected", expected_version, feedback=feedback)
+
+
+def clear_rejected(submitter):
+    """清除某用户的驳回通知，返回清除条数"""
+    with _lock, file_lock(JOURNAL_FILE):
+        refresh()
+        ids = [rid for rid in _by_status.get("rejected", {}) if _reports[rid]["submitter"] == submitter]
+        if ids:
+            versions = [_reports[rid]["version"] + 1 for rid in ids]
+            _append_locked({"type": "cleared", "ids": ids, "versions": versions})
+    _ensure_compactor()
+    return len(ids)
+
+
+# ==================================================
+# 查询 (全部走内存视图)
+# ==================================================
+def list_reports(status=None, submitter=None, limit=None):
+    """按状态 / 提交人查询报告 (最新在前)"""
+    with _lock:
+        refresh()
+        ids = _by_status.get(status, {}) if status is not None else _reports
+        result = []
+        for rid in reversed(ids):
+            report = _reports[rid]
+            if submitter is not None and report["submitter"] != submitter:
+                continue
+            result.append(dict(report))
+            if limit and len(result) >= limit:
+                break
+        return result
+
+
+def count_reports(status=None):
+    with _lock:
+        refresh()
+        return len(_by_status.get(status, {})) if status is not None else len(_reports)
+
+
+def get_report(report_id):
+    with _lock:
+        refresh()
+        report = _reports.get(report_id)
+        return dict(report) if report else None
+
+
+# ==================================================
+# 压缩
+# ==================================================
+def compact():
+    """把日志中的事件落入 SQLite 快照，然后用剩余尾部替换日志文件 (持有日志锁)"""
+    global _pending_events, _offset, _journal_ino
+    with _lock, file_lock(JOURNAL_FILE):
+        refresh()
+        try:
+            with open(JOURNAL_FILE, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return 0
+        end = data.rfind(b"\n")
+        if end < 0:
+            return 0
+        events = [json.loads(line) for line in data[:end].splitlines() if line.strip()]
+        # 1. 先落库 (幂等)，崩溃后重放也不会出错
+        storage.apply_report_events(events)
+        # 2. 再用未完整写入的尾部原子替换日志
+        atomic_write_bytes(JOURNAL_FILE, data[end + 1:])
+        # 本地视图已包含这些事件，只需同步偏移
+        _offset = 0
+        _journal_ino = _stat_ino()
+        _replay_tail()
+        _pending_events = 0
+        return len(events)
+
+
+def _compactor_loop():
+    while True:
+        _compact_signal.wait(COMPACT_INTERVAL)
+        _compact_signal.clear()
+        try:
+            # 定时检查：日志非空即压缩 (包括其它进程追加的事件)
+            if os.path.getsize(JOURNAL_FILE) > 0:
+                compact()
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning("压缩失败: %s", e)
+
+
+def _ensure_compactor():
+    """惰性启动后台压缩线程 (每个进程一个)"""
+    global _compactor
+    if _compactor is not None and _compactor.is_alive():
+        return
+    with _lock:
+        if _compactor is None or not _compactor.is_alive():
+            _compactor = threading.Thread(target=_compactor_loop, name="report-journal-compactor", daemon=True)
+            _compactor.start()
+
+
+if __name__ == "__main__":
+    # 手动触发一次压缩: python report_journal.py
+    storage.init_db()
+    print(f"已压缩 {compact()} 条事件 -> {storage.DB_FILE}")
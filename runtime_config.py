@@ -0,0 +1,43 @@
+# runtime_config.py
+"""
+运行模式配置
+
+- 演示模式 (默认)：保留思考动画、进度条跑动、打字机效果等演示性延时
+- 生产模式 (PETRO_PRODUCTION_MODE=1)：跳过所有演示性延时，进度只按真实完成的步骤推进
+
+演示性的等待统一调用 pause() (异步工具用 await sleep())，不要在业务代码里直接 time.sleep。
+在工具链步骤中的等待可以被取消 (见 async_runtime)。
+"""
+import asyncio
+import os
+import time
+
+import async_runtime
+
+PRODUCTION_MODE = os.environ.get("PETRO_PRODUCTION_MODE", "0").lower() in ("1", "true", "yes", "on")
+
+
+def set_production_mode(enabled=True):
+    """命令行 / 基准测试中切换运行模式"""
+    global PRODUCTION_MODE
+    PRODUCTION_MODE = bool(enabled)
+
+
+def is_production():
+    return PRODUCTION_MODE
+
+
+def pause(seconds):
+    """演示性延时：生产模式下直接跳过；在步骤中执行时，步骤被取消会立即抛出 StepCancelled"""
+    if PRODUCTION_MODE or seconds <= 0:
+        async_runtime.checkpoint()
+    elif async_runtime.current_event() is not None:
+        async_runtime.wait(seconds)
+    else:
+        time.sleep(seconds)
+
+
+async def sleep(seconds):
+    """pause() 的异步版本"""
+    if not PRODUCTION_MODE and seconds > 0:
+        await asyncio.sleep(seconds)
@@ -0,0 +1,66 @@
+# safe_io.py
+"""
+共享的安全写入工具
+
+- file_lock: 跨进程的建议锁 (POSIX flock / Windows msvcrt)，锁在独立的 .lock 文件上，
+  被保护的文件本身可以被原子替换而不影响锁
+- atomic_write_bytes / atomic_write_json: 先写临时文件并 fsync，再 os.replace 原子替换，
+  读取方永远不会看到写了一半的文件
+"""
+import contextlib
+import json
+import os
+import tempfile
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+@contextlib.contextmanager
+def file_lock(path, shared=False):
+    """对 path 加跨进程建议锁 (阻塞等待)；shared=True 为读锁 (仅 POSIX 生效)"""
+    lock_path = path + ".lock"
+    with open(lock_path, "a+b") as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+        else:
+            f.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    # LK_LOCK 最多重试 10 秒，超时后继续等待
+                    continue
+            try:
+                yield
+            finally:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def atomic_write_bytes(path, data):
+    """原子写入：同目录临时文件 + fsync + os.replace"""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix=".tmp-", dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(tmp_path)
+        raise
+
+
+def atomic_write_json(path, data, indent=4):
+    atomic_write_bytes(path, json.dumps(data, ensure_ascii=False, indent=indent).encode("utf-8"))
@@ -0,0 +1,363 @@
+# storage.py
+"""
+嵌入式事务存储层 (SQLite WAL)
+
+替代原先对 users.json / reports.json 的整文件读写：
+- 用户、历史索引、报告、统计数据分表存储，按用户 / 报告ID / 状态建立索引
+- reports 表是报告事件日志 (report_journal) 压缩后的快照，报告写入统一走事件日志
+- 每个线程复用一个连接，WAL 模式下读写互不阻塞
+- 首次启动时从旧 JSON 文件一次性迁移
+"""
+import sqlite3
+import json
+import os
+import threading
+
+DB_FILE = os.environ.get("PETRO_DB_FILE", "petro.db")
+
+# 旧版 JSON 数据文件 (仅作为迁移来源)
+USER_DB_FILE = "users.json"
+REPORT_DB_FILE = "reports.json"
+STATS_FILE = "manager_stats.json"
+
+DEFAULT_USERS = {
+    "mr.gong": {"password": "123456", "role": "admin", "model_states": {}},
+    "user": {"password": "123", "role": "user", "model_states": {}},
+}
+
+REPORT_FIELDS = ("id", "submitter", "task_name", "submit_time", "status", "feedback", "file_path", "summary")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    username     TEXT PRIMARY KEY,
+    password     TEXT NOT NULL,
+    role         TEXT NOT NULL DEFAULT 'user',
+    model_path   TEXT NOT NULL DEFAULT '',
+    model_states TEXT NOT NULL DEFAULT '{}'
+);
+
+CREATE TABLE IF NOT EXISTS user_history (
+    seq        INTEGER PRIMARY KEY AUTOINCREMENT,
+    username   TEXT NOT NULL,
+    id         TEXT NOT NULL,
+    title      TEXT NOT NULL DEFAULT '',
+    file_path  TEXT NOT NULL DEFAULT '',
+    updated_at TEXT NOT NULL DEFAULT '',
+    UNIQUE (username, id)
+);
+CREATE INDEX IF NOT EXISTS idx_history_user ON user_history (username, seq);
+
+CREATE TABLE IF NOT EXISTS reports (
+    seq         INTEGER PRIMARY KEY AUTOINCREMENT,
+    id          TEXT NOT NULL UNIQUE,
+    submitter   TEXT NOT NULL,
+    task_name   TEXT NOT NULL DEFAULT '',
+    submit_time TEXT NOT NULL DEFAULT '',
+    status      TEXT NOT NULL DEFAULT 'pending',
+    feedback    TEXT NOT NULL DEFAULT '',
+    file_path   TEXT NOT NULL DEFAULT '',
+    summary     TEXT NOT NULL DEFAULT '',
+    version     INTEGER NOT NULL DEFAULT 1
+);
+CREATE INDEX IF NOT EXISTS idx_reports_status ON reports (status, seq);
+CREATE INDEX IF NOT EXISTS idx_reports_submitter ON reports (submitter, status);
+
+CREATE TABLE IF NOT EXISTS kv (
+    key   TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+_local = threading.local()
+_init_lock = threading.Lock()
+_initialized = set()
+
+
+def get_conn():
+    """获取当前线程的数据库连接 (懒创建，WAL 模式)"""
+    conns = getattr(_local, "conns", None)
+    if conns is None:
+        conns = _local.conns = {}
+    conn = conns.get(DB_FILE)
+    if conn is None:
+        conn = sqlite3.connect(DB_FILE, timeout=30)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=30000")
+        conns[DB_FILE] = conn
+    return conn
+
+
+def init_db():
+    """建表 + 首次从 JSON 迁移 + 保证默认账号存在 (每个进程只执行一次)"""
+    if DB_FILE in _initialized:
+        return
+    with _init_lock:
+        if DB_FILE in _initialized:
+            return
+        conn = get_conn()
+        conn.executescript(SCHEMA)
+        _upgrade_schema(conn)
+        migrate_from_json()
+        with conn:
+            for username, info in DEFAULT_USERS.items():
+                conn.execute(
+                    "INSERT OR IGNORE INTO users (username, password, role, model_states) VALUES (?, ?, ?, ?)",
+                    (username, info["password"], info["role"], json.dumps(info["model_states"])),
+                )
+        _initialized.add(DB_FILE)
+
+
+def _upgrade_schema(conn):
+    """为旧版数据库补齐新增列"""
+    columns = {row["name"] for row in conn.execute("PRAGMA table_info(reports)")}
+    if "version" not in columns:
+        with conn:
+            conn.execute("ALTER TABLE reports ADD COLUMN version INTEGER NOT NULL DEFAULT 1")
+
+
+def migrate_from_json(user_file=USER_DB_FILE, report_file=REPORT_DB_FILE, stats_file=STATS_FILE, force=False):
+    """
+    一次性迁移旧版 JSON 数据到 SQLite。
+    迁移完成后在 kv 表写入标记，之后的启动不再重复导入 (force=True 可强制重导)。
+    """
+    conn = get_conn()
+    conn.executescript(SCHEMA)
+    if not force and get_meta("json_migrated"):
+        return False
+
+    users = _read_json(user_file, {})
+    reports = _read_json(report_file, [])
+    stats = _read_json(stats_file, {})
+
+    with conn:
+        for username, info in users.items():
+            conn.execute(
+                "INSERT OR REPLACE INTO users (username, password, role, model_path, model_states) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (username, info.get("password", ""), info.get("role", "user"), info.get("model_path", ""),
+                 json.dumps(info.get("model_states", {}), ensure_ascii=False)),
+            )
+            # JSON 中历史记录最新在前，按倒序插入使 seq 越大越新
+            for item in reversed(info.get("history", [])):
+                conn.execute(
+                    "INSERT OR REPLACE INTO user_history (username, id, title, file_path, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (username, item["id"], item.get("title", ""), item.get("file_path", ""),
+                     item.get("updated_at", "")),
+                )
+
+        # 报告同样是最新在前
+        for report in reversed(reports):
+            report = dict(report)
+            # 兼容早期字段名 file_name
+            report.setdefault("file_path", report.get("file_name", ""))
+            conn.execute(
+                "INSERT OR IGNORE INTO reports (id, submitter, task_name, submit_time, status, feedback, "
+                "file_path, summary) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                tuple(report.get(k) or "" for k in REPORT_FIELDS[:4])
+                + (report.get("status") or "pending",)
+                + tuple(report.get(k) or "" for k in REPORT_FIELDS[5:]),
+            )
+
+        for key, value in stats.items():
+            conn.execute("INSERT OR REPLACE INTO kv (key, value) VALUES (?, ?)", (f"stats.{key}", json.dumps(value)))
+
+        conn.execute("INSERT OR REPLACE INTO kv (key, value) VALUES ('json_migrated', '1')")
+    return True
+
+
+def _read_json(path, default):
+    # 只有文件不存在时才使用默认值；损坏的文件直接报错，避免静默丢数据
+    if not os.path.exists(path):
+        return default
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+# ==================================================
+# KV / 统计
+# ==================================================
+def get_meta(key, default=None):
+    row = get_conn().execute("SELECT value FROM kv WHERE key = ?", (key,)).fetchone()
+    return row["value"] if row else default
+
+
+def get_stat(name, default=0):
+    value = get_meta(f"stats.{name}")
+    return json.loads(value) if value is not None else default
+
+
+def incr_stat(name, default=0, step=1):
+    """原子自增统计计数，返回自增后的值"""
+    conn = get_conn()
+    key = f"stats.{name}"
+    with conn:
+        conn.execute("INSERT OR IGNORE INTO kv (key, value) VALUES (?, ?)", (key, json.dumps(default)))
+        conn.execute("UPDATE kv SET value = CAST(value AS INTEGER) + ? WHERE key = ?", (step, key))
+    return get_stat(name, default)
+
+
+# ==================================================
+# 用户
+# ==================================================
+def _user_from_row(row):
+    user = dict(row)
+    user["model_states"] = json.loads(user["model_states"] or "{}")
+    return user
+
+
+def get_user(username):
+    """按用户名查询用户 (不含历史记录)，不存在返回 None"""
+    if not username:
+        return None
+    row = get_conn().execute("SELECT * FROM users WHERE username = ?", (username,)).fetchone()
+    return _user_from_row(row) if row else None
+
+
+def create_user(username, password, role="user", model_path=""):
+    """注册新用户，用户已存在时返回 False"""
+    conn = get_conn()
+    with conn:
+        cur = conn.execute(
+            "INSERT OR IGNORE INTO users (username, password, role, model_path) VALUES (?, ?, ?, ?)",
+            (username, password, role, model_path),
+        )
+    return cur.rowcount == 1
+
+
+def set_model_state(username, model_key, state):
+    """更新用户的模型状态，state 为 None 时删除该模型记录"""
+    conn = get_conn()
+    with conn:
+        # 读-改-写需要写锁，避免并发会话互相覆盖
+        conn.execute("BEGIN IMMEDIATE")
+        row = conn.execute("SELECT model_states FROM users WHERE username = ?", (username,)).fetchone()
+        if row is None:
+            return
+        states = json.loads(row["model_states"] or "{}")
+        if state is None:
+            states.pop(model_key, None)
+        else:
+            states[model_key] = state
+        conn.execute("UPDATE users SET model_states = ? WHERE username = ?",
+                     (json.dumps(states, ensure_ascii=False), username))
+
+
+# ==================================================
+# 历史存档索引
+# ==================================================
+def list_history(username, limit=None):
+    """返回用户的历史存档索引 (最新在前)"""
+    sql = "SELECT id, title, file_path, updated_at FROM user_history WHERE username = ? ORDER BY seq DESC"
+    params = [username]
+    if limit:
+        sql += " LIMIT ?"
+        params.append(limit)
+    return [dict(r) for r in get_conn().execute(sql, params)]
+
+
+def get_history_item(username, history_id):
+    row = get_conn().execute(
+        "SELECT id, title, file_path, updated_at FROM user_history WHERE username = ? AND id = ?",
+        (username, history_id),
+    ).fetchone()
+    return dict(row) if row else None
+
+
+def upsert_history(username, item):
+    """新增或更新历史记录；已存在的 ID 会被移动到最前"""
+    conn = get_conn()
+    with conn:
+        conn.execute("DELETE FROM user_history WHERE username = ? AND id = ?", (username, item["id"]))
+        conn.execute(
+            "INSERT INTO user_history (username, id, title, file_path, updated_at) VALUES (?, ?, ?, ?, ?)",
+            (username, item["id"], item.get("title", ""), item.get("file_path", ""), item.get("updated_at", "")),
+        )
+
+
+# ==================================================
+# 报告
+# ==================================================
+def _report_from_row(row):
+    report = dict(row)
+    report.pop("seq", None)
+    return report
+
+
+def get_report(report_id):
+    row = get_conn().execute("SELECT * FROM reports WHERE id = ?", (report_id,)).fetchone()
+    return _report_from_row(row) if row else None
+
+
+def list_reports(status=None, submitter=None, limit=None):
+    """按状态 / 提交人查询报告 (最新在前)，走索引"""
+    clauses, params = [], []
+    if status is not None:
+        clauses.append("status = ?")
+        params.append(status)
+    if submitter is not None:
+        clauses.append("submitter = ?")
+        params.append(submitter)
+    sql = "SELECT * FROM reports"
+    if clauses:
+        sql += " WHERE " + " AND ".join(clauses)
+    sql += " ORDER BY seq DESC"
+    if limit:
+        sql += " LIMIT ?"
+        params.append(limit)
+    return [_report_from_row(r) for r in get_conn().execute(sql, params)]
+
+
+def count_reports(status=None, submitter=None):
+    clauses, params = [], []
+    if status is not None:
+        clauses.append("status = ?")
+        params.append(status)
+    if submitter is not None:
+        clauses.append("submitter = ?")
+        params.append(submitter)
+    sql = "SELECT COUNT(*) FROM reports"
+    if clauses:
+        sql += " WHERE " + " AND ".join(clauses)
+    return get_conn().execute(sql, params).fetchone()[0]
+
+
+def apply_report_events(events):
+    """
+    将报告事件日志批量落库 (由 report_journal 压缩时调用)。
+    事件均为幂等操作，重复回放不会改变结果；同一事务内推进压缩代数。
+    """
+    conn = get_conn()
+    with conn:
+        for event in events:
+            etype = event["type"]
+            if etype == "submitted":
+                report = event["report"]
+                conn.execute(
+                    "INSERT OR IGNORE INTO reports (id, submitter, task_name, submit_time, status, feedback, "
+                    "file_path, summary) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    tuple(report.get(k) or "" for k in REPORT_FIELDS),
+                )
+            elif etype in ("approved", "rejected"):
+                conn.execute("UPDATE reports SET status = ?, feedback = ?, version = ? WHERE id = ?",
+                             (etype, event.get("feedback", ""), event["version"], event["id"]))
+            elif etype == "cleared":
+                conn.executemany("UPDATE reports SET status = 'cleared', version = ? WHERE id = ?",
+                                 [(version, rid) for rid, version in zip(event["ids"], event["versions"])])
+        conn.execute("INSERT OR IGNORE INTO kv (key, value) VALUES ('report_generation', '0')")
+        conn.execute("UPDATE kv SET value = CAST(value AS INTEGER) + 1 WHERE key = 'report_generation'")
+
+
+def get_report_generation():
+    """报告快照的压缩代数，用于读取方检测快照与日志是否被并发替换"""
+    return int(get_meta("report_generation", "0"))
+
+
+if __name__ == "__main__":
+    # 手动执行一次性迁移: python storage.py
+    migrated = migrate_from_json()
+    init_db()
+    print(f"{'迁移完成' if migrated else '已迁移过，跳过'} -> {DB_FILE} | 用户 {get_conn().execute('SELECT COUNT(*) FROM users').fetchone()[0]} | "
+          f"报告 {count_reports()}")
@@ -0,0 +1,139 @@
+# tool_registry.py
+"""
+工具注册表 (每个进程只预热一次)
+
+- 启动时扫描 tools/tool_*.py，用 ast 静态读取模块级的 META / INPUTS / OUTPUTS 并校验存在 run / view，
+  不需要导入模块 (不触发 pandas / matplotlib 等重依赖的加载)
+- 后台线程按顺序预导入全部合法工具，用户进入分析页时模块已经就绪
+- load() 从注册表取模块；预热尚未完成时直接导入 (导入锁保证同一模块只执行一次)
+"""
+import ast
+import importlib
+import os
+import threading
+import time
+
+TOOLS_PACKAGE = "tools"
+TOOLS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), TOOLS_PACKAGE)
+REQUIRED_FUNCTIONS = ("run", "view")
+
+_lock = threading.Lock()
+_specs = None         # tool_id -> {"meta", "inputs", "outputs", "path"}
+_invalid = {}         # tool_id -> 校验失败原因
+_modules = {}         # tool_id -> 已导入的模块
+_preload_thread = None
+_preload_stats = {"started": None, "finished": None, "elapsed_ms": None, "errors": {}}
+
+
+def _literal(node):
+    try:
+        return ast.literal_eval(node)
+    except (ValueError, TypeError, SyntaxError):
+        return None
+
+
+def _scan(path):
+    """静态解析工具源码，返回 (spec, 错误原因)"""
+    with open(path, "r", encoding="utf-8") as f:
+        tree = ast.parse(f.read(), filename=path)
+    functions = {n.name for n in tree.body if isinstance(n, ast.FunctionDef)}
+    missing = [name for name in REQUIRED_FUNCTIONS if name not in functions]
+    if missing:
+        return None, f"缺少函数: {', '.join(missing)}"
+    constants = {}
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and len(node.targets) == 1 and isinstance(node.targets[0], ast.Name):
+            constants[node.targets[0].id] = node.value
+    meta = _literal(constants["META"]) if "META" in constants else None
+    spec = {
+        "path": path,
+        "meta": meta or {},
+        "inputs": _literal(constants["INPUTS"]) if "INPUTS" in constants else None,
+        "outputs": _literal(constants["OUTPUTS"]) if "OUTPUTS" in constants else None,
+    }
+    return spec, None
+
+
+def discover(refresh=False):
+    """扫描工具目录，返回 {tool_id: spec} (按 META['order'] 与文件名排序)"""
+    global _specs
+    with _lock:
+        if _specs is not None and not refresh:
+            return _specs
+        specs, invalid = {}, {}
+        for name in sorted(os.listdir(TOOLS_DIR)):
+            if not (name.startswith("tool_") and name.endswith(".py")):
+                continue
+            tool_id = name[:-3]
+            try:
+                spec, error = _scan(os.path.join(TOOLS_DIR, name))
+            except SyntaxError as e:
+                spec, error = None, f"语法错误: {e}"
+            if error:
+                invalid[tool_id] = error
+            else:
+                specs[tool_id] = spec
+        _specs = dict(sorted(specs.items(), key=lambda kv: (kv[1]["meta"].get("order", 99), kv[0])))
+        _invalid.clear()
+        _invalid.update(invalid)
+        return _specs
+
+
+def invalid_tools():
+    discover()
+    return dict(_invalid)
+
+
+def tool_meta():
+    """{tool_id: {"name", "icon", ...}}，供界面展示 (TOOL_META)"""
+    return {tool_id: dict({"name": tool_id, "icon": "🔧"}, **spec["meta"]) for tool_id, spec in discover().items()}
+
+
+def model_key(tool_id):
+    """深度模型工具对应的模型库 ID (如 tool_trend_algo -> model_trend)；普通工具返回自身 ID"""
+    spec = discover().get(tool_id)
+    return (spec["meta"].get("model_key") if spec else None) or tool_id
+
+
+def load(tool_id):
+    """取工具模块 (已预热则直接返回)，并校验 run / view 可调用"""
+    module = _modules.get(tool_id)
+    if module is not None:
+        return module
+    if tool_id in invalid_tools():
+        raise ImportError(f"工具 {tool_id} 不可用: {_invalid[tool_id]}")
+    module = importlib.import_module(f"{TOOLS_PACKAGE}.{tool_id}")
+    for name in REQUIRED_FUNCTIONS:
+        if not callable(getattr(module, name, None)):
+            raise ImportError(f"工具 {tool_id} 缺少可调用的 {name}()")
+    _modules[tool_id] = module
+    return module
+
+
+def _preload():
+    t0 = time.perf_counter()
+    for tool_id in discover():
+        try:
+            load(tool_id)
+        except Exception as e:
+            _preload_stats["errors"][tool_id] = str(e)
+    _preload_stats["elapsed_ms"] = (time.perf_counter() - t0) * 1000
+    _preload_stats["finished"] = time.time()
+
+
+def preload(background=True):
+    """预导入全部工具 (每个进程只执行一次)；background=False 时阻塞直到完成"""
+    global _preload_thread
+    with _lock:
+        if _preload_thread is None:
+            _preload_stats["started"] = time.time()
+            _preload_thread = threading.Thread(target=_preload, name="tool-preload", daemon=True)
+            _preload_thread.start()
+        thread = _preload_thread
+    if not background:
+        thread.join()
+    return thread
+
+
+def preload_stats():
+    return dict(_preload_stats, loaded=len(_modules), discovered=len(discover()), invalid=len(_invalid))
@@ -1,20 +1,20 @@
 # tools/tool_approval_flow.py
 import streamlit as st
-import time
-import json
-import os
+import asyncio
 import datetime
-import random
+import report_journal
+import runtime_config
 
-REPORT_DB_FILE = "reports.json"
+META = {"name": "自动审批流程推送", "icon": "📤", "order": 10, "timeout": 30}
+INPUTS = ('username', 'task_name', 'target_file', 'generated_report_content', 'trend_summary', 'risk_summary', 'water_summary')
+OUTPUTS = ('approval_saved',)
 
 
-def save_report_to_db(context):
-    """将当前任务保存到本地 JSON 数据库"""
-    # 1. 构造报告数据对象
-    new_report = {
-        "id": f"TASK-{int(time.time())}-{random.randint(100, 999)}",
-        "submitter": st.session_state.get("username", "Unknown"),  # 从全局状态获取提交人
+def build_report_record(context, report_id=None):
+    """构造待审批的报告记录 (批处理会收集后统一提交)"""
+    return {
+        "id": report_id,  # 为空时由报告日志分配不重复的 ID
+        "submitter": context.get("username") or st.session_state.get("username", "Unknown"),  # 优先取上下文中的提交人
         "task_name": context.get("task_name", "通用分析任务"),
         "submit_time": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
         "file_path": context.get("target_file", ""),
@@ -24,28 +24,15 @@ def save_report_to_db(context):
         "status": "pending"
     }
 
-    # 2. 读取现有数据
-    reports = []
-    if os.path.exists(REPORT_DB_FILE):
-        try:
-            with open(REPORT_DB_FILE, "r", encoding='utf-8') as f:
-                reports = json.load(f)
-        except:
-            reports = []
-
-    # 3. 追加新报告 (放在最前面)
-    reports.insert(0, new_report)
-
-    # 4. 写入文件
-    with open(REPORT_DB_FILE, "w", encoding='utf-8') as f:
-        json.dump(reports, f, ensure_ascii=False, indent=4)
 
-    return new_report["id"]
+def save_report_to_db(context):
+    """将当前任务追加到报告事件日志 (单行追加，与历史报告数量无关)"""
+    return report_journal.submit_report(build_report_record(context))
 
 
 def run(context):
     # 模拟网络推送延迟
-    time.sleep(1.5)
+    runtime_config.pause(1.5)
 
     # --- 核心修改：执行保存逻辑 ---
     # 只有当这个任务还没保存过时才保存（防止页面刷新重复写入）
@@ -57,6 +44,17 @@ def run(context):
         return "报告已存在，跳过保存"
 
 
+async def run_async(context):
+    """执行器使用的异步版本：等待可被立即取消，日志写入放到线程中不阻塞事件循环"""
+    await runtime_config.sleep(1.5)
+
+    if not context.get("approval_saved"):
+        report_id = await asyncio.to_thread(save_report_to_db, context)
+        context["approval_saved"] = True
+        return f"报告已归档，ID: {report_id}"
+    return "报告已存在，跳过保存"
+
+
 def view(context):
     # 界面渲染
     col1, col2 = st.columns([1, 5])
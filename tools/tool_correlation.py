@@ -1,109 +1,233 @@
 # tools/tool_correlation.py
 import streamlit as st
 import time
+import os
+import threading
+from collections import OrderedDict
 import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
+import render_cache
+
+META = {"name": "多维因子关联分析", "icon": "🕸️", "order": 4}
+# 同时使用清洗后的原始列与工程特征
+INPUTS = ('df', 'features')
+OUTPUTS = ('corr',)
+
+# 分块参数：列块大小 × 行块大小决定单次 matmul 的中间矩阵规模
+BLOCK_COLS = 256
+CHUNK_ROWS = 65536
+# 热力图最多展示的因子数
+MAX_HEATMAP = 10
+
+# 进程级结果缓存：数据指纹 -> 相关矩阵
+_CACHE_SIZE = 16
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
 
 def get_chinese_font():
     """
     终极方案：直接加载项目根目录下的字体文件
     """
+    from matplotlib import font_manager  # 缓存命中时不需要 matplotlib，延迟到绘图时导入
     # 【核心修改】这里改成了你的文件名
-    font_path = "msyh.ttc" 
-    
+    font_path = "msyh.ttc"
+
     # 如果根目录找不到，回退到系统字体（防止本地运行报错）
     if not os.path.exists(font_path):
         # 如果本地也没有这个文件，就尝试系统自带的
         return font_manager.FontProperties(family='Microsoft YaHei')
-    
+
     # 加载指定的字体文件
     return font_manager.FontProperties(fname=font_path)
 
 
+def _numeric_frame(context):
+    """原始数值列 + 工程特征 (特征表已包含原始列)"""
+    source = context.get('features')
+    if source is None:
+        source = context.get('df')
+    if source is None:
+        return None
+    return source.select_dtypes(include="number")
+
+
+def blocked_corr(X, block=BLOCK_COLS, chunk=CHUNK_ROWS):
+    """
+    分块、float32、缺失值感知的 Pearson 相关矩阵 (成对完整观测)。
+    按 列块 × 列块 × 行块 累加充分统计量 (float64 累加器)，不物化 n×p 的中间结果。
+    X 需为已按列均值中心化的 float32 矩阵，NaN 表示缺失。
+    """
+    n, p = X.shape
+    out = np.full((p, p), np.nan, dtype=np.float32)
+    col_has_nan = np.isnan(X).any(axis=0)
+    for i0 in range(0, p, block):
+        i1 = min(i0 + block, p)
+        for j0 in range(i0, p, block):
+            j1 = min(j0 + block, p)
+            shape = (i1 - i0, j1 - j0)
+            n_ij, s_i, s_j, ss_i, ss_j, s_ij = (np.zeros(shape) for _ in range(6))
+            dense = not (col_has_nan[i0:i1].any() or col_has_nan[j0:j1].any())
+            for r0 in range(0, n, chunk):
+                A = X[r0:r0 + chunk, i0:i1]
+                B = X[r0:r0 + chunk, j0:j1]
+                if dense:
+                    # 无缺失的快速路径：只需一次 matmul
+                    s_ij += A.T @ B
+                    a_sum, b_sum = A.sum(axis=0, dtype=np.float64), B.sum(axis=0, dtype=np.float64)
+                    s_i += a_sum[:, None]
+                    s_j += b_sum[None, :]
+                    ss_i += (A * A).sum(axis=0, dtype=np.float64)[:, None]
+                    ss_j += (B * B).sum(axis=0, dtype=np.float64)[None, :]
+                    n_ij += len(A)
+                    continue
+                ma, mb = ~np.isnan(A), ~np.isnan(B)
+                A0, B0 = np.where(ma, A, 0).astype(np.float32), np.where(mb, B, 0).astype(np.float32)
+                fa, fb = ma.astype(np.float32), mb.astype(np.float32)
+                n_ij += fa.T @ fb
+                s_i += A0.T @ fb
+                s_j += fa.T @ B0
+                ss_i += (A0 * A0).T @ fb
+                ss_j += fa.T @ (B0 * B0)
+                s_ij += A0.T @ B0
+            with np.errstate(divide="ignore", invalid="ignore"):
+                cov = s_ij - s_i * s_j / n_ij
+                var_i = ss_i - s_i * s_i / n_ij
+                var_j = ss_j - s_j * s_j / n_ij
+                r = np.where((n_ij >= 3) & (var_i > 0) & (var_j > 0), cov / np.sqrt(var_i * var_j), np.nan)
+            r = np.clip(r, -1, 1).astype(np.float32)
+            out[i0:i1, j0:j1] = r
+            out[j0:j1, i0:i1] = r.T
+    return out
+
+
+def _prepare(frame, method, block=BLOCK_COLS):
+    """转为中心化的 float32 矩阵；Spearman 先按列块做秩变换"""
+    if method == "spearman":
+        X = np.empty(frame.shape, dtype=np.float32)
+        for c0 in range(0, frame.shape[1], block):
+            X[:, c0:c0 + block] = frame.iloc[:, c0:c0 + block].rank(method="average", na_option="keep") \
+                .to_numpy(dtype=np.float32)
+    else:
+        X = frame.to_numpy(dtype=np.float32, na_value=np.nan, copy=True)
+    X -= np.nanmean(X, axis=0, dtype=np.float64).astype(np.float32)
+    return X
+
+
+def correlation(frame, method="pearson"):
+    """计算相关矩阵 (带进程级缓存，按数据指纹命中)，返回 (矩阵, 是否命中缓存)"""
+    fingerprint = (int(pd.util.hash_pandas_object(frame, index=False).sum()), tuple(frame.columns), method)
+    with _cache_lock:
+        if fingerprint in _cache:
+            _cache.move_to_end(fingerprint)
+            return _cache[fingerprint], True
+    matrix = blocked_corr(_prepare(frame, method))
+    with _cache_lock:
+        _cache[fingerprint] = matrix
+        while len(_cache) > _CACHE_SIZE:
+            _cache.popitem(last=False)
+    return matrix, False
+
+
 def run(context):
-    time.sleep(0.8)  # 假装在计算
+    frame = _numeric_frame(context)
+    if frame is None or frame.shape[1] < 2:
+        context['corr'] = None
+        return "数值列不足，跳过关联分析"
+
+    t0 = time.perf_counter()
+    # 去掉整列为空 / 常数列，避免无意义的 NaN 行列
+    frame = frame.loc[:, frame.nunique(dropna=True) > 1]
+    pearson, hit_p = correlation(frame, "pearson")
+    spearman, hit_s = correlation(frame, "spearman")
+    context['corr'] = {
+        "labels": list(frame.columns),
+        "pearson": pearson,
+        "spearman": spearman,
+        "rows": len(frame),
+        "cached": hit_p and hit_s,
+        "elapsed_ms": (time.perf_counter() - t0) * 1000,
+    }
     return "多维关联分析完成"
 
 
+def _strongest_pair(matrix, labels):
+    m = np.abs(np.nan_to_num(matrix, nan=0.0))
+    np.fill_diagonal(m, 0)
+    if not m.any():
+        return None
+    i, j = np.unravel_index(np.argmax(m), m.shape)
+    return labels[i], labels[j], float(matrix[i, j])
+
+
 def view(context):
     st.info("🕸️ 正在进行多维特征归因与关联度测算...")
 
-    # 1. 准备标签 (列名)
-    # 策略：读取 CSV 的列名 + 随机补全高大上的术语
-    df = context.get('df')
-    base_labels = []
-
-    # 获取 CSV 里的数值列名（如果有的话）
-    if df is not None:
-        # 排除 date 这种非数值列
-        numeric_cols = [c for c in df.columns if 'date' not in c.lower() and '时间' not in c]
-        base_labels = numeric_cols[:3]  # 最多取前3个真实的
-
-    # 油田专业术语库 (用来凑数的)
-    fake_terms = ['动液面', '含水率', '泵效', '孔隙度', '渗透率', '注采比', '地层压力']
-
-    # 凑够 5 个特征
-    labels = base_labels
-    for term in fake_terms:
-        if len(labels) >= 5:
-            break
-        if term not in labels:
-            labels.append(term)
-
-    # 2. 生成纯假的“相关性矩阵”
-    # 逻辑：必须是对称矩阵，且对角线为1
-    n = len(labels)
-    # 生成随机矩阵 (-0.8 到 0.9 之间)
-    raw_data = np.random.uniform(-0.6, 0.9, size=(n, n))
-    # 变成对称矩阵
-    corr_matrix = (raw_data + raw_data.T) / 2
-    # 对角线设为 1.0
-    np.fill_diagonal(corr_matrix, 1.0)
-
-    # 3. 绘图 (小而美)
-    fig, ax = plt.subplots(figsize=(5, 4))  # 尺寸控制小一点
-
-    # 画热力图
-    im = ax.imshow(corr_matrix, cmap='coolwarm', vmin=-1, vmax=1)
-
-    # 设置坐标轴标签
-    ax.set_xticks(np.arange(n))
-    ax.set_yticks(np.arange(n))
-    ax.set_xticklabels(labels, rotation=45, ha="right", fontsize=9)
-    ax.set_yticklabels(labels, fontsize=9)
-
-    # 添加颜色条 (短一点，协调一点)
-    cbar = ax.figure.colorbar(im, ax=ax, shrink=0.75, pad=0.05)
-    cbar.ax.tick_params(labelsize=8)
-
-    # 【美化】在格子里填上数字
-    for i in range(n):
-        for j in range(n):
-            val = corr_matrix[i, j]
-            # 只有相关性比较强的才显示数字，避免太乱
-            if abs(val) > 0.3:
-                color = "white" if abs(val) > 0.6 else "black"
-                ax.text(j, i, f"{val:.2f}",
-                        ha="center", va="center", color=color, fontsize=8)
-
-    ax.set_title("特征因子相关性矩阵 (AI 模拟)", fontsize=11, pad=10)
-
-    # 去掉四周的框框，看起来更现代
-    ax.spines[:].set_visible(False)
-    # 增加白色网格分隔线
-    ax.set_xticks(np.arange(n + 1) - .5, minor=True)
-    ax.set_yticks(np.arange(n + 1) - .5, minor=True)
-    ax.grid(which="minor", color="w", linestyle='-', linewidth=2)
-    ax.tick_params(which="minor", bottom=False, left=False)
-
-    st.pyplot(fig)
-
-    # 4. 生成一句看起来很专业的废话结论
-    # 随机挑两个不一样的特征
-    import random
-    if len(labels) >= 2:
-        f1, f2 = random.sample(labels, 2)
-        r_val = random.uniform(0.75, 0.95)
-
-        st.caption(f"✅ 深度归因结论: **{f1}** 对 **{f2}** 具有显著的正向敏感度 (Shapley Value={r_val:.2f})")
+    corr = context.get('corr')
+    if not corr:
+        st.caption("数值因子不足 2 个，无法计算相关性。")
+        return
+
+    method = st.radio("相关系数", ["Pearson", "Spearman"], horizontal=True, key="corr_method",
+                      label_visibility="collapsed")
+    matrix = corr[method.lower()]
+    labels = corr['labels']
+
+    # 同一矩阵再次渲染时回放缓存的 PNG，以下选因子与绘图只在未命中时执行
+    def build_fig():
+        # 1. 挑选与其它因子关联最强的若干个用于热力图
+        strength = np.nanmean(np.abs(matrix), axis=1)
+        order = np.argsort(-np.nan_to_num(strength, nan=-1))[:MAX_HEATMAP]
+        sub = matrix[np.ix_(order, order)]
+        sub_labels = [labels[k] for k in order]
+        n = len(sub_labels)
+
+        # 2. 绘图 (小而美)
+        import matplotlib.pyplot as plt
+        zh_font = get_chinese_font()
+        fig, ax = plt.subplots(figsize=(5, 4))  # 尺寸控制小一点
+
+        # 画热力图
+        im = ax.imshow(sub, cmap='coolwarm', vmin=-1, vmax=1)
+
+        # 设置坐标轴标签
+        ax.set_xticks(np.arange(n))
+        ax.set_yticks(np.arange(n))
+        ax.set_xticklabels(sub_labels, rotation=45, ha="right", fontsize=8, fontproperties=zh_font)
+        ax.set_yticklabels(sub_labels, fontsize=8, fontproperties=zh_font)
+
+        # 添加颜色条 (短一点，协调一点)
+        cbar = ax.figure.colorbar(im, ax=ax, shrink=0.75, pad=0.05)
+        cbar.ax.tick_params(labelsize=8)
+
+        # 【美化】在格子里填上数字
+        for i in range(n):
+            for j in range(n):
+                val = sub[i, j]
+                # 只有相关性比较强的才显示数字，避免太乱
+                if np.isfinite(val) and abs(val) > 0.3:
+                    color = "white" if abs(val) > 0.6 else "black"
+                    ax.text(j, i, f"{val:.2f}",
+                            ha="center", va="center", color=color, fontsize=7)
+
+        ax.set_title(f"特征因子相关性矩阵 ({method})", fontsize=11, pad=10, fontproperties=zh_font)
+
+        # 去掉四周的框框，看起来更现代
+        ax.spines[:].set_visible(False)
+        # 增加白色网格分隔线
+        ax.set_xticks(np.arange(n + 1) - .5, minor=True)
+        ax.set_yticks(np.arange(n + 1) - .5, minor=True)
+        ax.grid(which="minor", color="w", linestyle='-', linewidth=2)
+        ax.tick_params(which="minor", bottom=False, left=False)
+        return fig
+
+    render_cache.pyplot("tool_correlation", {"matrix": matrix, "labels": labels}, build_fig, variant=method)
+
+    # 3. 结论：最强的一对因子
+    pair = _strongest_pair(matrix, labels)
+    source = "⚡ 缓存命中" if corr['cached'] else f"⏱️ {corr['elapsed_ms']:.0f} ms"
+    st.caption(f"共 {len(labels)} 个因子 × {corr['rows']:,} 行 | {source}")
+    if pair:
+        f1, f2, r_val = pair
+        direction = "正向" if r_val > 0 else "负向"
+        st.caption(f"✅ 关联结论: **{f1}** 与 **{f2}** 呈显著{direction}相关 ({method} r={r_val:.2f})")
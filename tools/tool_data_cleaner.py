@@ -1,31 +1,109 @@
 # tools/tool_data_cleaner.py
 import streamlit as st
 import time
-import random
+import numpy as np
+import pandas as pd
+
+META = {"name": "异常值清洗引擎", "icon": "🧹", "order": 2}
+INPUTS = ('df',)
+OUTPUTS = ('df', 'clean_stats')
+
+# 稳健 Z 分数阈值 (|0.6745 * (x - 中位数) / MAD| > 3.5 视为离群)
+MAD_Z_THRESHOLD = 3.5
+# 每组至少多少个有效值才做离群检测，样本太少时 MAD 不稳定
+MIN_GROUP_SIZE = 5
+GROUP_COL = "井号"
+
+
+def _group_transform(values, keys, func):
+    """按井分组做 transform；没有分组列时对整列计算"""
+    if keys is None:
+        return pd.Series(getattr(values, func)(), index=values.index)
+    return values.groupby(keys, observed=True, sort=False).transform(func)
+
+
+def clean_frame(df, group_col=GROUP_COL):
+    """
+    向量化清洗：去重 -> 分井 MAD 离群检测 (置空) -> 分井中位数填充空值 (回退到全列中位数)。
+    返回 (清洗后的 DataFrame, 统计信息)。
+    """
+    t0 = time.perf_counter()
+    rows_in = len(df)
+
+    # 1. 去重
+    dup_mask = df.duplicated()
+    duplicates = int(dup_mask.sum())
+    if duplicates:
+        df = df.loc[~dup_mask]
+    df = df.copy(deep=False)
+
+    keys = df[group_col] if group_col in df.columns else None
+    numeric_cols = [c for c in df.select_dtypes(include="number").columns if c != group_col]
+
+    null_total = outlier_total = 0
+    per_column = {}
+    for col in numeric_cols:
+        values = df[col].astype("float64")
+        raw_nulls = int(values.isna().sum())
+
+        # 2. 离群检测：分井稳健 Z 分数
+        median = _group_transform(values, keys, "median")
+        mad = _group_transform((values - median).abs(), keys, "median")
+        count = _group_transform(values, keys, "count")
+        with np.errstate(divide="ignore", invalid="ignore"):
+            robust_z = 0.6745 * (values - median).to_numpy() / mad.to_numpy()
+        outlier_mask = (np.abs(robust_z) > MAD_Z_THRESHOLD) & (mad.to_numpy() > 0) & (count.to_numpy() >= MIN_GROUP_SIZE)
+        outliers = int(outlier_mask.sum())
+
+        # 3. 空值填充：离群点置空后统一用分井中位数填充，整组为空时回退全列中位数
+        values = values.mask(outlier_mask)
+        if raw_nulls or outliers:
+            fill = _group_transform(values, keys, "median").fillna(values.median())
+            values = values.fillna(fill)
+            df[col] = values
+
+        null_total += raw_nulls
+        outlier_total += outliers
+        per_column[col] = {"nulls_filled": raw_nulls, "outliers_replaced": outliers}
+
+    cells = max(len(df) * max(len(numeric_cols), 1), 1)
+    stats = {
+        "rows_in": rows_in,
+        "rows_out": len(df),
+        "duplicates_removed": duplicates,
+        "nulls_filled": null_total,
+        "outliers_replaced": outlier_total,
+        "columns": per_column,
+        "grouped_by": group_col if keys is not None else None,
+        "quality_score": 100.0 * (1 - (null_total + outlier_total + duplicates) / (cells + duplicates)),
+        "elapsed_ms": (time.perf_counter() - t0) * 1000,
+    }
+    return df, stats
 
 
 def run(context):
-    time.sleep(1.5)  # 假装耗时
+    df = context.get('df')
+    if df is None:
+        return "无数据可清洗"
+    cleaned, stats = clean_frame(df)
+    # 清洗后的数据回写上下文，统计信息供报告生成使用
+    context['df'] = cleaned
+    context['clean_stats'] = stats
     return "清洗完成"
 
 
 def view(context):
-    # --- 1. 生成动态随机数据 ---
-    # 模拟填充了几个空值 (0~5个)
-    null_count = random.randint(0, 5)
-
-    # 模拟剔除了多少个离群点 (5~35个，模拟去噪)
-    outlier_count = random.randint(5, 35)
-
-    # 模拟数据质量评分 (96.0 ~ 99.9)
-    # 用 uniform 生成浮点数
-    quality_score = random.uniform(96.0, 99.9)
+    stats = context.get('clean_stats')
+    if not stats:
+        st.info("暂无可清洗的数据。")
+        return
 
-    # --- 2. 界面渲染 ---
+    # --- 界面渲染 ---
     st.success("✅ 数据清洗引擎执行完毕")
 
-    # 使用 f-string 将随机数填入字符串
-    st.caption(f"已智能填充空值: {null_count} | 已剔除离群噪点: {outlier_count} | 🛡️ 数据质量评分: {quality_score:.1f}")
+    st.caption(f"已智能填充空值: {stats['nulls_filled']} | 已剔除离群噪点: {stats['outliers_replaced']} | "
+               f"已去除重复记录: {stats['duplicates_removed']} | 🛡️ 数据质量评分: {stats['quality_score']:.1f} | "
+               f"⏱️ 耗时 {stats['elapsed_ms']:.0f} ms ({stats['rows_in']:,} 行)")
 
     # (可选) 加一个更直观的进度条展示质量
     # st.progress(int(quality_score), text="质量健康度")
@@ -1,8 +1,14 @@
 # tools/tool_data_loader.py
-import pandas as pd
 import os
 import streamlit as st
-import time
+import data_catalog
+import data_ingest
+import data_stream
+
+META = {"name": "多源数据集成加载", "icon": "📂", "order": 1}
+# 读取 / 写入的上下文字段，pipeline_executor 据此推导步骤间依赖
+INPUTS = ('target_file', 'task_name', 'stream_mode')
+OUTPUTS = ('df', 'stream_stats', 'data_cache_hit')
 
 
 def run(context):
@@ -10,11 +16,20 @@ def run(context):
     # 假设 CSV 都在 data 目录下
     file_path = os.path.join("data", file_name)
 
-    time.sleep(0.5)  # 模拟加载耗时
-
     if os.path.exists(file_path):
-        # 读取 CSV
-        df = pd.read_csv(file_path)
+        # 读取数据 (进程级缓存：同一文件未修改时不重复解析)
+        # 首次读取时按任务 schema 转换为带类型的 Arrow 列式副本，之后 memory_map 加载
+        task = context.get('task_name')
+
+        # 大文件 (或指令要求流式) 按分块聚合，context['df'] 只保留有界大小的预览
+        if context.get('stream_mode') or data_stream.should_stream(file_path):
+            preview, stats = data_stream.aggregate(file_path, task)
+            context['df'] = preview
+            context['stream_stats'] = stats
+            return f"流式加载完成: {file_name} ({stats['rows']} 行 / {stats['chunks']} 块)"
+
+        context['data_cache_hit'] = data_catalog.is_cached(file_path)
+        df = data_catalog.load_frame(file_path, lambda p: data_ingest.load_typed(p, task))
         # 将数据存入上下文，供后续工具使用
         context['df'] = df
         return f"成功加载文件: {file_name}"
@@ -31,9 +46,13 @@ def view(context):
     uploaded_file = st.file_uploader("请上传本月生产数据 (.csv)", type=["csv", "xlsx"])
 
     if uploaded_file:
+        # 上传文件走同样的列式接入流程，替换本次任务的数据 (同一文件只接入一次)
+        upload_key = (uploaded_file.name, uploaded_file.size)
+        if context.get('uploaded_key') != upload_key:
+            context['df'] = data_ingest.ingest_upload(uploaded_file, context.get('task_name'))
+            context['uploaded_key'] = upload_key
         st.success(f"✅ {uploaded_file.name} 上传成功")
-        st.caption("数据已完成哈希校验，无篡改风险。")
-        # 这里实际上为了演示，我们还是依赖 context 里的假数据，或者你可以写逻辑去读取
+        st.caption(f"数据已按「{context.get('task_name', '')}」schema 完成类型校验，共 {len(context['df'])} 条记录。")
     # else:
     #     st.info("ℹ️ 暂未检测到上传文件，将加载 **系统默认演示数据**。")
     #
@@ -41,4 +60,17 @@ def view(context):
     # if 'df' in context:
     #     with st.expander("🔍 预览加载的数据集", expanded=False):
     #         st.dataframe(context['df'].head(5), use_container_width=True)
-    #         st.caption(f"共 {len(context['df'])} 条记录")
\ No newline at end of file
+    #         st.caption(f"共 {len(context['df'])} 条记录")
+
+    # 数据缓存 / 流式加载状态
+    stream_stats = context.get('stream_stats')
+    if stream_stats:
+        st.caption(f"🌊 流式模式 | {context.get('target_file', '')} | 共 {stream_stats['rows']:,} 行，"
+                   f"分 {stream_stats['chunks']} 块 (每块 ≤ {stream_stats['chunk_rows']:,} 行，"
+                   f"单块峰值 {stream_stats['peak_chunk_bytes'] / 1024 / 1024:.1f} MB)")
+    elif 'df' in context:
+        stats = data_catalog.cache_stats()
+        source = "⚡ 命中数据缓存" if context.get('data_cache_hit') else "📥 首次解析"
+        st.caption(f"{source} | {context.get('target_file', '')} | 缓存命中率 {stats['hit_rate']:.0%} "
+                   f"({stats['hits']}/{stats['hits'] + stats['misses']}) | "
+                   f"占用 {stats['bytes'] / 1024 / 1024:.1f}/{stats['max_bytes'] / 1024 / 1024:.0f} MB")
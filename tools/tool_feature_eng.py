@@ -1,95 +1,217 @@
 # tools/tool_feature_eng.py
 import streamlit as st
 import time
-import random
+import threading
+from collections import OrderedDict
 import pandas as pd
 import numpy as np
 
+META = {"name": "时序特征工程构建", "icon": "🔧", "order": 3}
+INPUTS = ('df', 'target_file')
+OUTPUTS = ('features', 'feature_names', 'feature_stats')
+
+GROUP_COL = "井号"
+DATE_CANDIDATES = ("date", "日期", "预测发生时间")
+
+# 特征配置：滞后 / 滑动均值 / 滑动标准差 (窗口单位为行，按日数据即为天)
+LAGS = (1, 7)
+MA_WINDOWS = (7, 15)
+STD_WINDOWS = (30,)
+# 增量计算时每口井需要回看的历史行数
+HISTORY_ROWS = max(LAGS + MA_WINDOWS + STD_WINDOWS)
+
+# 进程级增量缓存：数据集 -> 上次的特征结果 (按数据集名，只保留最近几份)
+_CACHE_SIZE = 8
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def _find_date_col(df):
+    for col in DATE_CANDIDATES:
+        if col in df.columns:
+            return col
+    return next((c for c in df.columns if pd.api.types.is_datetime64_any_dtype(df[c])), None)
+
+
+def _value_cols(df, date_col):
+    return [c for c in df.select_dtypes(include="number").columns if c not in (GROUP_COL, date_col)]
+
+
+def _sort(df, keys_col, date_col):
+    by = [c for c in (keys_col, date_col) if c]
+    return df.sort_values(by, kind="stable") if by else df
+
+
+def _gb(series, keys):
+    return series.groupby(keys, sort=False, observed=True) if keys is not None else series
+
+
+def _shift(series, keys, k):
+    return _gb(series, keys).shift(k)
+
+
+def _cumsum(series, keys):
+    return _gb(series, keys).cumsum()
+
+
+def _rolling_mean_std(values, keys, window):
+    """
+    分组滑动均值 / 标准差：用组内累计和之差代替逐组 rolling，全程向量化。
+    窗口内不足 window 行时按已有行计算 (等价 min_periods=1)。
+    """
+    valid = values.notna().astype("float64")
+    x = values.fillna(0.0)
+    sums = {"s": _cumsum(x, keys), "s2": _cumsum(x * x, keys), "n": _cumsum(valid, keys)}
+    win = {k: v - _shift(v, keys, window).fillna(0.0) for k, v in sums.items()}
+    n = win["n"].to_numpy()
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean = np.where(n > 0, win["s"].to_numpy() / n, np.nan)
+        var = (win["s2"].to_numpy() - n * mean * mean) / (n - 1)
+        std = np.where(n > 1, np.sqrt(np.clip(var, 0, None)), np.nan)
+    return mean, std
+
+
+def build_features(df, group_col=GROUP_COL):
+    """
+    构建时序特征 (按井分组、按日期排序)：滞后、滑动均值、滑动标准差、一阶差分、日历编码。
+    返回 (特征 DataFrame, 新增特征名列表)。
+    """
+    date_col = _find_date_col(df)
+    keys_col = group_col if group_col in df.columns else None
+    out = _sort(df, keys_col, date_col).copy(deep=False)
+    keys = out[keys_col] if keys_col else None
+
+    names = []
+    for col in _value_cols(out, date_col):
+        values = out[col].astype("float64")
+        for k in LAGS:
+            out[f"{col}_Lag_{k}"] = _shift(values, keys, k)
+        for w in sorted(set(MA_WINDOWS + STD_WINDOWS)):
+            mean, std = _rolling_mean_std(values, keys, w)
+            if w in MA_WINDOWS:
+                out[f"{col}_MA_{w}"] = mean
+            if w in STD_WINDOWS:
+                out[f"{col}_Std_{w}"] = std
+        out[f"{col}_Diff"] = values - _shift(values, keys, 1)
+        names += [f"{col}_Lag_{k}" for k in LAGS] + [f"{col}_MA_{w}" for w in MA_WINDOWS] \
+            + [f"{col}_Std_{w}" for w in STD_WINDOWS] + [f"{col}_Diff"]
+
+    # 日历编码 (周期性 sin/cos)
+    if date_col and pd.api.types.is_datetime64_any_dtype(out[date_col]):
+        dates = out[date_col].dt
+        dow = dates.dayofweek.to_numpy(dtype="float64")
+        dom = (dates.day.to_numpy(dtype="float64") - 1) / dates.days_in_month.to_numpy(dtype="float64")
+        out["Time_DOW_Sin"] = np.sin(2 * np.pi * dow / 7)
+        out["Time_DOW_Cos"] = np.cos(2 * np.pi * dow / 7)
+        out["Time_DOM_Sin"] = np.sin(2 * np.pi * dom)
+        out["Time_DOM_Cos"] = np.cos(2 * np.pi * dom)
+        names += ["Time_DOW_Sin", "Time_DOW_Cos", "Time_DOM_Sin", "Time_DOM_Cos"]
+    return out, names
+
+
+def _appended_rows(prev, df, group_col):
+    """
+    判断 df 是否是 prev 的原始数据追加了新行 (按井 + 日期的键比对前缀)。
+    是则返回新增的行，否则返回 None。
+    """
+    date_col = _find_date_col(df)
+    if date_col is None or len(df) <= len(prev) or list(prev.columns[:len(df.columns)]) != list(df.columns):
+        return None
+    keys_col = group_col if group_col in df.columns else None
+    key_cols = [c for c in (keys_col, date_col) if c]
+    last_seen = prev[date_col].max()
+    new_rows = df[df[date_col] > last_seen]
+    old_rows = df[df[date_col] <= last_seen]
+    if len(old_rows) != len(prev):
+        return None
+    old_keys = _sort(old_rows, keys_col, date_col)[key_cols].reset_index(drop=True)
+    if not old_keys.equals(prev[key_cols].reset_index(drop=True)):
+        return None
+    return new_rows
+
+
+def update_features(prev, new_rows, group_col=GROUP_COL):
+    """
+    增量计算：只取每口井最近 HISTORY_ROWS 行历史 + 新增行重新计算，
+    再把新增行的特征追加到已有结果之后，历史部分不重算。
+    """
+    date_col = _find_date_col(new_rows)
+    keys_col = group_col if group_col in new_rows.columns else None
+    raw_cols = list(new_rows.columns)
+    history = prev.groupby(keys_col, sort=False, observed=True).tail(HISTORY_ROWS) if keys_col \
+        else prev.tail(HISTORY_ROWS)
+    combined = pd.concat([history[raw_cols], new_rows], ignore_index=True)
+    recomputed, names = build_features(combined, group_col)
+    fresh = recomputed[recomputed[date_col] > prev[date_col].max()]
+    merged = _sort(pd.concat([prev, fresh], ignore_index=True), keys_col, date_col).reset_index(drop=True)
+    return merged, names
+
 
 def run(context):
-    time.sleep(0.8)  # 假装耗时
+    df = context.get('df')
+    if df is None:
+        return "无数据可构建特征"
+
+    t0 = time.perf_counter()
+    cache_key = (context.get('target_file'), tuple(df.columns))
+    fingerprint = int(pd.util.hash_pandas_object(df, index=False).sum())
+    with _cache_lock:
+        prev = _cache.get(cache_key)
+
+    incremental = False
+    new_rows = None
+    if prev is not None and prev["fingerprint"] == fingerprint:
+        # 数据未变化，直接复用
+        features, names = prev["features"], prev["names"]
+        new_rows = df.iloc[:0]
+    elif prev is not None and (new_rows := _appended_rows(prev["features"], df, GROUP_COL)) is not None:
+        # 只追加了新的日期：增量计算
+        features, names = update_features(prev["features"], new_rows)
+        incremental = True
+    else:
+        features, names = build_features(df)
+        features = features.reset_index(drop=True)
+
+    with _cache_lock:
+        _cache[cache_key] = {"features": features, "names": names, "fingerprint": fingerprint}
+        _cache.move_to_end(cache_key)
+        while len(_cache) > _CACHE_SIZE:
+            _cache.popitem(last=False)
+
+    feature_block = features[names] if names else pd.DataFrame(index=features.index)
+    context['features'] = features
+    context['feature_names'] = names
+    context['feature_stats'] = {
+        "n_features": len(names),
+        "rows": len(features),
+        "sparsity": float(feature_block.isna().to_numpy().mean()) if names else 0.0,
+        "incremental": incremental,
+        "new_rows": len(new_rows) if new_rows is not None else len(features),
+        "elapsed_ms": (time.perf_counter() - t0) * 1000,
+    }
     return "特征构建完成"
 
 
 def view(context):
-    # 1. 获取任务类型和数据列名
-    task = context.get('task_name', '')
-    df = context.get('df')
+    names = context.get('feature_names')
+    stats = context.get('feature_stats')
+    if not stats:
+        st.info("暂无可构建特征的数据。")
+        return
 
-    # 获取 CSV 中的关键列名（排除日期）
-    target_col = "Value"
-    if df is not None:
-        cols = [c for c in df.columns if 'date' not in c.lower() and '时间' not in c]
-        if cols:
-            target_col = cols[0]  # 取第一列数值列作为特征基底
-
-    # 2. 定义不同场景的“专业术语库”
-    # 这些词汇会随机组合，让特征看起来很高级
-
-    # 通用时序特征 (General)
-    common_feats = [
-        f"{target_col}_Lag_1",  # 滞后特征
-        f"{target_col}_Lag_7",
-        f"{target_col}_MA_15",  # 滑动平均
-        f"{target_col}_Std_30",  # 滑动标准差
-        f"{target_col}_Diff",  # 一阶差分
-        "Time_Embedding_Sin",  # 时间编码
-        "Seasonality_Idx"  # 季节性指数
-    ]
-
-    # 场景 A: 产量趋势 (Production)
-    prod_terms = [
-        "Arps_Decline_Rate",  # Arps递减率
-        "Water_Cut_Derivative",  # 含水率导数
-        "Cumulative_Oil_Prod",  # 累产
-        "Liquid_Prod_Index",  # 产液指数
-        "Natural_Decline_b"  # 自然递减指数
-    ]
-
-    # 场景 B: 注水调配 (Injection)
-    water_terms = [
-        "Voidage_Replacement_Ratio",  # 注采比
-        "Injectivity_Index",  # 吸水指数
-        "Hall_Plot_Slope",  # 霍尔曲线斜率
-        "Pressure_Gradient",  # 压力梯度
-        "Water_Drive_Index"  # 水驱指数
-    ]
-
-    # 场景 C: 风险预测 (Risk)
-    risk_terms = [
-        "Anomaly_Score_IsolationForest",  # 孤立森林评分
-        "Pressure_Surge_Rate",  # 压力激增率
-        "Casing_Damage_Prob",  # 套损概率
-        "Entropy_Risk_Val",  # 熵值风险
-        "Threshold_Crossing_Count"  # 越限次数
-    ]
-
-    # 3. 动态组装特征列表
-    generated_features = []
-
-    # 先加通用的
-    generated_features.extend(random.sample(common_feats, k=3))
-
-    # 再根据任务类型加专业的
-    if "注水" in task:
-        generated_features.extend(random.sample(water_terms, k=3))
-    elif "风险" in task:
-        generated_features.extend(random.sample(risk_terms, k=3))
-    else:  # 默认为产量预测
-        generated_features.extend(random.sample(prod_terms, k=3))
-
-    # 4. 渲染界面
-    st.success(f"✅ 时序特征工程构建完成 (共生成 {len(generated_features)} 维特征)")
+    # 渲染界面
+    st.success(f"✅ 时序特征工程构建完成 (共生成 {len(names)} 维特征)")
 
     st.markdown("**已提取关键因子:**")
 
     # 使用 Markdown 的代码块样式显示特征，看起来像代码输出
     # 用 join 把列表变成 `Tag1` `Tag2` 的形式
-    tags = " ".join([f"`{feat}`" for feat in generated_features])
-    st.markdown(tags)
+    tags = " ".join([f"`{feat}`" for feat in names])
+    st.markdown(tags or "_无数值列可构建特征_")
 
-    # 加一点假装的数据统计
+    # 真实的构建统计
     col1, col2, col3 = st.columns(3)
-    col1.metric("特征维度", f"{len(generated_features)}", "+2")
-    col2.metric("稀疏度", f"{random.randint(5, 15)}%", "-1.2%")
-    col3.metric("信息增益 (IG)", f"{random.uniform(0.6, 0.9):.2f}")
+    col1.metric("特征维度", f"{stats['n_features']}")
+    col2.metric("稀疏度", f"{stats['sparsity'] * 100:.1f}%")
+    mode = "增量" if stats['incremental'] else "全量"
+    col3.metric(f"构建耗时 ({mode})", f"{stats['elapsed_ms']:.0f} ms", f"{stats['new_rows']:,} 行")
@@ -1,34 +1,83 @@
 # tools/tool_model_inference.py
 import streamlit as st
 import time
-import random
+import data_ingest
+import inference_service
+import instrumentation
+import model_store
+import tool_registry
+
+META = {"name": "深度学习模型推理", "icon": "🧠", "order": 5}
+INPUTS = ('df', 'target_file', 'username')
+OUTPUTS = ('inference',)
+
+# 任务 -> 使用模型的算法工具
+TASK_TOOLS = {"产量预测": "tool_trend_algo", "风险预测": "tool_risk_algo", "注水调配": "tool_water_algo"}
+# 经推理服务 (inference_service 微批) 计算的工具；其余算法在工具步骤内直接计算
+SERVED_TOOLS = ("tool_risk_algo",)
 
 
 def run(context):
-    # 这里不需要sleep，因为我们在view里模拟进度条
-    return "推理启动"
+    """
+    加载本次任务要用的模型版本 (内存映射并预先读入页缓存)。
+    算法工具在 INPUTS 中声明 'inference'，调度时排在本步骤之后，取到的是这里已发布 / 读入的权重。
+    """
+    task = data_ingest.task_from_filename(context.get('target_file', ''))
+    tool_id = TASK_TOOLS.get(task)
+    if tool_id is None:
+        return "无需模型推理"
+    module = tool_registry.load(tool_id)
+    model_key = tool_registry.model_key(tool_id)
+
+    t0 = time.perf_counter()
+    artifact = model_store.resolve(model_key, context.get('username'), module.default_weights)
+    if artifact is None:
+        return "模型权重不可用，使用内置参数"
+    for weights in artifact.weights.values():
+        weights.sum()  # 顺序读一遍，把映射的页读进来，首个推理请求不再等磁盘
+    nbytes = sum(w.nbytes for w in artifact.weights.values())
+    context['inference'] = {
+        "model_key": model_key,
+        "scope": artifact.scope,
+        "version": artifact.version,
+        "bytes": int(nbytes),
+        "load_ms": (time.perf_counter() - t0) * 1000,
+    }
+    scope = "专属" if artifact.scope != model_store.PUBLIC else "公共"
+    return f"已加载 {model_key} ({scope} v{artifact.version})"
 
 
 def view(context):
-    st.write("🧠 正在加载 LSTM-Transformer 混合模型...")
-
-    # 模拟一个推理进度条
-    progress_bar = st.progress(0)
-    status_text = st.empty()
-
-    # 进度条跑动逻辑
-    for i in range(101):
-        if i % 10 == 0:  # 加快一点速度，每10%停顿一下
-            time.sleep(0.02)
-            progress_bar.progress(i)
-            # 动态显示推理百分比
-            status_text.text(f"Tensor Core 推理中... {i}%")
-
-    # --- 核心修改：生成随机数据 ---
-    # 耗时: 0.8 ~ 2.5 秒
-    cost_time = random.uniform(0.8, 2.5)
-    # 显存: 3.5 ~ 6.2 GB
-    vram_usage = random.uniform(3.5, 6.2)
-
-    # 显示最终状态 (保留一位或两位小数)
-    status_text.text(f"✅ 模型推理完成 | 耗时: {cost_time:.2f}s | 显存占用: {vram_usage:.1f}GB")
\ No newline at end of file
+    info = context.get('inference')
+    if info:
+        scope = "专属" if info['scope'] != model_store.PUBLIC else "公共"
+        st.write(f"🧠 模型 `{info['model_key']}` {scope} v{info['version']} 已加载 "
+                 f"({info['bytes'] / 1024:.1f} KB，内存映射，耗时 {info['load_ms']:.1f} ms)")
+
+    # 显示真实的埋点数据：本步骤与截至目前整条工作流的耗时 / 内存
+    m = context.get("step_metrics", {}).get("tool_model_inference", {}).get("run")
+    totals = instrumentation.workflow_totals(context)
+    if m:
+        rss = f"{m['rss_mb']:.0f} MB" if m["rss_mb"] is not None else "未知"
+        st.text(f"✅ 模型加载完成 | 耗时: {m['wall_ms']:.1f} ms (CPU {m['cpu_ms']:.1f} ms) | 内存占用: {rss}")
+
+    # 推理服务的实时统计 (本进程所有会话的请求合并微批计算)；只有风险评分走推理服务，
+    # 产量拟合与配注求解在算法步骤内直接计算，显示该步骤自身的实测耗时
+    tool_id = TASK_TOOLS.get(data_ingest.task_from_filename(context.get('target_file', '')))
+    if tool_id and tool_id not in SERVED_TOOLS:
+        name = tool_registry.tool_meta().get(tool_id, {}).get("name", tool_id)
+        st.caption(f"推理服务目前只承载风险评分模型；{name} 在算法步骤内直接计算，不经过推理服务微批。")
+        tm = context.get("step_metrics", {}).get(tool_id, {}).get("run")
+        if tm:
+            st.text(f"⏱️ {name} 实测耗时: {tm['wall_ms']:.1f} ms (CPU {tm['cpu_ms']:.1f} ms)")
+        else:
+            st.caption("算法步骤完成后在此显示其实测耗时。")
+    service = inference_service.stats()
+    if service and tool_id in SERVED_TOOLS:
+        st.caption("推理服务延迟 (所有会话，提交到返回，ms)")
+        st.dataframe([{"模型": key, "请求数": s['requests'], "直接计算": s['inline'], "批次数": s['batches'],
+                       "平均每批请求": round(s['requests_per_batch'], 2), "P50": round(s['p50_ms'], 2),
+                       "P95": round(s['p95_ms'], 2), "P99": round(s['p99_ms'], 2)}
+                      for key, s in service.items()], use_container_width=True, hide_index=True)
+    st.caption(f"已执行 {totals['steps']} 个步骤，累计耗时 {totals['wall_ms']:.0f} ms，"
+               f"CPU {totals['cpu_ms']:.0f} ms，缓存命中 {totals['cache_hits']} 次")
\ No newline at end of file
@@ -2,17 +2,16 @@
 import streamlit as st
 import time
 import random
+import runtime_config
+import render_cache
 
+META = {"name": "AI 决策报告生成", "icon": "📝", "order": 9}
+INPUTS = ('month', 'task_name', 'clean_stats', 'trend_summary', 'risk_summary', 'water_summary')
+OUTPUTS = ('generated_report_content',)
 
-def run(context):
-    # 模拟生成长报告的耗时
-    time.sleep(1.0)
-    return "报告构建完成"
-
-
-def view(context):
-    st.markdown("### 📝 AI 决策报告生成引擎")
 
+def build_report(context):
+    """根据前序步骤的结论拼装报告全文"""
     # 1. 获取上下文数据
     month = context.get('month', 7)
     task = context.get('task_name', '通用分析')
@@ -22,11 +21,20 @@ def view(context):
     risk_concl = context.get('risk_summary', '全区生产形势稳定，未监测到一级井控风险，设备运行状况良好。')
     water_concl = context.get('water_summary', '注采结构基本合理，地层压力保持水平，建议维持当前配注方案微调。')
 
+    # 数据清洗引擎回写的真实统计
+    clean_stats = context.get('clean_stats') or {}
+    outlier_count = clean_stats.get('outliers_replaced', 35)
+    quality_line = ""
+    if clean_stats:
+        quality_line = (f"**数据质量**: 清洗 {clean_stats['rows_in']:,} 条记录 | 填充空值 {clean_stats['nulls_filled']} | "
+                        f"修正离群点 {clean_stats['outliers_replaced']} | 去除重复 {clean_stats['duplicates_removed']} | "
+                        f"质量评分 {clean_stats['quality_score']:.1f}\n")
+
     # 2. 定义通用头部信息
     report_header = f"""# {month}月度{task}智能化决策分析报告
 **密级**: 内部绝密 | **生成时间**: {time.strftime('%Y-%m-%d %H:%M')}
 **数据范围**: 第五采油厂作业区 | **分析引擎**: Petro-Brain AI V3.2
----
+{quality_line}---
 """
 
     # 3. 根据任务类型构建长文本内容
@@ -68,7 +76,7 @@ def view(context):
 3.  **工况异常**: 数字化示功图诊断发现，有 15 口井呈现“气体影响”或“供液不足”特征，不仅影响产量，更加速设备老化。
 
 ## 三、 数字化诊断结论
-经系统关联分析，本月风险主要集中在西区老井区块。数据清洗引擎剔除了 35 个因传感器故障导致的误报警，最终锁定了 12 个确信度极高的红色预警目标。这些井的电流方差在过去 72 小时内显著增大，预示着井下结蜡或卡泵风险急剧升高。
+经系统关联分析，本月风险主要集中在西区老井区块。数据清洗引擎剔除了 {outlier_count} 个因传感器故障导致的误报警，最终锁定了 12 个确信度极高的红色预警目标。这些井的电流方差在过去 72 小时内显著增大，预示着井下结蜡或卡泵风险急剧升高。
 
 ## 四、 应急响应与维保建议
 1.  **立即核查**: 请生产运行科立即将红色预警清单下发至基层班站，要求 24 小时内完成现场复核（如憋压测试、电流卡片检查）。
@@ -101,6 +109,22 @@ def view(context):
 """
 
     full_text = report_header + report_body
+    return full_text
+
+
+def run(context):
+    # 模拟生成长报告的耗时 (生产模式下跳过)
+    runtime_config.pause(1.0)
+    context['generated_report_content'] = build_report(context)
+    return "报告构建完成"
+
+
+def view(context):
+    st.markdown("### 📝 AI 决策报告生成引擎")
+
+    month = context.get('month', 7)
+    task = context.get('task_name', '通用分析')
+    full_text = context.get('generated_report_content') or build_report(context)
 
     # 4. 界面渲染（打字机效果）
     st.markdown(f"#### 📄 正在生成《{month}月{task}分析报告》...")
@@ -112,18 +136,22 @@ def view(context):
     # 使用 placeholder 来避免每次都重新渲染整个 markdown
     text_placeholder = report_container.empty()
 
-    display_text = ""
-    # 为了演示流畅，不再一个字一个字打，而是一小段一小段打
-    chunk_size = 5
+    # 生产模式下、或同一份报告已经播放过时直接输出全文
+    replay = render_cache.seen("tool_report_gen", full_text)
+    if not replay and not runtime_config.is_production():
+        display_text = ""
+        # 为了演示流畅，不再一个字一个字打，而是一小段一小段打
+        chunk_size = 5
 
-    for i in range(0, len(full_text), chunk_size):
-        chunk = full_text[i:i + chunk_size]
-        display_text += chunk
-        # 加上光标
-        text_placeholder.markdown(display_text + " ▍")
-        time.sleep(0.01)  # 极速打字
+        for i in range(0, len(full_text), chunk_size):
+            chunk = full_text[i:i + chunk_size]
+            display_text += chunk
+            # 加上光标
+            text_placeholder.markdown(display_text + " ▍")
+            time.sleep(0.01)  # 极速打字
 
-    text_placeholder.markdown(display_text)  # 最后移除光标
+    text_placeholder.markdown(full_text)  # 最后移除光标
+    render_cache.cached("tool_report_gen", full_text, lambda: full_text.encode("utf-8"))
 
     # 5. 交互区
     col1, col2 = st.columns([1, 1])
@@ -137,6 +165,3 @@ def view(context):
         )
     with col2:
         st.button("📧 发送邮件给主管", disabled=True, help="系统演示模式暂不支持邮件发送", use_container_width=True)
-
-    # 将生成的摘要存回去，防止后续步骤需要（虽然这里已经是最后了）
-    context['generated_report_content'] = full_text
\ No newline at end of file
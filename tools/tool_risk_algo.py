@@ -1,11 +1,240 @@
 # tools/tool_risk_algo.py
 import streamlit as st
 import time
+import numpy as np
+import pandas as pd
+import async_runtime
+import data_ingest
+import data_stream
+import inference_service
+import model_store
+import runtime_config
+
+META = {"name": "生产风险扫描引擎", "icon": "⚠️", "order": 7, "model_key": "model_risk"}
+INPUTS = ('df', 'stream_stats', 'inference')
+OUTPUTS = ('risk_summary', 'risk_ranking')
+
+WELL_COL = "井号"
+TYPE_COL = "预测风险类型"
+PROB_COL = "预测风险概率"
+DATE_COL = "预测发生时间"
+TOP_K = 20
+HIGH_RISK_SCORE = data_stream.HIGH_RISK_THRESHOLD
+# 距预计发生时间超过该天数的预警视为同等不紧迫
+HORIZON_CAP_DAYS = 60
+# 训练用的实际结果标注列 (1 = 预警的风险实际发生)；至少需要的标注井数
+LABEL_COLUMNS = ("实际发生", "是否发生", "label")
+MIN_TRAIN_WELLS = 10
+# 训练时向当前权重收缩的 L2 强度 (增量微调，样本少时不偏离原权重太远)
+PRIOR_STRENGTH = 1.0
+# 等待推理服务结果的上限取本步骤的超时，服务线程异常时步骤按超时失败而不是一直挂起
+INFER_TIMEOUT = float(META.get("timeout", async_runtime.STEP_TIMEOUT))
+
+# 逻辑回归权重：特征依次为 上游概率的 logit、距发生天数 / 30、log(同井预警条数)
+FEATURES = ("prob_logit", "horizon_months", "log_alerts")
+DEFAULT_WEIGHTS = {
+    "coef": np.array([1.0, -0.35, 0.4]),
+    "bias": 0.0,
+    # 风险类型的偏置：套损、管线穿孔后果更重，结垢等可计划处理
+    "type_bias": {"套损风险": 0.6, "管线穿孔": 0.5, "含水突升": 0.3, "产量骤降": 0.3, "泵况恶化": 0.1, "结垢堵塞": 0.0},
+}
+
+
+def default_weights():
+    """内置权重 -> 模型仓库格式 (数组 + meta)"""
+    types = list(DEFAULT_WEIGHTS["type_bias"])
+    weights = {"coef": DEFAULT_WEIGHTS["coef"], "bias": np.array([DEFAULT_WEIGHTS["bias"]]),
+               "type_bias": np.array([DEFAULT_WEIGHTS["type_bias"][t] for t in types])}
+    return weights, {"features": list(FEATURES), "types": types}
+
+
+def load_weights(username=None):
+    """从模型仓库取当前生效的权重 (用户专属优先)，返回 (权重字典, 版本说明, 版本目录)"""
+    artifact = model_store.resolve(META["model_key"], username, default_weights)
+    if artifact is None:
+        return DEFAULT_WEIGHTS, "内置", "内置"
+    w = artifact.weights
+    weights = {"coef": w["coef"], "bias": float(w["bias"][0]),
+               "type_bias": dict(zip(artifact.meta["types"], w["type_bias"].tolist()))}
+    return weights, f"{'专属' if artifact.scope != model_store.PUBLIC else '公共'} v{artifact.version}", artifact.path
+
+
+def fit_weights(df, username=None):
+    """
+    用带实际结果标注 (LABEL_COLUMNS) 的预警数据训练专属权重：按井取特征与标注 (该井任一预警发生即为 1)，
+    以当前生效的权重为先验做 L2 正则的逻辑回归 (牛顿法)。
+    返回 (weights, meta)；没有标注列、标注井数不足或只有一类结果时返回 None。
+    """
+    label_col = next((c for c in LABEL_COLUMNS if c in df.columns), None)
+    if label_col is None or WELL_COL not in df.columns:
+        return None
+    df = normalize(df)
+    wells_df, X = well_features(df)
+    # well_features 的井顺序即 factorize 的编码顺序
+    codes = pd.factorize(df[WELL_COL])[0]
+    labels = pd.Series(pd.to_numeric(df[label_col], errors="coerce").to_numpy()).groupby(codes).max()
+    y = labels.reindex(range(len(wells_df))).to_numpy()
+    ok = np.isfinite(y)
+    y = (y[ok] > 0).astype(np.float64)
+    if ok.sum() < MIN_TRAIN_WELLS or y.min() == y.max():
+        return None
+
+    base = load_weights(username)[0]
+    types = list(dict.fromkeys(list(base["type_bias"]) + [str(t) for t in wells_df[TYPE_COL]]))
+    onehot = (wells_df[TYPE_COL].astype(str).to_numpy()[ok][:, None] == np.array(types)[None, :]).astype(np.float64)
+    A = np.column_stack([X[ok], onehot, np.ones(len(y))])
+    prior = np.r_[base["coef"], [base["type_bias"].get(t, 0.0) for t in types], base["bias"]]
+    w = prior.copy()
+    for _ in range(50):
+        p = 1.0 / (1.0 + np.exp(-A @ w))
+        grad = A.T @ (p - y) + PRIOR_STRENGTH * (w - prior)
+        hess = (A * (p * (1 - p))[:, None]).T @ A + PRIOR_STRENGTH * np.eye(len(w))
+        step = np.linalg.solve(hess, grad)
+        w -= step
+        if np.abs(step).max() < 1e-8:
+            break
+    p = np.clip(1.0 / (1.0 + np.exp(-A @ w)), 1e-9, 1 - 1e-9)
+    logloss = float(-np.mean(y * np.log(p) + (1 - y) * np.log(1 - p)))
+    n = X.shape[1]
+    weights = {"coef": w[:n], "bias": w[-1:], "type_bias": w[n:-1]}
+    meta = {"features": list(FEATURES), "types": types,
+            "fit": {"wells": int(len(y)), "positives": int(y.sum()), "logloss": logloss,
+                    "summary": f"{len(y)} 口井 ({int(y.sum())} 口实际发生) 训练，对数损失 {logloss:.3f}"}}
+    return weights, meta
+
+
+# ==================================================
+# 规范化 + 特征
+# ==================================================
+def normalize(df):
+    """
+    风险表列类型只转换一次：接入阶段已按 schema 转好时直接返回，
+    回退路径下 (如 '88%' 字符串、日期字符串) 只对尚未转换的列套用同一份 schema，
+    已是 0~1 小数的概率列不会再除一次 100。
+    """
+    pending = []
+    if PROB_COL in df.columns and not pd.api.types.is_float_dtype(df[PROB_COL]):
+        pending.append(PROB_COL)
+    if DATE_COL in df.columns and not pd.api.types.is_datetime64_any_dtype(df[DATE_COL]):
+        pending.append(DATE_COL)
+    if not pending:
+        return df
+    return data_ingest.apply_schema(df, "风险预测", columns=pending)
+
+
+def well_features(df):
+    """
+    按井汇总预警记录 (每口井取概率最高的一条) 并构建特征矩阵。
+    返回 (每井一行的 DataFrame, 特征矩阵 井数 × len(FEATURES))。
+    """
+    n = len(df)
+    prob = df[PROB_COL].to_numpy(np.float64, na_value=np.nan) if PROB_COL in df.columns else np.full(n, 0.5)
+    prob = np.clip(np.nan_to_num(prob, nan=0.5), 1e-4, 1 - 1e-4)
+    codes, wells = pd.factorize(df[WELL_COL] if WELL_COL in df.columns else pd.RangeIndex(n))
+
+    if DATE_COL in df.columns:
+        days = df[DATE_COL].to_numpy("datetime64[D]").astype(np.int64).astype(np.float64)
+        dated = df[DATE_COL].notna().to_numpy()
+        # 以最早的预警日期为基准，没有日期的记录按最不紧迫处理
+        base = days[dated].min() if dated.any() else 0.0
+        horizon = np.where(dated, days - base, HORIZON_CAP_DAYS)
+    else:
+        horizon = np.zeros(n)
+    horizon = np.clip(horizon, 0, HORIZON_CAP_DAYS)
+
+    # 井内按概率降序排序，每段的首行即该井的代表记录
+    order = np.lexsort((-prob, codes))
+    sorted_codes = codes[order]
+    starts = np.flatnonzero(np.r_[True, sorted_codes[1:] != sorted_codes[:-1]])
+    lead = order[starts]
+    alerts = np.diff(np.r_[starts, n])
+    nearest = np.minimum.reduceat(horizon[order], starts)
+
+    wells_df = pd.DataFrame({
+        WELL_COL: np.asarray(wells)[sorted_codes[starts]],
+        TYPE_COL: (df[TYPE_COL].to_numpy()[lead] if TYPE_COL in df.columns else "未知"),
+        PROB_COL: prob[lead],
+        "距发生天数": nearest,
+        "预警条数": alerts,
+    })
+    X = np.column_stack([np.log(prob[lead] / (1 - prob[lead])), nearest / 30.0, np.log(alerts)])
+    return wells_df, X
+
+
+# ==================================================
+# 打分 + Top-K
+# ==================================================
+def _forward(weights, rows):
+    """逻辑回归前向计算：rows 为特征列 + 最后一列类型偏置，输出 sigmoid(X·w + b + 类型偏置)"""
+    z = rows[:, :-1] @ weights["coef"] + weights["bias"] + rows[:, -1]
+    return 1.0 / (1.0 + np.exp(-z))
+
+
+def score(X, types, weights=DEFAULT_WEIGHTS, batch_key="内置"):
+    """对整列井打分；交给推理服务，与其它会话同一版本模型的请求合并计算"""
+    type_bias = pd.Series(weights["type_bias"], dtype="float64")
+    bias = type_bias.reindex(pd.Index(types).astype(str)).fillna(0.0).to_numpy()
+    rows = np.column_stack([X, bias])
+    return inference_service.infer(META["model_key"], batch_key, weights, rows, _forward, timeout=INFER_TIMEOUT)
+
+
+def top_k(scores, k=TOP_K):
+    """部分排序取得分最高的 k 个下标 (按得分降序)"""
+    k = min(k, len(scores))
+    if k == 0:
+        return np.empty(0, dtype=np.int64)
+    idx = np.argpartition(-scores, k - 1)[:k]
+    return idx[np.argsort(-scores[idx], kind="stable")]
+
+
+def rank_wells(df, weights=DEFAULT_WEIGHTS, k=TOP_K, batch_key="内置"):
+    """完整的扫描流程：规范化 -> 按井特征 -> 打分 -> Top-K"""
+    t0 = time.perf_counter()
+    df = normalize(df)
+    wells_df, X = well_features(df)
+    scores = score(X, wells_df[TYPE_COL].to_numpy(), weights, batch_key)
+    idx = top_k(scores, k)
+    top = wells_df.iloc[idx].reset_index(drop=True)
+    top.insert(2, "风险评分", scores[idx])
+    high = scores > HIGH_RISK_SCORE
+    type_counts = pd.Series(wells_df[TYPE_COL].to_numpy()[high]).astype(str).value_counts()
+    return {
+        "top": top,
+        "wells": int(len(wells_df)),
+        "high_risk": int(high.sum()),
+        "max_score": float(scores.max()) if len(scores) else 0.0,
+        "type_counts": {str(t): int(c) for t, c in type_counts.items()},
+        "elapsed_ms": (time.perf_counter() - t0) * 1000,
+    }
 
 
 def run(context):
-    time.sleep(0.5)
-    return "风险扫描完成"
+    runtime_config.pause(0.5)
+    df = context.get('df')
+    if df is None:
+        return "无数据可扫描"
+    if df.empty or not ({PROB_COL, TYPE_COL} & set(df.columns)):
+        context['risk_summary'] = "数据中没有风险预警字段，未进行风险评分。"
+        return "风险扫描完成 (无风险字段)"
+
+    weights, model_version, batch_key = load_weights(context.get('username'))
+    ranking = rank_wells(df, weights, batch_key=batch_key)
+    ranking['model_version'] = model_version
+    context['risk_ranking'] = ranking
+
+    stream_stats = context.get('stream_stats')
+    if stream_stats:
+        context['risk_summary'] = (f"流式扫描 {stream_stats['rows']:,} 条记录，发现 {stream_stats['high_risk']:,} 条"
+                                   f"高风险预警，已对概率最高的 {len(df)} 条重新评分。")
+    elif ranking['high_risk']:
+        lead = ranking['top'].iloc[0]
+        main_type = max(ranking['type_counts'], key=ranking['type_counts'].get)
+        context['risk_summary'] = (f"扫描 {ranking['wells']} 口井，{ranking['high_risk']} 口井风险评分超过 "
+                                   f"{HIGH_RISK_SCORE:.0%}，以{main_type}为主；最高为 {lead[WELL_COL]} "
+                                   f"({lead[TYPE_COL]}，评分 {lead['风险评分']:.0%})，建议优先排查。")
+    else:
+        context['risk_summary'] = "整体风险可控，无高等级预警。"
+    return f"风险扫描完成 ({ranking['wells']} 口井)"
 
 
 def view(context):
@@ -23,37 +252,34 @@ def view(context):
         return
 
     # ==================================================
-    # 2. 原有的风险展示逻辑
+    # 2. 风险评分结果展示
     # ==================================================
-    if 'df' in context:
-        df = context['df']
-
-        # 简单判断是否有风险
-        has_risk = False
-        if '风险值' in df.columns and df['风险值'].max() > 0.8:
-            has_risk = True
-
-        if has_risk:
-            st.warning("⚠️ 发现潜在生产风险点！(置信度 > 85%)")
-        else:
-            st.success("✅ 当前生产状况健康，未发现显著异常。")
-
-        # 1. 风险统计图
-        if '风险类型' in df.columns:
-            st.caption("风险类型分布统计")
-            risk_counts = df['风险类型'].value_counts()
-            st.bar_chart(risk_counts, color="#ff4b4b")
-
-        # 2. 高风险列表
-        st.write("🔴 **重点关注井号清单**")
-        if '风险值' in df.columns:
-            # 筛选高风险
-            high_risk = df[df['风险值'] > 0.6].copy()
-            # 格式化一下风险值显示
-            high_risk['风险值'] = high_risk['风险值'].apply(lambda x: f"{x * 100:.1f}%")
-
-            st.dataframe(high_risk, use_container_width=True)
-            context['risk_summary'] = f"扫描发现 {len(high_risk)} 口井存在潜在风险，建议优先排查套损问题。"
-        else:
-            st.dataframe(df)
-            context['risk_summary'] = "整体风险可控，无高等级预警。"
\ No newline at end of file
+    ranking = context.get('risk_ranking')
+    if ranking is None:
+        st.dataframe(context.get('df'))
+        return
+
+    if ranking['max_score'] > 0.8:
+        st.warning(f"⚠️ 发现潜在生产风险点！{ranking['high_risk']} 口井风险评分超过 {HIGH_RISK_SCORE:.0%}")
+    else:
+        st.success("✅ 当前生产状况健康，未发现显著异常。")
+
+    # 1. 风险统计图 (流式模式下使用全量分块计数)
+    stream_stats = context.get('stream_stats')
+    if stream_stats and not stream_stats['type_counts'].empty:
+        st.caption(f"风险类型分布统计 (流式汇总 {stream_stats['rows']:,} 条)")
+        st.bar_chart(stream_stats['type_counts'], color="#ff4b4b")
+    elif ranking['type_counts']:
+        st.caption(f"高风险井类型分布 (评分 > {HIGH_RISK_SCORE:.0%})")
+        st.bar_chart(pd.Series(ranking['type_counts']), color="#ff4b4b")
+
+    # 2. 高风险列表 (百分比格式交给表格列配置，不逐行转换字符串)
+    st.write(f"🔴 **重点关注井号清单** (评分最高的 {len(ranking['top'])} 口 / 共 {ranking['wells']} 口)")
+    st.caption(f"评分模型: {ranking.get('model_version', '内置')} | 耗时 {ranking['elapsed_ms']:.1f} ms")
+    top = ranking['top'].assign(**{"风险评分": ranking['top']["风险评分"] * 100,
+                                   PROB_COL: ranking['top'][PROB_COL] * 100})
+    st.dataframe(top, use_container_width=True, hide_index=True, column_config={
+        "风险评分": st.column_config.ProgressColumn("风险评分", format="%.1f%%", min_value=0, max_value=100),
+        PROB_COL: st.column_config.NumberColumn(PROB_COL, format="%.1f%%"),
+        "距发生天数": st.column_config.NumberColumn("距发生天数", format="%d 天"),
+    })
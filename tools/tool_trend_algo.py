@@ -1,10 +1,36 @@
 # tools/tool_trend_algo.py
 import streamlit as st
-import matplotlib.pyplot as plt
-import pandas as pd
 import time
+import math
+import threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+import model_store
+import runtime_config
+import render_cache
 import os
-from matplotlib import font_manager
+
+META = {"name": "产量趋势预测算法", "icon": "📈", "order": 6, "model_key": "model_trend"}
+INPUTS = ('df', 'month', 'inference')
+OUTPUTS = ('trend_summary', 'trend_forecast')
+
+# Arps 递减：b=0 指数、0<b<1 双曲、b=1 调和；b 在网格上取值，每个 b 下线性化后做闭式最小二乘
+B_GRID = np.round(np.linspace(0.0, 1.0, 11), 2)
+FORECAST_DAYS = 30
+MIN_POINTS = 3
+Z_95 = 1.96
+# 区间校准：每口井按时间后 20% 的点作检验，至少需要的检验点数
+HOLDOUT_FRACTION = 0.2
+MIN_HOLDOUT = 5
+WELL_COLUMNS = ("井号", "well", "well_id")
+RATE_COLUMNS = ("predicted_yield", "日产油", "产量")
+
+# 进程级参数缓存：(井号, 该井数据指纹) -> 拟合参数；数据未变的井不重新拟合
+_PARAM_CACHE_SIZE = 200_000
+_param_cache = OrderedDict()
+_param_lock = threading.Lock()
+PARAM_FIELDS = ("qi", "di", "b", "sse", "n", "t_mean", "stt", "t_last", "first_day")
 
 
 # --- 字体辅助函数 (保持不变) ---
@@ -12,16 +38,290 @@ def get_chinese_font():
     """
     加载项目根目录下的 msyh.ttc 字体
     """
+    from matplotlib import font_manager  # 只在真正绘图时加载 matplotlib
     font_path = "msyh.ttc"
     if not os.path.exists(font_path):
         return font_manager.FontProperties(family='Microsoft YaHei')
     return font_manager.FontProperties(fname=font_path)
 
 
+# ==================================================
+# Arps 递减曲线拟合 (全部井一次向量化)
+# ==================================================
+def arps_rate(qi, di, b, t):
+    """Arps 产量公式，参数可以是按井广播的数组 (b=0 时为指数递减)"""
+    b = np.asarray(b, dtype=np.float64)
+    safe_b = np.where(b > 0, b, 1.0)
+    with np.errstate(invalid="ignore", divide="ignore", over="ignore"):
+        hyperbolic = qi * np.power(1 + safe_b * di * t, -1 / safe_b)
+        return np.where(b > 0, hyperbolic, qi * np.exp(-di * t))
+
+
+def _well_matrix(wells, days, rates):
+    """长表 -> (井数 × 最大点数) 的矩阵，按时间排序，空位为 NaN"""
+    codes, uniques = pd.factorize(wells, sort=True)
+    order = np.lexsort((days, codes))
+    codes, days, rates = codes[order], days[order], rates[order]
+    counts = np.bincount(codes, minlength=len(uniques))
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    pos = np.arange(len(codes)) - starts[codes]
+    T = np.full((len(uniques), counts.max(initial=1)), np.nan)
+    Q = np.full_like(T, np.nan)
+    T[codes, pos] = days
+    Q[codes, pos] = rates
+    return np.asarray(uniques), T, Q
+
+
+def default_weights():
+    return {"b_grid": B_GRID}, {"forecast_days": FORECAST_DAYS, "z": Z_95}
+
+
+def load_params(username=None):
+    """从模型仓库取当前生效的 b 网格与预测设置 (用户专属优先)"""
+    artifact = model_store.resolve(META["model_key"], username, default_weights)
+    if artifact is None:
+        return {"b_grid": B_GRID, "forecast_days": FORECAST_DAYS, "z": Z_95, "confidence": _normal_level(Z_95),
+                "version": "内置"}
+    z = float(artifact.meta.get("z", Z_95))
+    return {"b_grid": np.asarray(artifact.weights["b_grid"]),
+            "forecast_days": int(artifact.meta.get("forecast_days", FORECAST_DAYS)),
+            "z": z,
+            # 校准过的版本记录的是目标置信水平，z 不再对应正态分位数
+            "confidence": float(artifact.meta.get("confidence", _normal_level(z))),
+            "version": f"{'专属' if artifact.scope != model_store.PUBLIC else '公共'} v{artifact.version}"}
+
+
+def fit_arps(T, Q, b_grid=B_GRID):
+    """
+    对矩阵中的每一行 (一口井) 拟合 Arps 曲线，返回按井的参数数组字典。
+    对每个 b：指数取 ln q、双曲 / 调和取 q^-b，与 t 成线性关系，用求和统计量一次解出所有井；
+    按对数空间残差平方和为每口井选出最优 b。
+    """
+    first_day = np.nanmin(T, axis=1)
+    valid = np.isfinite(T) & np.isfinite(Q) & (Q > 0)
+    t = np.where(valid, T - first_day[:, None], 0.0)
+    log_q = np.log(np.where(valid, Q, 1.0))
+    n = valid.sum(axis=1).astype(np.float64)
+    s_t, s_tt = t.sum(axis=1), (t * t).sum(axis=1)
+    denom = n * s_tt - s_t ** 2
+
+    wells = len(T)
+    best = {"qi": np.full(wells, np.nan), "di": np.full(wells, np.nan), "b": np.full(wells, np.nan),
+            "sse": np.full(wells, np.inf)}
+    with np.errstate(invalid="ignore", divide="ignore", over="ignore"):
+        for b in b_grid:
+            y = np.where(valid, log_q if b == 0 else np.exp(-b * log_q), 0.0)
+            s_y, s_ty = y.sum(axis=1), (t * y).sum(axis=1)
+            slope = (n * s_ty - s_t * s_y) / denom
+            intercept = (s_y - slope * s_t) / n
+            if b == 0:
+                qi, di = np.exp(intercept), -slope
+            else:
+                qi, di = np.power(intercept, -1 / b), slope / (intercept * b)
+            fitted = arps_rate(qi[:, None], di[:, None], b, t)
+            resid = np.where(valid, np.log(fitted) - log_q, 0.0)
+            sse = (resid ** 2).sum(axis=1)
+            ok = (n >= MIN_POINTS) & (denom > 0) & np.isfinite(sse) & np.isfinite(qi) & (qi > 0)
+            better = ok & (sse < best["sse"])
+            best["qi"][better], best["di"][better], best["b"][better] = qi[better], di[better], b
+            best["sse"][better] = sse[better]
+
+        best["n"] = n
+        best["t_mean"] = np.where(n > 0, s_t / n, 0.0)
+        best["stt"] = s_tt - n * best["t_mean"] ** 2
+        best["t_last"] = np.nanmax(np.where(valid, t, np.nan), axis=1)
+    best["first_day"] = first_day
+    best["sse"][~np.isfinite(best["sse"])] = np.nan
+    return best
+
+
+def forecast_arps(params, days, z=Z_95):
+    """按井预测指定日历日 (与拟合时同一时间轴) 的产量及置信区间，返回 (q, lo, hi)，形状 井数 × 天数"""
+    t = days[None, :] - params["first_day"][:, None]
+    q = arps_rate(params["qi"][:, None], params["di"][:, None], params["b"][:, None], t)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        sigma = np.sqrt(params["sse"] / np.maximum(params["n"] - 2, 1))
+        leverage = 1 + 1 / params["n"][:, None] + (t - params["t_mean"][:, None]) ** 2 / params["stt"][:, None]
+        spread = np.exp(z * sigma[:, None] * np.sqrt(leverage))
+    return q, q / spread, q * spread
+
+
+def _well_fingerprints(codes, row_hashes, wells):
+    """每口井的数据指纹 (该井所有行哈希之和，行顺序无关)"""
+    sums = np.zeros(wells, dtype=np.uint64)
+    np.add.at(sums, codes, row_hashes)
+    return sums
+
+
+def fit_wells(frame, well_col, rate_col, b_grid=B_GRID):
+    """
+    拟合全部井，数据未变化的井直接复用缓存参数。
+    返回 (井号数组, 参数字典, 重新拟合的井数)
+    """
+    days = (frame["date"].to_numpy("datetime64[D]").astype(np.int64).astype(np.float64)
+            if "date" in frame.columns else np.arange(len(frame), dtype=np.float64))
+    wells = frame[well_col].to_numpy() if well_col else np.zeros(len(frame), dtype=np.int64)
+    rates = pd.to_numeric(frame[rate_col], errors="coerce").to_numpy(np.float64)
+
+    codes, uniques = pd.factorize(wells, sort=True)
+    row_hashes = pd.util.hash_pandas_object(pd.DataFrame({"t": days, "q": rates}), index=False).to_numpy()
+    fingerprints = _well_fingerprints(codes, row_hashes, len(uniques))
+    # b 网格不同 (换了模型版本) 的拟合结果不能互相复用
+    grid_key = tuple(np.round(b_grid, 6).tolist())
+    keys = [(well, fp, grid_key) for well, fp in zip(uniques.tolist(), fingerprints.tolist())]
+
+    with _param_lock:
+        cached = [_param_cache.get(key) for key in keys]
+    missing = np.array([c is None for c in cached], dtype=bool)
+
+    params = {field: np.empty(len(uniques)) for field in PARAM_FIELDS}
+    if missing.any():
+        rows = missing[codes]
+        _, T, Q = _well_matrix(codes[rows], days[rows], rates[rows])
+        fitted = fit_arps(T, Q, b_grid)
+        for field in PARAM_FIELDS:
+            params[field][missing] = fitted[field]
+    hit = np.flatnonzero(~missing)
+    for field_idx, field in enumerate(PARAM_FIELDS):
+        params[field][hit] = [cached[i][field_idx] for i in hit]
+
+    with _param_lock:
+        for i in np.flatnonzero(missing):
+            _param_cache[keys[i]] = tuple(float(params[field][i]) for field in PARAM_FIELDS)
+        for key in keys:
+            if key in _param_cache:
+                _param_cache.move_to_end(key)
+        while len(_param_cache) > _PARAM_CACHE_SIZE:
+            _param_cache.popitem(last=False)
+    return np.asarray(uniques), params, int(missing.sum())
+
+
+def _model_name(b):
+    if not np.isfinite(b):
+        return "拟合失败"
+    return "指数" if b == 0 else ("调和" if b == 1 else "双曲")
+
+
+def _normal_level(z):
+    return math.erf(z / math.sqrt(2))
+
+
+def confidence_label(z):
+    """双侧正态区间的置信水平文字 (z=1.96 -> '95%')"""
+    return f"{_normal_level(z):.0%}"
+
+
+def fit_weights(df, username=None):
+    """
+    用一份产量数据训练 (校准) 预测区间：每口井按时间取前 80% 拟合 Arps 曲线、后 20% 作检验，
+    以检验点标准化对数残差的 95% 分位数作为新的 z，使区间的实际覆盖率回到 95%。
+    返回 (weights, meta)；没有日期 / 产量列或检验点不足时返回 None。
+    """
+    rate_col = rate_column(df)
+    if rate_col is None or "date" not in df.columns:
+        return None
+    if not pd.api.types.is_datetime64_any_dtype(df["date"]):
+        df = df.assign(date=pd.to_datetime(df["date"], errors="coerce"))
+    df = df[df["date"].notna()]
+    well_col = _pick_column(df, WELL_COLUMNS)
+    model = load_params(username)
+
+    wells = df[well_col].to_numpy() if well_col else np.zeros(len(df), dtype=np.int64)
+    codes = pd.factorize(wells)[0]
+    days = df["date"].to_numpy("datetime64[D]").astype(np.int64).astype(np.float64)
+    holdout = (pd.Series(days).groupby(codes).rank(pct=True) > 1 - HOLDOUT_FRACTION).to_numpy()
+    uniques, params, _ = fit_wells(df[~holdout], well_col, rate_col, model["b_grid"])
+
+    w = pd.Index(uniques).get_indexer(wells[holdout])
+    known = w >= 0
+    w, t_day = w[known], days[holdout][known]
+    q = pd.to_numeric(df[rate_col], errors="coerce").to_numpy(np.float64)[holdout][known]
+    with np.errstate(invalid="ignore", divide="ignore", over="ignore"):
+        t = t_day - params["first_day"][w]
+        predicted = arps_rate(params["qi"][w], params["di"][w], params["b"][w], t)
+        sigma = np.sqrt(params["sse"][w] / np.maximum(params["n"][w] - 2, 1))
+        leverage = 1 + 1 / params["n"][w] + (t - params["t_mean"][w]) ** 2 / params["stt"][w]
+        score = np.abs(np.log(q / predicted)) / (sigma * np.sqrt(leverage))
+    score = score[np.isfinite(score)]
+    if len(score) < MIN_HOLDOUT:
+        return None
+
+    z = float(np.clip(np.quantile(score, 0.95), 0.5, 5.0))
+    coverage = float(np.mean(score <= model["z"]))
+    weights = {"b_grid": np.asarray(model["b_grid"])}
+    meta = {"forecast_days": model["forecast_days"], "z": z, "confidence": 0.95,
+            "fit": {"holdout_points": int(len(score)), "coverage_before": coverage, "z_before": model["z"],
+                    "summary": f"检验 {len(score)} 个点：原区间覆盖率 {coverage:.0%} (z={model['z']:.2f})，"
+                               f"校准后 z={z:.2f}"}}
+    return weights, meta
+
+
+def _pick_column(frame, candidates):
+    return next((c for c in candidates if c in frame.columns), None)
+
+
+def rate_column(frame):
+    """产量列：优先已知列名，否则取第一个数值列；都没有时返回 None"""
+    numeric = frame.select_dtypes("number").columns
+    return _pick_column(frame, RATE_COLUMNS) or (numeric[0] if len(numeric) else None)
+
+
 def run(context):
-    # 后端模拟运行逻辑
-    time.sleep(0.5)
-    return "预测完成"
+    runtime_config.pause(0.5)
+    df = context.get('df')
+    if df is None or df.empty:
+        context['trend_summary'] = "数据不足，无法生成摘要。"
+        return "无数据可预测"
+
+    rate_col = rate_column(df)
+    if rate_col is None:
+        context['trend_summary'] = "数据中没有可拟合的产量列 (无数值列)，未进行递减拟合。"
+        return "预测完成 (无可拟合的产量列)"
+    # 没有井号列时 (如月度汇总曲线) 视为一口"全油田"井
+    well_col = _pick_column(df, WELL_COLUMNS)
+    model = load_params(context.get('username'))
+    t0 = time.perf_counter()
+    wells, params, refit = fit_wells(df, well_col, rate_col, model["b_grid"])
+
+    # 预测下一个月：所有井对齐到同一日历日后求和 (区间取各井上下界之和，偏保守)
+    last_day = np.nanmax(params["first_day"] + params["t_last"])
+    horizon = last_day + np.arange(1, model["forecast_days"] + 1)
+    q, lo, hi = forecast_arps(params, horizon, model["z"])
+    fitted_ok = np.isfinite(q[:, 0])
+    epoch = np.datetime64("1970-01-01", "D")
+    dates = epoch + horizon.astype("timedelta64[D]") if "date" in df.columns else horizon
+    forecast = pd.DataFrame({"date": dates, "q": np.nansum(q, axis=0),
+                             "lo": np.nansum(lo, axis=0), "hi": np.nansum(hi, axis=0)})
+
+    models = pd.Series([_model_name(b) for b in params["b"]]).value_counts()
+    well_params = pd.DataFrame({"well": wells.astype(str), "model": [_model_name(b) for b in params["b"]],
+                                "qi": params["qi"], "di": params["di"], "b": params["b"],
+                                "points": params["n"].astype(int)})
+    context['trend_forecast'] = {
+        "forecast": forecast,
+        "params": well_params,
+        "wells": int(len(wells)),
+        "fitted_wells": int(fitted_ok.sum()),
+        "refit": refit,
+        "models": {str(k): int(v) for k, v in models.items()},
+        "model_version": model["version"],
+        "confidence": f"{model['confidence']:.0%}",
+        "elapsed_ms": (time.perf_counter() - t0) * 1000,
+    }
+
+    if not fitted_ok.any():
+        context['trend_summary'] = "有效数据点不足，无法拟合递减曲线。"
+        return "预测完成 (拟合失败)"
+
+    current = df.groupby("date")[rate_col].sum().iloc[-1] if "date" in df.columns else df[rate_col].iloc[-1]
+    mean_q, mean_lo, mean_hi = forecast["q"].mean(), forecast["lo"].mean(), forecast["hi"].mean()
+    change = mean_q / current - 1 if current else 0.0
+    dominant = models.index[0]
+    next_month = context.get('month', 0) % 12 + 1
+    context['trend_summary'] = (f"Arps 递减拟合 {fitted_ok.sum()} 口井 (以{dominant}递减为主)，"
+                                f"预计{next_month}月日产量约 {mean_q:.1f} 吨 ({context['trend_forecast']['confidence']} 区间 {mean_lo:.1f}~{mean_hi:.1f})，"
+                                f"较当前 {change:+.1%}。")
+    return f"预测完成 ({len(wells)} 口井，重新拟合 {refit} 口)"
 
 
 def view(context):
@@ -40,46 +340,64 @@ def view(context):
         return
 
     # ==================================================
-    # 2. 原有的预测图表渲染逻辑
+    # 2. 历史曲线 + Arps 递减预测及置信带 (置信水平取自模型版本)
     # ==================================================
     st.info("📉 正在渲染未来产量趋势预测曲线...")
 
-    zh_font = get_chinese_font()
-
     if 'df' in context:
         df = context['df']
+        trend = context.get('trend_forecast') or {}
+        forecast = trend.get('forecast')
+        confidence = trend.get('confidence', confidence_label(Z_95))
+        rate_col = rate_column(df)
+        if rate_col is None:
+            st.warning(context.get('trend_summary') or "数据中没有可拟合的产量列。")
+            st.dataframe(df.head(render_cache.MAX_TABLE_ROWS))
+            return
+
+        # 接入阶段已按 schema 转好类型，仅在回退路径下才需要解析 (不原地修改上下文中的数据)
+        if 'date' in df.columns and not pd.api.types.is_datetime64_any_dtype(df['date']):
+            df = df.assign(date=pd.to_datetime(df['date']))
+
+        # --- 绘图逻辑 (输入不变时直接回放缓存的 PNG) ---
+        def build_fig():
+            import matplotlib.pyplot as plt
+            zh_font = get_chinese_font()
+            fig, ax = plt.subplots(figsize=(10, 4))
+
+            # 多井数据按日汇总成全油田曲线
+            history = df.groupby('date')[rate_col].sum() if 'date' in df.columns else df[rate_col]
+            ax.plot(history.index, history.values,
+                    label='历史日产量',
+                    color='#1f77b4',
+                    linewidth=2,
+                    marker='o',
+                    markersize=3,
+                    linestyle='-')
+
+            if forecast is not None and not forecast.empty:
+                ax.plot(forecast['date'], forecast['q'],
+                        label='Arps 递减预测',
+                        color='#d62728',
+                        linewidth=2.5,
+                        linestyle='--')
+                ax.fill_between(forecast['date'], forecast['lo'], forecast['hi'],
+                                alpha=0.15, color='red', label=f'{confidence} 置信区间')
+
+            # 设置中文
+            ax.set_title(f"{context.get('month')}月 产量递减拟合与下月预测",
+                         fontsize=12, fontproperties=zh_font)
+            ax.legend(loc='upper right', prop=zh_font)
+            ax.set_xlabel("时间", fontproperties=zh_font)
+            ax.set_ylabel("日产量 (吨)", fontproperties=zh_font)
+
+            ax.grid(True, linestyle='--', alpha=0.3)
+            return fig
+
+        render_cache.pyplot("tool_trend_algo", {"df": df, "forecast": forecast, "month": context.get('month'),
+                                               "confidence": confidence},
+                            build_fig)
 
-        if 'date' in df.columns:
-            df['date'] = pd.to_datetime(df['date'])
-
-        # --- 绘图逻辑 ---
-        fig, ax = plt.subplots(figsize=(10, 4))
-
-        # 绘制预测线
-        ax.plot(df['date'], df['predicted_yield'],
-                label='AI 预测趋势',
-                color='#d62728',
-                linewidth=2.5,
-                marker='o',
-                markersize=4,
-                linestyle='-')
-
-        # 设置中文
-        ax.set_title(f"{context.get('month')}月 全周期产量推演 (AI Predicted)",
-                     fontsize=12, fontproperties=zh_font)
-        ax.legend(loc='upper right', prop=zh_font)
-        ax.set_xlabel("预测时间轴", fontproperties=zh_font)
-        ax.set_ylabel("日产量 (吨)", fontproperties=zh_font)
-
-        ax.grid(True, linestyle='--', alpha=0.3)
-        ax.fill_between(df['date'], df['predicted_yield'], alpha=0.1, color='red')
-
-        st.pyplot(fig)
-
-        # 生成摘要
-        if not df.empty:
-            min_val = df['predicted_yield'].min()
-            max_val = df['predicted_yield'].max()
-            context['trend_summary'] = f"预计全月产量将在 {min_val}~{max_val} 吨区间运行，呈现平稳缓降趋势。"
-        else:
-            context['trend_summary'] = "数据不足，无法生成摘要。"
\ No newline at end of file
+        if trend.get('params') is not None and trend['wells'] > 1:
+            with st.expander(f"单井递减参数 ({trend['fitted_wells']}/{trend['wells']} 口拟合成功)"):
+                st.dataframe(trend['params'], use_container_width=True, hide_index=True)
\ No newline at end of file
@@ -1,11 +1,297 @@
 # tools/tool_water_algo.py
 import streamlit as st
+import json
+import logging
+import os
 import time
+import numpy as np
+import pandas as pd
+import model_store
+import runtime_config
+import render_cache
+from safe_io import atomic_write_json, file_lock
+
+META = {"name": "智能配注优化模型", "icon": "💧", "order": 8, "model_key": "model_water"}
+INPUTS = ('df', 'stream_stats', 'month', 'water_budget', 'inference')
+OUTPUTS = ('water_summary', 'water_plan')
+
+# ==================================================
+# 配注优化模型
+# ==================================================
+# min Σ (x_i - r_i)² / r_i - Σ p_i x_i   s.t.  Σ x_i = V,  l_i ≤ x_i ≤ u_i
+#   r_i 建议配注 (按相对偏离计代价)，p_i 优先级收益 (同样的水量优先给高优先级井)，V 总配注量 (默认保持建议总量)
+#   上限 u_i：按线性吸水关系 Δp_i(x) = 预计增压_i · x / r_i，增压不超过 PRESSURE_LIMIT_MPA，且不超过设备增注上限
+# Hessian 为对角阵、只有一条耦合约束，KKT 条件给出 x_i(λ) = clip(r_i + r_i (λ + p_i) / 2, l_i, u_i)，
+# Σ x_i(λ) 关于 λ 单调分段线性，对 λ 求根即可精确求解；上月的 λ 作为热启动初值
+PRIORITY_BONUS = {"高": 0.2, "中": 0.0, "低": -0.2}
+PRESSURE_LIMIT_MPA = float(os.environ.get("PETRO_WATER_PRESSURE_LIMIT", "0.5"))
+MAX_UPLIFT = 0.3   # 单井最多在建议量基础上增注 30%
+MAX_CUT = 0.5      # 单井最多减注 50%
+# 训练用的实际执行配注列；至少需要的有效井数
+ACTUAL_COL = "实际配注"
+MIN_TRAIN_WELLS = 5
+SOLVER_TOL = 1e-9
+MAX_ITER = 200
+# 各月求解结果 (λ 与单井配注)，供下月热启动与环比
+PLAN_STORE = os.environ.get("PETRO_WATER_PLANS", os.path.join("data", ".water_plans.json"))
+
+logger = logging.getLogger(__name__)
+
+
+def default_weights():
+    levels = list(PRIORITY_BONUS)
+    weights = {"priority_bonus": np.array([PRIORITY_BONUS[k] for k in levels]),
+               "limits": np.array([PRESSURE_LIMIT_MPA, MAX_UPLIFT, MAX_CUT])}
+    return weights, {"levels": levels, "limits": ["pressure_limit_mpa", "max_uplift", "max_cut"]}
+
+
+def load_params(username=None):
+    """从模型仓库取当前生效的配注参数 (用户专属优先)"""
+    artifact = model_store.resolve(META["model_key"], username, default_weights)
+    if artifact is None:
+        return {"bonus": PRIORITY_BONUS, "pressure_limit": PRESSURE_LIMIT_MPA, "max_uplift": MAX_UPLIFT,
+                "max_cut": MAX_CUT, "version": "内置"}
+    pressure_limit, max_uplift, max_cut = artifact.weights["limits"].tolist()
+    return {"bonus": dict(zip(artifact.meta["levels"], artifact.weights["priority_bonus"].tolist())),
+            "pressure_limit": pressure_limit, "max_uplift": max_uplift, "max_cut": max_cut,
+            "version": f"{'专属' if artifact.scope != model_store.PUBLIC else '公共'} v{artifact.version}"}
+
+
+def fit_weights(df, username=None):
+    """
+    用带实际执行配注 (ACTUAL_COL) 的数据校准单井增注/减注上限：取实际相对建议量偏离的 95% 分位，
+    优先级收益与压力上限沿用当前生效的参数。
+    返回 (weights, meta)；缺少实际配注列或有效井数不足时返回 None。
+    """
+    if ACTUAL_COL not in df.columns or "建议配注" not in df.columns:
+        return None
+    suggested = pd.to_numeric(df["建议配注"], errors="coerce").to_numpy(np.float64)
+    actual = pd.to_numeric(df[ACTUAL_COL], errors="coerce").to_numpy(np.float64)
+    ok = np.isfinite(suggested) & np.isfinite(actual) & (suggested > 0) & (actual >= 0)
+    if ok.sum() < MIN_TRAIN_WELLS:
+        return None
+    ratio = actual[ok] / suggested[ok] - 1.0
+    params = load_params(username)
+    uplift = (float(np.clip(np.quantile(ratio[ratio > 0], 0.95), 0.0, 2.0))
+              if (ratio > 0).any() else params["max_uplift"])
+    cut = (float(np.clip(np.quantile(-ratio[ratio < 0], 0.95), 0.0, 1.0))
+           if (ratio < 0).any() else params["max_cut"])
+    levels = list(params["bonus"])
+    weights = {"priority_bonus": np.array([params["bonus"][k] for k in levels]),
+               "limits": np.array([params["pressure_limit"], uplift, cut])}
+    meta = {"levels": levels, "limits": ["pressure_limit_mpa", "max_uplift", "max_cut"],
+            "fit": {"wells": int(ok.sum()),
+                    "summary": (f"{int(ok.sum())} 口井实际执行校准：增注上限 {params['max_uplift']:.0%} → {uplift:.0%}，"
+                                f"减注上限 {params['max_cut']:.0%} → {cut:.0%}")}}
+    return weights, meta
+
+
+def prepare_wells(df, bonus_map=PRIORITY_BONUS):
+    """按井汇总 (同一井多行时配注求和、增压取最大、优先级取最高)，返回求解所需的数组"""
+    level = df["执行优先级"].astype(str) if "执行优先级" in df.columns else pd.Series("中", index=df.index)
+    frame = pd.DataFrame({
+        "井号": df["井号"].astype(str).to_numpy() if "井号" in df.columns else np.arange(len(df)).astype(str),
+        "r": pd.to_numeric(df["建议配注"], errors="coerce").to_numpy(np.float64),
+        "dp": (pd.to_numeric(df["预计增压"], errors="coerce").to_numpy(np.float64)
+               if "预计增压" in df.columns else np.zeros(len(df))),
+        "level": level.to_numpy(),
+        "p": level.map(bonus_map).to_numpy(np.float64, na_value=np.nan),
+    })
+    frame = frame[frame["r"] > 0]
+    if frame["井号"].duplicated().any():
+        frame = frame.sort_values("p", ascending=False, kind="stable")
+        frame = frame.groupby("井号", sort=False, as_index=False).agg(
+            r=("r", "sum"), dp=("dp", "max"), level=("level", "first"), p=("p", "first"))
+    frame["dp"] = frame["dp"].fillna(0.0)
+    frame["p"] = frame["p"].fillna(0.0)
+    return frame
+
+
+def bounds(r, dp, pressure_limit=PRESSURE_LIMIT_MPA, max_uplift=MAX_UPLIFT, max_cut=MAX_CUT):
+    """由增压限制与设备能力得到单井配注上下限"""
+    upper = r * (1 + max_uplift)
+    with np.errstate(divide="ignore"):
+        pressure_cap = np.where(dp > 0, r * pressure_limit / dp, np.inf)
+    upper = np.minimum(upper, pressure_cap)
+    lower = np.minimum(r * (1 - max_cut), upper)
+    return lower, upper
+
+
+def solve_allocation(r, bonus, lower, upper, volume, lam0=0.0):
+    """
+    对偶求根求解配注二次规划。
+    返回 (x, λ, 迭代次数, 实际总量)；V 超出 [Σl, Σu] 时取最接近的可行总量。
+    """
+    volume = float(np.clip(volume, lower.sum(), upper.sum()))
+
+    def allocate(lam):
+        return np.clip(r + r * (lam + bonus) / 2, lower, upper)
+
+    def total(lam):
+        return allocate(lam).sum()
+
+    tol = SOLVER_TOL * max(volume, 1.0)
+    iterations = 1
+    gap = total(lam0) - volume
+    if abs(gap) <= tol:
+        return allocate(lam0), lam0, iterations, volume
+
+    # 从热启动点向外倍增步长找到包含根的区间，再二分 (区间内分段线性，最后一步线性插值)
+    step = max(abs(lam0), 1.0)
+    lo = hi = lam0
+    if gap < 0:
+        while total(hi) < volume and iterations < MAX_ITER:
+            lo, hi, step, iterations = hi, hi + step, step * 2, iterations + 1
+    else:
+        while total(lo) > volume and iterations < MAX_ITER:
+            hi, lo, step, iterations = lo, lo - step, step * 2, iterations + 1
+    f_lo, f_hi = total(lo) - volume, total(hi) - volume
+    while iterations < MAX_ITER and hi - lo > 1e-12 * max(1.0, abs(lo)):
+        mid = lo - f_lo * (hi - lo) / (f_hi - f_lo) if f_hi != f_lo else (lo + hi) / 2
+        # 插值点贴近端点时退回二分，保证区间至少缩小一半
+        if not (lo + 0.01 * (hi - lo) < mid < hi - 0.01 * (hi - lo)):
+            mid = (lo + hi) / 2
+        f_mid = total(mid) - volume
+        iterations += 1
+        if abs(f_mid) <= tol:
+            lo = hi = mid
+            break
+        if f_mid < 0:
+            lo, f_lo = mid, f_mid
+        else:
+            hi, f_hi = mid, f_mid
+    lam = (lo + hi) / 2
+    return allocate(lam), lam, iterations, volume
+
+
+# ==================================================
+# 月度方案存取 (热启动)
+# ==================================================
+def _load_plans():
+    try:
+        with open(PLAN_STORE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def previous_plan(month):
+    """上月 (或最近一个更早月份) 的求解结果"""
+    plans = _load_plans()
+    if not isinstance(month, int):
+        return None
+    earlier = [int(m) for m in plans if int(m) < month]
+    return plans[str(max(earlier))] if earlier else None
+
+
+def save_plan(month, lam, wells, x):
+    if not isinstance(month, int):
+        return
+    entry = {"lambda": lam, "x": dict(zip(wells, np.round(x, 4).tolist())), "saved_at": time.time()}
+    try:
+        os.makedirs(os.path.dirname(PLAN_STORE) or ".", exist_ok=True)
+        # 读-改-写整体加锁，并发会话保存不同月份时不会互相覆盖
+        with file_lock(PLAN_STORE):
+            plans = _load_plans()
+            plans[str(month)] = entry
+            atomic_write_json(PLAN_STORE, plans, indent=None)
+    except OSError as e:
+        logger.warning("配注方案未保存: %s", e)
+
+
+def optimize(df, month=None, volume=None, params=None):
+    """对一份配注数据求解，返回方案字典 (单井方案表 + 求解统计)"""
+    t0 = time.perf_counter()
+    params = params or {"bonus": PRIORITY_BONUS, "pressure_limit": PRESSURE_LIMIT_MPA,
+                        "max_uplift": MAX_UPLIFT, "max_cut": MAX_CUT}
+    wells = prepare_wells(df, params["bonus"])
+    r, dp, bonus = (wells[c].to_numpy() for c in ("r", "dp", "p"))
+    lower, upper = bounds(r, dp, params["pressure_limit"], params["max_uplift"], params["max_cut"])
+    requested = float(r.sum()) if volume is None else float(volume)
+
+    prev = previous_plan(month)
+    lam0 = prev["lambda"] if prev else 0.0
+    x, lam, iterations, total = solve_allocation(r, bonus, lower, upper, requested, lam0)
+
+    names = wells["井号"].to_numpy()
+    prev_x = (pd.Series(prev["x"], dtype="float64").reindex(names).to_numpy() if prev
+              else np.full(len(names), np.nan))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        pressure = np.where(r > 0, dp * x / r, 0.0)
+    plan = pd.DataFrame({
+        "井号": names,
+        "执行优先级": wells["level"].to_numpy(),
+        "建议配注": r,
+        "优化配注": x,
+        "调整量": x - r,
+        "配注上限": upper,
+        "优化后增压": pressure,
+        "较上月": x - prev_x,
+    })
+    save_plan(month, lam, names.tolist(), x)
+    return {
+        "plan": plan,
+        "wells": int(len(plan)),
+        "requested": requested,
+        "total": total,
+        "feasible": abs(total - requested) <= SOLVER_TOL * max(requested, 1.0),
+        "pressure_limited": int(np.sum(np.isclose(x, upper) & (upper < r))),
+        "cut_volume": float(np.clip(r - x, 0, None).sum()),
+        "max_pressure": float(pressure.max()) if len(pressure) else 0.0,
+        "pressure_limit": params["pressure_limit"],
+        "model_version": params.get("version", "内置"),
+        "lambda": lam,
+        "iterations": iterations,
+        "warm_start": prev is not None,
+        "elapsed_ms": (time.perf_counter() - t0) * 1000,
+    }
+
+
+
+def _target_col(df):
+    """自动适配列名，返回 (目标列, 指标名)"""
+    if '调整量' in df.columns:
+        return '调整量', "总增注量"
+    if '建议配注' in df.columns:
+        return '建议配注', "总建议配注量"
+    return None, "数值统计"
 
 
 def run(context):
-    time.sleep(0.5)
-    return "方案生成完毕"
+    runtime_config.pause(0.5)
+    df = context.get('df')
+    if df is None:
+        return "无数据可优化"
+
+    target_col, metric_label = _target_col(df)
+    # 流式模式下 df 只是前 1000 行预览，井数与合计取全量分块聚合结果，不对预览求解
+    stream_stats = context.get('stream_stats')
+    if stream_stats or '建议配注' not in df.columns:
+        well_count = stream_stats['well_count'] if stream_stats else len(df)
+        if stream_stats:
+            total_vol = stream_stats['total']
+        else:
+            total_vol = df[target_col].sum() if target_col else 0
+        context['water_summary'] = f"共 {well_count} 口井，{metric_label}合计 {total_vol:.1f} m³。"
+        return "方案生成完毕"
+
+    _solve_into(context, df, context.get('water_budget'), "指令指定" if context.get('water_budget') else "建议配注合计")
+    result = context['water_plan']
+    return f"方案生成完毕 (迭代 {result['iterations']} 次{'，热启动' if result['warm_start'] else ''})"
+
+
+def _solve_into(context, df, budget, source):
+    """求解并把方案与摘要写回上下文 (run 与视图中手动调整总量共用)"""
+    result = optimize(df, context.get('month'), budget, load_params(context.get('username')))
+    result['budget_source'] = source
+    context['water_plan'] = result
+    summary = (f"针对 {result['wells']} 口井求解配注优化 (增压上限 {result['pressure_limit']:g} MPa)，"
+               f"目标总配注 {result['requested']:.1f} m³ ({source})，实际 {result['total']:.1f} m³")
+    if not result['feasible']:
+        summary += " (目标超出压力与设备约束下的可行范围)"
+    if result['cut_volume'] > 0:
+        summary += f"；{result['pressure_limited']} 口井受压力上限约束，按优先级共减注 {result['cut_volume']:.1f} m³"
+    context['water_summary'] = summary + f"，优化后最大增压 {result['max_pressure']:.2f} MPa。"
 
 
 def view(context):
@@ -23,49 +309,77 @@ def view(context):
         return
 
     # ==================================================
-    # 2. 原有的配注方案展示逻辑
+    # 2. 配注方案展示
     # ==================================================
     st.success("💧 智能配注方案已生成 (基于当前地层压力)")
 
+    plan = context.get('water_plan')
+    if plan is not None and context.get('df') is not None:
+        # 目标总配注量：默认取指令指定值或建议配注合计，修改后按新的总量约束重新求解
+        budget = st.number_input("目标总配注量 (m³)", min_value=0.0, value=float(plan['requested']), step=10.0,
+                                 key=f"water_budget_{context.get('workflow_id', '')}")
+        if abs(budget - plan['requested']) > 1e-6:
+            context['water_budget'] = budget
+            _solve_into(context, context['df'], budget, "手动调整")
+            plan = context['water_plan']
+    if plan is not None:
+        col1, col2, col3 = st.columns(3)
+        col1.metric("涉及调整井数", f"{plan['wells']} 口",
+                    delta=f"{plan['pressure_limited']} 口受压力约束" if plan['pressure_limited'] else None, delta_color="off")
+        col2.metric("总配注量", f"{plan['total']:.1f} m³",
+                    delta=(f"{plan['total'] - plan['requested']:+.1f} m³ 较目标" if not plan['feasible']
+                           else f"目标 {plan['requested']:.1f} m³ ({plan.get('budget_source', '建议配注合计')})"),
+                    delta_color="normal" if not plan['feasible'] else "off")
+        col3.metric("最大增压", f"{plan['max_pressure']:.2f} MPa", delta=f"上限 {plan['pressure_limit']:g} MPa",
+                    delta_color="off")
+        st.caption(f"参数版本 {plan['model_version']} | 对偶求根迭代 {plan['iterations']} 次，求解耗时 {plan['elapsed_ms']:.1f} ms"
+                   f"{' (上月方案热启动)' if plan['warm_start'] else ''}")
+        df = plan['plan']
+        table = df.head(render_cache.MAX_TABLE_ROWS)
+        try:
+            render_cache.styled_table(
+                "tool_water_algo", {"df": df, "target_col": "调整量"},
+                lambda: table.style.background_gradient(subset=["调整量"], cmap='RdBu').format(precision=2)
+            )
+        except Exception:
+            st.dataframe(df, use_container_width=True)
+        if len(df) > len(table):
+            st.caption(f"仅展示前 {len(table):,} 行 (共 {len(df):,} 行)")
+        return
+
     if 'df' in context:
         df = context['df']
 
         # 自动适配列名
-        if '调整量' in df.columns:
-            target_col = '调整量'
-            metric_label = "总增注量"
-        elif '建议配注' in df.columns:
-            target_col = '建议配注'
-            metric_label = "总建议配注量"
-        else:
-            target_col = None
-            metric_label = "数值统计"
+        target_col, metric_label = _target_col(df)
+
+        # 流式模式下 df 只是前 1000 行预览，井数与合计取全量分块聚合结果
+        stream_stats = context.get('stream_stats')
+        well_count = stream_stats['well_count'] if stream_stats else len(df)
 
         # 统计指标展示
         col1, col2 = st.columns(2)
         with col1:
-            st.metric("涉及调整井数", f"{len(df)} 口", delta="优化覆盖率 100%")
+            st.metric("涉及调整井数", f"{well_count} 口", delta="优化覆盖率 100%")
 
         with col2:
             if target_col:
-                total = df[target_col].sum()
+                total = stream_stats['total'] if stream_stats else df[target_col].sum()
                 st.metric(metric_label, f"{total:.1f} m³", delta_color="normal")
             else:
                 st.metric("数据状态", "无有效数值列")
 
-        # 数据表格展示 (带热力图)
+        # 数据表格展示 (带热力图，样式化结果以 HTML 缓存，刷新时直接回放)
         if target_col:
+            table = df.head(render_cache.MAX_TABLE_ROWS)
             try:
-                st.dataframe(
-                    df.style.background_gradient(subset=[target_col], cmap='Blues'),
-                    use_container_width=True
+                render_cache.styled_table(
+                    "tool_water_algo", {"df": df, "target_col": target_col},
+                    lambda: table.style.background_gradient(subset=[target_col], cmap='Blues')
                 )
             except Exception:
                 st.dataframe(df, use_container_width=True)
+            if len(df) > len(table):
+                st.caption(f"仅展示前 {len(table):,} 行 (共 {len(df):,} 行)")
         else:
-            st.dataframe(df, use_container_width=True)
-
-        # 更新摘要
-        total_vol = df[target_col].sum() if target_col else 0
-        context[
-            'water_summary'] = f"针对 {len(df)} 口井生成了 DQN 优化方案，{metric_label}合计 {total_vol:.1f} m³，预计提升水驱效率 2.3%。"
\ No newline at end of file
+            st.dataframe(df, use_container_width=True)
\ No newline at end of file